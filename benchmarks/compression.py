@@ -0,0 +1,56 @@
+'''
+Benchmark de compresión: coste de CPU frente a bytes ahorrados para un GET /users/ sin paginar.
+
+Uso:
+    python -m benchmarks.compression [num_usuarios] [repeticiones]
+'''
+import json
+import sys
+import time
+
+from middleware.compression import GzipCompressor, BrotliCompressor, ZstdCompressor, brotli, zstandard
+
+
+LEVELS = {
+    'gzip': (GzipCompressor, [1, 6, 9]),
+    'br': (BrotliCompressor, [1, 4, 6, 11]),
+    'zstd': (ZstdCompressor, [1, 3, 9, 19]),
+}
+
+
+def build_payload(num_users:int) -> bytes:
+    '''Genera un JSON con la misma forma que la respuesta de GET /users/'''
+    users = [
+        {
+            'first_name': f'Nombre{i % 500}', 'last_name': f'Apellido{i % 700}', 'username': f'user_{i}',
+            'email': f'user_{i}@correo.com' if i % 3 else None, 'age': 18 + i % 70, 'id': i
+        }
+        for i in range(1, num_users + 1)
+    ]
+    return json.dumps(users).encode()
+
+
+def run(num_users:int = 20_000, repeat:int = 3):
+    payload = build_payload(num_users)
+    print(f'Payload: {num_users} usuarios, {len(payload) / 1024:.0f} KiB sin comprimir\n')
+    print(f'{"codificación":<12} {"nivel":>5} {"tamaño KiB":>11} {"ratio":>7} {"ms":>8} {"MiB/s":>8}')
+
+    for name, (compressor_class, levels) in LEVELS.items():
+        if (name == 'br' and brotli is None) or (name == 'zstd' and zstandard is None):
+            print(f'{name:<12} (librería no instalada)')
+            continue
+
+        for level in levels:
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                compressor = compressor_class(level)
+                compressed = compressor.compress(payload) + compressor.finish()
+                best = min(best, time.perf_counter() - start)
+
+            print(f'{name:<12} {level:>5} {len(compressed) / 1024:>11.1f} {len(payload) / len(compressed):>7.1f} '
+                  f'{best * 1000:>8.1f} {len(payload) / best / 2**20:>8.1f}')
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,85 @@
+'''
+Benchmark del tiempo que cada ruta tiene ocupada una conexión del pool (desde que la saca hasta que la devuelve),
+con la aplicación completa (middlewares, get_db, serialización) sobre una BD SQLite temporal con datos de seed.
+
+Mide con los eventos checkout / checkin del pool, no con las métricas de db, así sirve también para comparar
+con versiones anteriores de get_db. Las peticiones son secuenciales: cada intervalo es de la ruta en curso.
+
+Uso:
+    python -m benchmarks.connection_hold [peticiones_por_ruta] [num_usuarios]
+'''
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def run(requests_per_route:int = 500, num_users:int = 2000):
+    tmp = tempfile.TemporaryDirectory()
+    # Antes de importar db: la aplicación usa esta BD
+    os.environ['DB_URL_J'] = f'sqlite:///{Path(tmp.name) / "bench.db"}'
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    import db
+    from main import app
+    from models.base import Base
+    from seed import seed
+
+    Base.metadata.create_all(db.engine)
+    seed(db.engine, num_users, max_notes=20)
+
+    holds:list[float] = []
+
+    @event.listens_for(db.engine, 'checkout')
+    def checkout(dbapi_connection, record, proxy):
+        record.info['checked_out'] = time.perf_counter()
+
+    @event.listens_for(db.engine, 'checkin')
+    def checkin(dbapi_connection, record):
+        start = record.info.pop('checked_out', None)
+        if start is not None:
+            holds.append(time.perf_counter() - start)
+
+    client = TestClient(app)
+    counter = iter(range(10**9))
+    routes = {
+        'GET /users/?limit=100': lambda i: client.get('/users/', params={'limit': 100, 'after': i % num_users}),
+        'GET /users/{id}': lambda i: client.get(f'/users/{1 + i % num_users}'),
+        'GET /users/by-username/{username}': lambda i: client.get('/users/by-username/nadie'),
+        'GET /users/{id}/notes': lambda i: client.get(f'/users/{1 + i % num_users}/notes'),
+        'POST /users/': lambda i: client.post('/users/', json={
+            'first_name': 'Pepe', 'last_name': 'Ruiz', 'username': f'hold_{next(counter)}', 'age': 30,
+            'password': '12345678'}),
+        'PATCH /users/{id}': lambda i: client.patch(f'/users/{1 + i % num_users}', json={'age': 18 + i % 60}),
+    }
+
+    print(f'{requests_per_route} peticiones por ruta, {num_users} usuarios\n')
+    print(f'{"ruta":<36} {"conexiones/pet.":>15} {"media ms":>9} {"p95 ms":>8} {"total pet. ms":>14}')
+    try:
+        for name, call in routes.items():
+            holds.clear()
+            per_request = []
+            start = time.perf_counter()
+            for i in range(requests_per_route):
+                before = len(holds)
+                response = call(i)
+                assert response.status_code < 500, response.text
+                per_request.append(sum(holds[before:]))
+            elapsed = time.perf_counter() - start
+
+            print(f'{name:<36} {len(holds) / requests_per_route:>15.2f} '
+                  f'{statistics.mean(per_request) * 1000:>9.3f} '
+                  f'{statistics.quantiles(per_request, n=20)[18] * 1000:>8.3f} '
+                  f'{elapsed / requests_per_route * 1000:>14.3f}')
+    finally:
+        db.engine.dispose()
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    run(int(args[0]) if len(args) > 0 else 500, int(args[1]) if len(args) > 1 else 2000)
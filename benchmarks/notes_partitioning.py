@@ -0,0 +1,133 @@
+'''
+Benchmark de la tabla notes particionada por meses (partitions.py) frente a sin particionar, solo Postgres:
+- carga masiva: INSERT ... SELECT generate_series con created_at repartido en los últimos `meses` meses
+- inserción: latencia de INSERT de una nota (transacción propia, como POST de una nota)
+- notas recientes: latencia de la consulta de crud.user.get_user_notes (últimos 7 días de un usuario, 20 filas)
+  y particiones que recorre el plan
+
+Cada variante se crea en su propio esquema (bench_plain / bench_partitioned) con las mismas columnas e índice
+que models.note, sin foreign key ni triggers para medir solo la tabla. Los esquemas se borran al terminar.
+Con 100M de notas la carga tarda del orden de una hora y ocupa ~15 GB por variante: por defecto se usa 1M.
+
+Uso:
+    python -m benchmarks.notes_partitioning url_bd [num_notas] [consultas] [meses]
+'''
+import random
+import re
+import statistics
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import create_engine
+
+from partitions import add_months, create_partitions, month_start
+
+
+NUM_USERS = 100_000
+LOAD_CHUNK = 1_000_000
+
+# Las columnas del CREATE TABLE de models.note en Postgres (tests/maintenance/test_partitions.py lo comprueba)
+COLUMNS = '''
+    id SERIAL NOT NULL,
+    title VARCHAR(20) NOT NULL,
+    description VARCHAR(150) NOT NULL,
+    user_id INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL
+'''
+
+VARIANTS = {
+    'plain': f'CREATE TABLE notes ({COLUMNS}, PRIMARY KEY (id))',
+    'partitioned': f'CREATE TABLE notes ({COLUMNS}, PRIMARY KEY (id, created_at)) PARTITION BY RANGE (created_at)',
+}
+
+RECENT = '''
+    SELECT id, title, description, user_id, created_at, updated_at FROM notes
+    WHERE user_id = %(user_id)s AND created_at >= now() - interval '7 days' AND created_at < now()
+    ORDER BY created_at DESC, id DESC LIMIT 20
+'''
+
+INSERT = "INSERT INTO notes (title, description, user_id) VALUES ('Nota', 'Nota de prueba', %(user_id)s)"
+
+
+def percentiles(samples:list[float]) -> str:
+    q = statistics.quantiles(samples, n=100)
+    return f'{q[49] * 1000:>8.2f} {q[94] * 1000:>8.2f} {q[98] * 1000:>8.2f}'
+
+
+def timed(connection, statement:str, queries:int) -> list[float]:
+    samples = []
+    for _ in range(queries):
+        parameters = {'user_id': random.randint(1, NUM_USERS)}
+        start = time.perf_counter()
+        result = connection.exec_driver_sql(statement, parameters)
+        if result.returns_rows:
+            result.all()
+        connection.commit()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run_variant(engine, name:str, num_notes:int, queries:int, months:int):
+    schema = f'bench_{name}'
+    with engine.connect() as connection:
+        connection.exec_driver_sql(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+        connection.exec_driver_sql(f'CREATE SCHEMA {schema}')
+        # Sin cualificar, 'notes' es la tabla del esquema del benchmark (también para partitions.py)
+        connection.exec_driver_sql(f'SET search_path TO {schema}')
+        connection.exec_driver_sql(VARIANTS[name])
+        connection.exec_driver_sql('CREATE INDEX notes_user_id_created_at_idx ON notes (user_id, created_at)')
+        created = create_partitions(connection, start=add_months(month_start(date.today()), -months))
+        connection.commit()
+
+        start = time.perf_counter()
+        for offset in range(0, num_notes, LOAD_CHUNK):
+            connection.exec_driver_sql(
+                f"INSERT INTO notes (title, description, user_id, created_at, updated_at) "
+                f"SELECT 'Nota ' || mod(n, 100), 'Nota de prueba número ' || n, "
+                f"1 + mod(n * 7919, {NUM_USERS}), t, t "
+                f"FROM generate_series(1, {min(LOAD_CHUNK, num_notes - offset)}) n, "
+                f"LATERAL (SELECT now() - random() * interval '{months} months' AS t) r"
+            )
+            connection.commit()
+        load = time.perf_counter() - start
+        connection.exec_driver_sql('ANALYZE notes')
+        connection.commit()
+
+        plan = '\n'.join(connection.exec_driver_sql('EXPLAIN ' + RECENT, {'user_id': 1}).scalars())
+        scanned = len(set(re.findall(r' on (notes_p\d{4}_\d{2})', plan))) or 1
+        connection.commit()
+
+        timed(connection, RECENT, min(queries, 100)) # calentar la caché
+        recent = timed(connection, RECENT, queries)
+        inserts = timed(connection, INSERT, queries)
+
+        print(f'{name:<12} {len(created) or "-":>5} {num_notes / load:>12,.0f} {scanned:>6}  '
+              f'{percentiles(inserts)}  {percentiles(recent)}')
+
+        connection.exec_driver_sql(f'DROP SCHEMA {schema} CASCADE')
+        connection.commit()
+
+
+def run(url:str, num_notes:int = 1_000_000, queries:int = 1000, months:int = 12):
+    engine = create_engine(url)
+    if engine.dialect.name != 'postgresql':
+        sys.exit('El particionado solo existe en Postgres')
+
+    print(f'{num_notes} notas de {NUM_USERS} usuarios en {months} meses, {queries} consultas por medida\n')
+    print(f'{"tabla":<12} {"part.":>5} {"carga fil/s":>12} {"leídas":>6}  '
+          f'{"insert ms p50/p95/p99":>26}  {"recientes ms p50/p95/p99":>26}')
+    try:
+        for name in VARIANTS:
+            run_variant(engine, name, num_notes, queries, months)
+    finally:
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args:
+        sys.exit(__doc__)
+    run(args[0], int(args[1]) if len(args) > 1 else 1_000_000, int(args[2]) if len(args) > 2 else 1000,
+        int(args[3]) if len(args) > 3 else 12)
@@ -0,0 +1,96 @@
+'''
+Benchmark de las lecturas de usuarios en el camino completo de GET /users/ (consulta + JSON):
+- orm: instancias User validadas en UserRead y serializadas (camino anterior)
+- core+validación: filas de Core validadas en UserRead y serializadas
+- core: filas de Core serializadas directamente (camino actual, routers.user._render_users)
+
+Mide filas/s (mejor de `repeticiones`) y el pico de memoria (tracemalloc, en una pasada aparte).
+Por defecto usa una BD SQLite temporal; con una URL se usa esa BD, donde se insertan usuarios
+'bench_*' que se borran al terminar.
+
+Uso:
+    python -m benchmarks.user_reads [num_usuarios] [repeticiones] [url_bd]
+'''
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+from sqlalchemy import create_engine, delete, insert
+from sqlalchemy.orm import Session
+
+import db # noqa: F401 registra char_length y las foreign keys para SQLite
+from crud.user import get_users, get_user_rows
+from models.base import Base
+from models.user import User
+from schemas.user import UserRead
+
+
+PREFIX = 'bench_'
+
+_user_list = TypeAdapter(list[UserRead])
+
+PATHS = {
+    'orm': lambda session: _user_list.dump_json(_user_list.validate_python(get_users(session))),
+    'core+validación': lambda session: _user_list.dump_json(_user_list.validate_python(get_user_rows(session))),
+    'core': lambda session: to_json([dict(row) for row in get_user_rows(session)]),
+}
+
+
+def fill(engine, num_users:int, chunk_size:int = 10_000):
+    with Session(engine) as session, session.begin():
+        for start in range(0, num_users, chunk_size):
+            session.execute(insert(User), [
+                {'first_name': f'Nombre{i % 500}', 'last_name': f'Apellido{i % 700}', 'username': f'{PREFIX}{i}',
+                 'email': f'user_{i}@correo.com' if i % 3 else None, 'age': 18 + i % 70, 'password': '12345678'}
+                for i in range(start, min(start + chunk_size, num_users))
+            ])
+
+
+def render(engine, path) -> int:
+    '''Lo que hace GET /users/ al no estar en caché. Devuelve los bytes generados'''
+    with Session(engine) as session:
+        return len(path(session))
+
+
+def run(num_users:int = 100_000, repeat:int = 3, url:str | None = None):
+    tmp = None
+    if url is None:
+        tmp = tempfile.TemporaryDirectory()
+        url = f'sqlite:///{Path(tmp.name) / "bench.db"}'
+
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    try:
+        fill(engine, num_users)
+        print(f'{num_users} usuarios en {engine.dialect.name}\n')
+        print(f'{"camino":<16} {"ms":>9} {"filas/s":>11} {"pico MiB":>9}')
+
+        for name, path in PATHS.items():
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                render(engine, path)
+                best = min(best, time.perf_counter() - start)
+
+            tracemalloc.start()
+            render(engine, path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            print(f'{name:<16} {best * 1000:>9.1f} {num_users / best:>11,.0f} {peak / 2**20:>9.1f}')
+    finally:
+        with Session(engine) as session, session.begin():
+            session.execute(delete(User).where(User.username.startswith(PREFIX)))
+        engine.dispose()
+        if tmp is not None:
+            tmp.cleanup()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    run(int(args[0]) if len(args) > 0 else 100_000, int(args[1]) if len(args) > 1 else 3,
+        args[2] if len(args) > 2 else None)
@@ -0,0 +1,90 @@
+'''
+Benchmark de la comprobación de disponibilidad de usernames (username_filter.py) sobre una BD SQLite temporal
+con datos de seed:
+- construcción del filtro (recorrido por lotes) y su memoria, nº de hashes y tasa de falsos positivos teórica
+- tasa real de falsos positivos con usernames que no existen (parecidos a los de seed: nombre + hexadecimal)
+- latencia de is_taken con filtro frente a consultar siempre el índice (crud.user.username_exists),
+  para usernames libres (el caso de cada pulsación) y ocupados, y conexiones del pool que usa cada uno
+
+Uso:
+    python -m benchmarks.username_availability [num_usuarios] [consultas] [tasa_fp]
+'''
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def run(num_users:int = 200_000, queries:int = 20_000, fp_rate:float = 0.01):
+    tmp = tempfile.TemporaryDirectory()
+    # Antes de importar db: la aplicación usa esta BD
+    os.environ['DB_URL_J'] = f'sqlite:///{Path(tmp.name) / "bench.db"}'
+
+    from sqlalchemy import event, select
+    from sqlalchemy.orm import Session
+
+    import db
+    from crud.user import username_exists
+    from models.base import Base
+    from models.user import User
+    from seed import seed
+    from username_filter import UsernameFilter
+
+    Base.metadata.create_all(db.engine)
+    seed(db.engine, num_users, max_notes=0)
+    with Session(db.engine) as session:
+        taken = session.scalars(select(User.username)).all()
+
+    checkouts = []
+    event.listen(db.engine, 'checkout', lambda *args: checkouts.append(1))
+
+    # Sin log de cambios: un solo proceso, el filtro siempre se considera al día
+    username_filter = UsernameFilter([db.engine], fp_rate, sync_interval=0, rebuild_interval=0)
+    start = time.perf_counter()
+    username_filter.rebuild()
+    build = time.perf_counter() - start
+    bloom = username_filter._filter
+
+    rng = random.Random(1)
+    free = [f'{rng.choice(["pepe", "maria", "lucia", "javier"])}_{rng.getrandbits(40):x}' for _ in range(queries)]
+    false_positives = sum(name.casefold().encode() in bloom for name in free)
+
+    print(f'{num_users} usuarios, {queries} consultas, tasa objetivo {fp_rate:.2%}\n')
+    print(f'construcción      {build:.2f} s ({num_users / build:,.0f} usernames/s)')
+    print(f'memoria           {bloom.memory_bytes / 2**20:.2f} MiB ({bloom.num_bits / bloom.items:.1f} bits/username, '
+          f'capacidad {bloom.capacity})')
+    print(f'hashes            {bloom.num_hashes}')
+    print(f'fp teórica        {bloom.estimated_fp_rate:.3%}')
+    print(f'fp medida         {false_positives / queries:.3%} ({false_positives} de {queries})\n')
+
+    def timed(check, names:list[str]) -> tuple[list[float], int]:
+        samples = []
+        checkouts.clear()
+        with Session(db.engine) as session:
+            for name in names:
+                start = time.perf_counter()
+                check(session, name)
+                samples.append(time.perf_counter() - start)
+        return samples, len(checkouts)
+
+    print(f'{"consulta":<26} {"p50 µs":>8} {"p95 µs":>8} {"conexiones":>11}')
+    variants = (('libre, filtro', username_filter.is_taken, free), ('libre, índice', username_exists, free),
+                ('ocupado, filtro', username_filter.is_taken, rng.sample(taken, min(queries, len(taken)))),
+                ('ocupado, índice', username_exists, rng.sample(taken, min(queries, len(taken)))))
+    try:
+        for name, check, names in variants:
+            samples, connections = timed(check, names)
+            q = statistics.quantiles(samples, n=20)
+            print(f'{name:<26} {statistics.median(samples) * 1e6:>8.1f} {q[18] * 1e6:>8.1f} {connections:>11}')
+    finally:
+        db.engine.dispose()
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    run(int(args[0]) if len(args) > 0 else 200_000, int(args[1]) if len(args) > 1 else 20_000,
+        float(args[2]) if len(args) > 2 else 0.01)
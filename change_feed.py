@@ -0,0 +1,130 @@
+'''
+Cambios confirmados por otros procesos de la API (los workers de serve.py, otras máquinas).
+
+crud.change.on_changes_committed solo ve las transacciones de este proceso: con varios procesos, la caché de
+respuestas, los contadores de filas y los eventos SSE / WebSocket de cada uno no se enterarían de las escrituras
+de los demás. Con config.CHANGE_FEED_INTERVAL > 0 (por defecto si SERVE_WORKERS_J > 1) un hilo lee el log de
+cambios desde el último leído cada tantos segundos y los reparte en este proceso:
+
+- on_changes(func): los cambios de este proceso al confirmarse y los de los demás (Change.process) al leerlos.
+  El orden entre unos y otros no está garantizado: vale para invalidar cachés o sumar contadores.
+- on_changes(func, in_order=True): todos los cambios en el orden del log (seq). Con el hilo activo, también los
+  de este proceso llegan al leerlos del log (hasta CHANGE_FEED_INTERVAL segundos después). Es lo que necesitan
+  los eventos: un cliente que reconecta con Last-Event-ID no puede haber recibido antes un seq mayor.
+
+Sin el hilo (un solo proceso) las dos formas equivalen a on_changes_committed: cada commit entrega sus cambios
+desde su hilo y dos commits concurrentes pueden llegar en orden de seq inverso. El filtro de usernames lee el
+log por su cuenta (username_filter.UsernameFilter.sync).
+'''
+import logging
+from collections.abc import Callable
+from threading import Event, Thread
+
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+
+import config
+from crud.change import get_changes, get_last_change_seq, on_changes_committed, process_id
+from db import engine
+from metrics import Counter
+
+
+RECEIVED = Counter('journal_change_feed_received_total', 'Cambios de otros procesos leídos del log')
+
+# Cambios leídos por consulta al log
+_BATCH = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    '''Lectura periódica del log de cambios (en el shard principal) en un hilo'''
+
+    def __init__(self, bind:Engine, interval:float):
+        self.bind = bind
+        self.interval = interval
+        self._remote:list[Callable[[list[dict]], None]] = []
+        self._ordered:list[Callable[[list[dict]], None]] = []
+        self._seq:int | None = None # último cambio del log ya repartido
+        self._stop = Event()
+        self._thread:Thread | None = None
+
+    def subscribe(self, func:Callable[[list[dict]], None], in_order:bool = False):
+        if in_order and self.interval > 0:
+            self._ordered.append(func)
+        else:
+            on_changes_committed(func)
+            self._remote.append(func)
+        return func
+
+    def poll(self):
+        '''Reparte los cambios del log posteriores al cursor. La primera vez solo fija el cursor'''
+        with Session(self.bind) as session:
+            if self._seq is None:
+                self._seq = get_last_change_seq(session)
+                return
+            while True:
+                changes = get_changes(session, self._seq, _BATCH)
+                if changes:
+                    self._deliver(changes)
+                    self._seq = changes[-1].seq
+                if len(changes) < _BATCH:
+                    break
+
+    def _deliver(self, changes:list):
+        current = process_id()
+        everything, remote = [], []
+        for change in changes:
+            values = {'seq': change.seq, 'entity': change.entity, 'entity_id': change.entity_id, 'op': change.op,
+                      'data': change.data, 'changed_at': change.changed_at}
+            everything.append(values)
+            if change.process != current:
+                remote.append(values)
+
+        RECEIVED.inc(len(remote))
+        for hooks, batch in ((self._ordered, everything), (self._remote, remote)):
+            if not batch:
+                continue
+            for hook in hooks:
+                try:
+                    hook(batch)
+                except Exception:
+                    logger.exception('Error repartiendo cambios del log a %s', getattr(hook, '__qualname__', hook))
+
+    def start(self):
+        '''
+        Fija el cursor antes de atender peticiones: los cambios que confirme este proceso desde ahora llegan a los
+        suscritos con in_order. Si la BD no responde, lo reintenta el hilo
+        '''
+        if self.interval <= 0 or self._thread is not None:
+            return
+        try:
+            self.poll()
+        except Exception:
+            logger.exception('Error leyendo el log de cambios')
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='change-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                # p.ej. la BD no responde: se sigue desde el mismo cursor en la siguiente vuelta
+                logger.exception('Error leyendo el log de cambios')
+
+
+feed = ChangeFeed(engine, config.CHANGE_FEED_INTERVAL)
+
+
+def on_changes(func:Callable[[list[dict]], None], in_order:bool = False):
+    '''Registra `func` para recibir los cambios confirmados por cualquier proceso (ver el docstring del módulo)'''
+    return feed.subscribe(func, in_order)
@@ -0,0 +1,217 @@
+'''
+Configuración de la aplicación leída de variables de entorno (.env).
+Todo lo relacionado con capacidad (pool de conexiones, threadpool, límites de
+concurrencia) se deriva de aquí para que los valores no puedan desincronizarse.
+'''
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+
+def _int_env(name:str, default:int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _float_env(name:str, default:float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, '') else default
+
+
+# --- Pool de conexiones ---
+# Procesos de la API que comparten la BD (los que arranca serve.py; con otro servidor, indicar cuántos)
+SERVE_WORKERS = max(_int_env('SERVE_WORKERS_J', 1), 1)
+# Conexiones máximas con cada BD entre todos los procesos (max_connections de Postgres menos un margen para
+# otros clientes). Si se indica, cada proceso se queda con su parte, sin overflow, en lugar de usar
+# DB_POOL_SIZE_J + DB_MAX_OVERFLOW_J; todo lo que se deriva del pool se dimensiona con esa parte
+DB_CONNECTION_BUDGET = _int_env('DB_CONNECTION_BUDGET_J', 0)
+DB_POOL_SIZE = DB_CONNECTION_BUDGET // SERVE_WORKERS if DB_CONNECTION_BUDGET else _int_env('DB_POOL_SIZE_J', 10)
+DB_MAX_OVERFLOW = 0 if DB_CONNECTION_BUDGET else _int_env('DB_MAX_OVERFLOW_J', 0)
+DB_POOL_TIMEOUT = _float_env('DB_POOL_TIMEOUT_J', 10)
+
+# Sharding horizontal (opcional): URLs de los shards separadas por comas. Cada shard tiene su propio pool
+# del tamaño anterior. Vacío = una sola BD (DB_URL_J / variables de Postgres)
+DB_SHARD_URLS = [url.strip() for url in os.getenv('DB_SHARD_URLS_J', '').split(',') if url.strip()]
+
+# Número máximo de conexiones que puede llegar a abrir el proceso (por BD)
+DB_MAX_CONNECTIONS = DB_POOL_SIZE + DB_MAX_OVERFLOW
+
+
+# --- Purga de usuarios dados de baja (purge.py) ---
+# Segundos entre pasadas del worker de purga (0 = sin worker; se puede lanzar con `python -m maintenance purge-users`)
+PURGE_INTERVAL = _float_env('PURGE_INTERVAL_J', 60)
+# Filas borradas por lote (una transacción corta por lote) y pausa entre lotes (segundos)
+PURGE_BATCH_SIZE = _int_env('PURGE_BATCH_SIZE_J', 1000)
+PURGE_PAUSE = _float_env('PURGE_PAUSE_J', 0.1)
+# statement_timeout de cada lote y duración máxima de una pasada (segundos)
+PURGE_BATCH_TIMEOUT = _float_env('PURGE_BATCH_TIMEOUT_J', 5)
+PURGE_MAX_SECONDS = _float_env('PURGE_MAX_SECONDS_J', 30)
+# El worker usa una conexión mientras purga
+PURGE_CONNECTIONS = 1 if PURGE_INTERVAL > 0 else 0
+
+
+# --- Disponibilidad de usernames (GET /users/availability, username_filter.py) ---
+# Tasa de falsos positivos para la que se dimensiona el filtro de Bloom de cada proceso (0 = sin filtro:
+# todas las consultas van al índice)
+USERNAME_FILTER_FP_RATE = _float_env('USERNAME_FILTER_FP_RATE_J', 0.01)
+# Segundos entre lecturas del log de cambios (altas y renombrados de otros procesos; 0 = no se lee, solo
+# con un proceso) y entre reconstrucciones (descarta bajas y renombrados, recoge importaciones; 0 = nunca)
+USERNAME_FILTER_SYNC_INTERVAL = _float_env('USERNAME_FILTER_SYNC_INTERVAL_J', 1)
+USERNAME_FILTER_REBUILD_INTERVAL = _float_env('USERNAME_FILTER_REBUILD_INTERVAL_J', 3600)
+# Filas por lote del recorrido que construye el filtro (una transacción corta por lote)
+USERNAME_FILTER_SCAN_BATCH = _int_env('USERNAME_FILTER_SCAN_BATCH_J', 10_000)
+# El worker del filtro usa una conexión mientras construye o sincroniza
+USERNAME_FILTER_CONNECTIONS = 1 if USERNAME_FILTER_FP_RATE > 0 else 0
+
+
+# --- Cambios confirmados por otros procesos (change_feed.py) ---
+# Segundos entre lecturas del log de cambios para llevar a este proceso los de los demás (caché de respuestas,
+# contadores de filas, eventos SSE / WebSocket). 0 = no se lee: solo es correcto con un único proceso
+CHANGE_FEED_INTERVAL = _float_env('CHANGE_FEED_INTERVAL_J', 0.5 if SERVE_WORKERS > 1 else 0)
+# El hilo que lo lee usa una conexión mientras lee
+CHANGE_FEED_CONNECTIONS = 1 if CHANGE_FEED_INTERVAL > 0 else 0
+
+
+# --- Trabajos en segundo plano ---
+# Cada worker puede tener una conexión ocupada, así que se descuentan de las disponibles para peticiones
+JOB_WORKERS = min(max(_int_env('JOB_WORKERS_J', 2), 1),
+                  DB_MAX_CONNECTIONS - 1 - PURGE_CONNECTIONS - USERNAME_FILTER_CONNECTIONS - CHANGE_FEED_CONNECTIONS)
+# Carpeta de ficheros de los trabajos (ficheros subidos para importar y resultados de exportaciones)
+JOBS_DIR = os.getenv('JOBS_DIR_J', 'job_files')
+# Cada cuántos segundos como mucho se guarda el progreso de un trabajo en BD
+JOB_PROGRESS_INTERVAL = _float_env('JOB_PROGRESS_INTERVAL_J', 1)
+# Cada proceso renueva cada estos segundos el heartbeat de los trabajos que ejecuta (una transacción corta)
+JOB_HEARTBEAT_INTERVAL = _float_env('JOB_HEARTBEAT_INTERVAL_J', 10)
+# Un trabajo en running sin heartbeat desde hace más de estos segundos se da por huérfano y vuelve a la cola
+JOB_HEARTBEAT_TIMEOUT = _float_env('JOB_HEARTBEAT_TIMEOUT_J', 60)
+
+# Conexiones que quedan para atender peticiones
+DB_REQUEST_CONNECTIONS = (DB_MAX_CONNECTIONS - JOB_WORKERS - PURGE_CONNECTIONS - USERNAME_FILTER_CONNECTIONS
+                          - CHANGE_FEED_CONNECTIONS)
+
+
+# --- Control de admisión ---
+# Peticiones de escritura que pueden estar usando el pool a la vez. El resto del pool queda para lecturas,
+# así la suma de ambos límites nunca supera el número de conexiones disponibles
+LIMIT_WRITES = min(max(_int_env('LIMIT_WRITES_J', DB_REQUEST_CONNECTIONS // 4), 1), DB_REQUEST_CONNECTIONS)
+LIMIT_READS = max(DB_REQUEST_CONNECTIONS - LIMIT_WRITES, 1)
+
+# Peticiones que pueden esperar turno (por clase). Si la cola está llena se responde 503 directamente
+QUEUE_SIZE_READS = _int_env('QUEUE_SIZE_READS_J', LIMIT_READS * 2)
+QUEUE_SIZE_WRITES = _int_env('QUEUE_SIZE_WRITES_J', LIMIT_WRITES * 2)
+
+# Segundos máximos que una petición espera en cola antes de ser rechazada
+QUEUE_TIMEOUT = _float_env('QUEUE_TIMEOUT_J', DB_POOL_TIMEOUT / 2)
+
+# Valor de la cabecera Retry-After en las respuestas 503
+RETRY_AFTER = _int_env('RETRY_AFTER_J', 1)
+
+
+# --- Threadpool de anyio ---
+# Los endpoints síncronos se ejecutan en el threadpool (los trabajos tienen sus propios hilos). Con un hilo
+# por conexión (más un margen para rutas que no tocan la BD) ningún hilo se queda bloqueado esperando
+# una conexión del pool
+THREADPOOL_SIZE = DB_REQUEST_CONNECTIONS + _int_env('THREADPOOL_EXTRA_J', 4)
+
+
+# --- serve.py: varios procesos ---
+# Peticiones tras las que un proceso se recicla (termina ordenadamente y se arranca otro; 0 = nunca) y margen
+# aleatorio que se suma a cada uno para que no se reciclen todos a la vez
+SERVE_MAX_REQUESTS = _int_env('SERVE_MAX_REQUESTS_J', 0)
+SERVE_MAX_REQUESTS_JITTER = _int_env('SERVE_MAX_REQUESTS_JITTER_J', SERVE_MAX_REQUESTS // 10)
+# Segundos que un proceso que para espera a que terminen las peticiones en curso
+SERVE_GRACEFUL_TIMEOUT = _float_env('SERVE_GRACEFUL_TIMEOUT_J', 30)
+
+
+# --- Compresión de respuestas ---
+# Por debajo de este tamaño (bytes) no compensa comprimir
+COMPRESSION_MIN_SIZE = _int_env('COMPRESSION_MIN_SIZE_J', 1024)
+GZIP_LEVEL = _int_env('GZIP_LEVEL_J', 6)          # 1-9
+BROTLI_QUALITY = _int_env('BROTLI_QUALITY_J', 4)  # 0-11
+ZSTD_LEVEL = _int_env('ZSTD_LEVEL_J', 3)          # 1-22
+
+
+# --- Importación masiva ---
+# Carpeta donde se dejan los ficheros de filas rechazadas de las importaciones hechas por la API
+IMPORT_ERRORS_DIR = os.getenv('IMPORT_ERRORS_DIR_J', 'import_errors')
+# Tamaño a partir del cual el fichero subido se vuelca de memoria a disco
+IMPORT_SPOOL_SIZE = _int_env('IMPORT_SPOOL_SIZE_J', 8 * 2**20)
+
+
+# --- Idempotency-Key ---
+# Tiempo que se guarda la respuesta asociada a una clave (segundos)
+IDEMPOTENCY_TTL = _int_env('IDEMPOTENCY_TTL_J', 24 * 3600)
+# Entradas de la LRU en memoria (por delante de la tabla idempotency_keys)
+IDEMPOTENCY_CACHE_SIZE = _int_env('IDEMPOTENCY_CACHE_SIZE_J', 10_000)
+# Una clave reservada por una petición que no ha terminado en este tiempo se considera abandonada
+IDEMPOTENCY_LOCK_TIMEOUT = _float_env('IDEMPOTENCY_LOCK_TIMEOUT_J', 60)
+# Tiempo máximo que una petición duplicada espera a que termine la original antes de responder 409
+IDEMPOTENCY_WAIT_TIMEOUT = _float_env('IDEMPOTENCY_WAIT_TIMEOUT_J', 30)
+# Respuestas más grandes no se guardan (bytes)
+IDEMPOTENCY_MAX_BODY = _int_env('IDEMPOTENCY_MAX_BODY_J', 2**20)
+# Cada cuántos segundos se borran de BD las claves caducadas
+IDEMPOTENCY_PURGE_INTERVAL = _float_env('IDEMPOTENCY_PURGE_INTERVAL_J', 600)
+
+
+# --- Notificaciones en tiempo real (SSE / WebSocket) ---
+# Eventos pendientes por conexión; si un cliente lento llena su buffer se le desconecta
+EVENTS_BUFFER_SIZE = _int_env('EVENTS_BUFFER_SIZE_J', 256)
+# Segundos entre comentarios de keep-alive en SSE
+EVENTS_HEARTBEAT = _float_env('EVENTS_HEARTBEAT_J', 15)
+# Cambios máximos que se reenvían al reconectar con Last-Event-ID. Si hay más, tras ellos se envía un evento
+# resync (WebSocket: cierre 1008 'resync') y el cliente sigue desde el último recibido
+EVENTS_REPLAY_LIMIT = _int_env('EVENTS_REPLAY_LIMIT_J', 1000)
+
+
+# --- Caché de respuestas de colecciones ---
+# Segundos que una respuesta cacheada se considera fresca (acota el desfase entre procesos)
+RESPONSE_CACHE_TTL = _float_env('RESPONSE_CACHE_TTL_J', 30)
+# Segundos adicionales durante los que se sirve la versión antigua mientras se recalcula en segundo plano
+RESPONSE_CACHE_STALE_TTL = _float_env('RESPONSE_CACHE_STALE_TTL_J', 300)
+RESPONSE_CACHE_MAX_ENTRIES = _int_env('RESPONSE_CACHE_MAX_ENTRIES_J', 256)
+
+
+# --- X-Total-Count de los listados ---
+# Segundos tras los que el contador en memoria del modo exact se vuelve a calcular con COUNT
+# (acota el desfase por escrituras de otros procesos o que no pasan por crud.user)
+ROW_COUNT_TTL = _float_env('ROW_COUNT_TTL_J', 300)
+
+
+# --- Notas: particionado por meses (partitions.py, solo Postgres) y lecturas por rango de fechas ---
+# 1 = create_all crea la tabla notes particionada por meses de created_at. Una tabla ya existente no cambia:
+# hay que migrarla (crear la particionada, adjuntar o copiar los datos y renombrar)
+NOTES_PARTITIONED = _int_env('NOTES_PARTITIONED_J', 0) == 1
+# Meses futuros con partición ya creada (no hay partición por defecto: sin la del mes, el INSERT falla)
+NOTES_PARTITIONS_AHEAD = _int_env('NOTES_PARTITIONS_AHEAD_J', 3)
+# Meses completos de notas que se conservan; las particiones anteriores se separan de la tabla (0 = todas)
+NOTES_RETENTION_MONTHS = _int_env('NOTES_RETENTION_MONTHS_J', 0)
+# Rango por defecto y máximo (días) de GET /users/{id}/notes: acota cuántas particiones se leen
+NOTES_RECENT_DAYS = _int_env('NOTES_RECENT_DAYS_J', 30)
+NOTES_MAX_WINDOW_DAYS = _int_env('NOTES_MAX_WINDOW_DAYS_J', 366)
+
+
+# --- POST /batch ---
+# Operaciones máximas por lote
+BATCH_MAX_OPERATIONS = _int_env('BATCH_MAX_OPERATIONS_J', 100)
+
+
+# --- Deadlines de las peticiones ---
+# Segundos de presupuesto por defecto de una petición (cola de admisión + consultas). El cliente puede
+# pedir otro con la cabecera X-Request-Timeout, nunca por encima de REQUEST_TIMEOUT_MAX
+REQUEST_TIMEOUT = _float_env('REQUEST_TIMEOUT_J', 10)
+REQUEST_TIMEOUT_MAX = _float_env('REQUEST_TIMEOUT_MAX_J', 60)
+# Las importaciones síncronas (POST /imports) procesan ficheros enteros
+REQUEST_TIMEOUT_IMPORTS = _float_env('REQUEST_TIMEOUT_IMPORTS_J', 600)
+
+
+# --- Profiling por petición ---
+# Perfila 1 de cada N peticiones (0 = nunca). Con 0 y sin secreto el middleware ni se instala
+PROFILE_SAMPLE_RATE = _int_env('PROFILE_SAMPLE_RATE_J', 0)
+# Secreto para firmar la cabecera X-Profile que pide perfilar una petición concreta ('' = desactivado)
+PROFILE_SECRET = os.getenv('PROFILE_SECRET_J', '')
+# Segundos entre muestras de las pilas
+PROFILE_INTERVAL = _float_env('PROFILE_INTERVAL_J', 0.005)
+# Carpeta de los perfiles y cuántos se conservan (los más antiguos se borran)
+PROFILE_DIR = os.getenv('PROFILE_DIR_J', 'profiles')
+PROFILE_MAX_FILES = _int_env('PROFILE_MAX_FILES_J', 100)
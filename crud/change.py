@@ -0,0 +1,187 @@
+import logging
+import os
+import uuid
+from collections.abc import Callable
+from datetime import datetime, timezone
+
+from sqlalchemy import select, insert, delete, func, text, event, and_, or_, Engine
+from sqlalchemy.orm import Session
+
+from db import PRIMARY_SHARD, read_transaction
+from models.change import Change
+
+
+# Clave del advisory lock que serializa la escritura del log de cambios en Postgres
+CHANGES_LOCK_KEY = 31_000_001
+
+# Clave de session.info con los cambios de la transacción en curso
+PENDING_EVENTS = 'pending_change_events'
+
+# Clave de session.info con los shards (distintos del principal) en cuya cola ha escrito la transacción en curso
+PENDING_RELAY = 'pending_change_relay'
+
+# Cambios trasladados por transacción desde la cola de un shard
+_RELAY_BATCH = 500
+
+logger = logging.getLogger(__name__)
+
+# Identifica a este proceso en el log de cambios (Change.process). Un hijo de fork necesita otro
+_process_id = uuid.uuid4().hex[:16]
+
+
+def process_id() -> str:
+    return _process_id
+
+
+def _new_process_id():
+    global _process_id
+    _process_id = uuid.uuid4().hex[:16]
+
+
+os.register_at_fork(after_in_child=_new_process_id)
+
+# Funciones a las que se pasan los cambios de cada transacción confirmada (notificaciones, cachés...)
+_commit_hooks:list[Callable[[list[dict]], None]] = []
+
+
+def on_changes_committed(func:Callable[[list[dict]], None]):
+    '''Decorador que registra `func` para recibir los cambios de cada transacción confirmada'''
+    _commit_hooks.append(func)
+    return func
+
+
+def record_change(session:Session, entity:str, entity_id:int, op:str, data:dict | None = None,
+                  shard_id:str | None = None):
+    '''
+    Añade un cambio al log dentro de la transacción en curso (se confirma o se descarta con ella).
+    Debe llamarse al final de la transacción: en Postgres se toma un advisory lock hasta el commit para que
+    el orden de los `seq` coincida con el orden de commit y un lector nunca se salte un cambio aún no confirmado.
+    El cambio queda además pendiente en la sesión para notificarse (SSE / WebSocket) tras el commit.
+
+    Con sharding (db.py) el log está en el shard principal y `shard_id` es el shard de la fila cambiada. Si es
+    otro, escribir en los dos serían dos commits independientes: si el segundo falla queda un cambio sin
+    registrar o uno que no ha ocurrido. El cambio se escribe entonces en la cola (tabla changes) del shard de
+    la fila, en su misma transacción, y tras el commit relay_changes lo pasa al log principal, donde recibe
+    su `seq` y se notifica. Si ese traslado falla lo reintenta el worker de purge.py: el cambio llega tarde,
+    pero llega una sola vez y en el orden de su shard
+    '''
+    if shard_id is not None and shard_id != PRIMARY_SHARD:
+        bind_arguments = {'shard_id': shard_id}
+        if session.get_bind(shard_id=shard_id).dialect.name == 'postgresql':
+            session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': CHANGES_LOCK_KEY},
+                            bind_arguments=bind_arguments)
+        session.execute(insert(Change).values(entity=entity, entity_id=entity_id, op=op, data=data,
+                                              changed_at=datetime.now(timezone.utc)),
+                        bind_arguments=bind_arguments)
+        session.info.setdefault(PENDING_RELAY, set()).add(shard_id)
+        return
+
+    _lock_log(session)
+    _append(session, {'entity': entity, 'entity_id': entity_id, 'op': op, 'data': data,
+                      'changed_at': datetime.now(timezone.utc)})
+
+
+def record_changes(session:Session, entity:str, op:str, items:list[tuple[int, dict | None]]):
+    '''
+    Como record_change para muchas filas del shard principal a la vez (importaciones masivas): un único
+    INSERT de varias filas en lugar de uno por cambio. `items` son pares (entity_id, data)
+    '''
+    if not items:
+        return
+    _lock_log(session)
+    changed_at = datetime.now(timezone.utc)
+    values = [{'entity': entity, 'entity_id': entity_id, 'op': op, 'data': data, 'changed_at': changed_at}
+              for entity_id, data in items]
+    seqs = session.scalars(insert(Change).returning(Change.seq, sort_by_parameter_order=True),
+                           [{**row, 'process': _process_id} for row in values]).all()
+    session.info.setdefault(PENDING_EVENTS, []).extend({'seq': seq, **row} for seq, row in zip(seqs, values))
+
+
+def _lock_log(session:Session):
+    # get_bind con el mapper: con sharding (db.py) el log de cambios vive en el shard principal
+    if session.get_bind(Change.__mapper__).dialect.name == 'postgresql':
+        session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': CHANGES_LOCK_KEY})
+
+
+def _append(session:Session, values:dict, source:str | None = None):
+    seq = session.execute(insert(Change).values(**values, source=source, process=_process_id)
+                          .returning(Change.seq)).scalar_one()
+    session.info.setdefault(PENDING_EVENTS, []).append({'seq': seq, **values})
+
+
+def relay_changes(primary:Engine, shard:Engine, shard_id:str, batch:int = _RELAY_BATCH) -> int:
+    '''
+    Pasa al log del shard principal, en orden, los cambios de la cola de otro shard (ver record_change) y los
+    notifica al confirmarse. Cada uno se guarda con su origen (`source`): si el borrado de la cola no llega a
+    confirmarse, el siguiente traslado no lo repite. Devuelve cuántos cambios ha añadido al log
+    '''
+    relayed = 0
+    with Session(shard, expire_on_commit=False) as queue:
+        while True:
+            with queue.begin():
+                pending = queue.scalars(select(Change).order_by(Change.seq).limit(batch)).all()
+            if not pending:
+                return relayed
+
+            sources = {f'{shard_id}:{change.seq}': change for change in pending}
+            with Session(primary) as session, session.begin():
+                _lock_log(session)
+                done = set(session.scalars(select(Change.source).where(Change.source.in_(sources))))
+                for source, change in sources.items():
+                    if source not in done:
+                        _append(session, {'entity': change.entity, 'entity_id': change.entity_id, 'op': change.op,
+                                          'data': change.data, 'changed_at': change.changed_at}, source)
+                        relayed += 1
+
+            with queue.begin():
+                queue.execute(delete(Change).where(Change.seq.in_([change.seq for change in pending])))
+            if len(pending) < batch:
+                return relayed
+
+
+def relay_pending_changes(engines:list[Engine]) -> int:
+    '''Traslada las colas de cambios de todos los shards (el primero es el principal, sin cola)'''
+    return sum(relay_changes(engines[0], bind, str(index)) for index, bind in enumerate(engines[1:], start=1))
+
+
+def get_changes(session:Session, since:int, limit:int, user_id:int | None = None) -> list[Change]:
+    '''
+    Operación CRUD que obtiene, en orden, los cambios posteriores al cursor `since`.
+    Con `user_id` solo los que afectan a ese usuario (el propio usuario o sus notas), filtrados en la consulta:
+    el límite cuenta solo esos
+    '''
+    statement = select(Change).where(Change.seq > since)
+    if user_id is not None:
+        statement = statement.where(or_(
+            and_(Change.entity == 'user', Change.entity_id == user_id),
+            and_(Change.entity == 'note', Change.data['user_id'].as_integer() == user_id),
+        ))
+    with read_transaction(session):
+        return session.scalars(statement.order_by(Change.seq).limit(limit)).all()
+
+
+def get_last_change_seq(session:Session) -> int:
+    '''Operación CRUD que obtiene el `seq` del último cambio (0 si no hay ninguno): cursor para leer los siguientes'''
+    with read_transaction(session):
+        return session.scalar(select(func.coalesce(func.max(Change.seq), 0)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session:Session):
+    changes = session.info.pop(PENDING_EVENTS, None)
+    if changes:
+        for hook in _commit_hooks:
+            hook(changes)
+
+    # La escritura ya está confirmada: un fallo del traslado no la deshace (lo reintenta el worker de purge.py)
+    for shard_id in sorted(session.info.pop(PENDING_RELAY, ())):
+        try:
+            relay_changes(session.get_bind(shard_id=PRIMARY_SHARD), session.get_bind(shard_id=shard_id), shard_id)
+        except Exception:
+            logger.exception('Error trasladando al log principal los cambios del shard %s', shard_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session:Session):
+    session.info.pop(PENDING_EVENTS, None)
+    session.info.pop(PENDING_RELAY, None)
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, update, or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.idempotency import IdempotencyRecord
+
+
+def claim_key(session:Session, client:str, key:str, fingerprint:str, ttl:float,
+              lock_timeout:float) -> IdempotencyRecord | None:
+    '''
+    Reserva la clave para la petición actual insertando un registro "en curso" (status_code NULL).
+    Devuelve None si la reserva se ha conseguido, o el registro existente si otra petición ya la tiene.
+    Una clave caducada o reservada por una petición abandonada (más de lock_timeout segundos) se reutiliza
+    '''
+    now = datetime.now(timezone.utc)
+    values = {'fingerprint': fingerprint, 'status_code': None, 'content_type': None, 'body': None,
+              'created_at': now, 'expires_at': now + timedelta(seconds=ttl)}
+
+    try:
+        with session.begin():
+            session.add(IdempotencyRecord(client=client, key=key, **values))
+        return None
+
+    except IntegrityError:
+        pass
+
+    with session.begin():
+        # UPDATE condicionado: si dos peticiones intentan quedarse la misma clave abandonada, solo una lo consigue
+        taken_over = session.execute(
+            update(IdempotencyRecord)
+            .where(
+                IdempotencyRecord.client == client, IdempotencyRecord.key == key,
+                or_(
+                    IdempotencyRecord.expires_at < now,
+                    and_(IdempotencyRecord.status_code.is_(None),
+                         IdempotencyRecord.created_at < now - timedelta(seconds=lock_timeout))
+                )
+            )
+            .values(**values)
+        ).rowcount
+        if taken_over:
+            return None
+
+        record = session.get(IdempotencyRecord, (client, key), populate_existing=True)
+
+    if record is None: # se borró entre el INSERT y el SELECT (purga de caducadas)
+        return claim_key(session, client, key, fingerprint, ttl, lock_timeout)
+
+    return record
+
+
+def complete_key(session:Session, client:str, key:str, status_code:int, content_type:str | None, body:bytes):
+    '''Operación CRUD que guarda la respuesta final asociada a la clave'''
+    with session.begin():
+        session.execute(
+            update(IdempotencyRecord)
+            .where(IdempotencyRecord.client == client, IdempotencyRecord.key == key)
+            .values(status_code=status_code, content_type=content_type, body=body)
+        )
+
+
+def release_key(session:Session, client:str, key:str):
+    '''Libera una clave reservada cuya petición no ha producido una respuesta reutilizable (p.ej. un 5xx)'''
+    with session.begin():
+        session.execute(
+            delete(IdempotencyRecord)
+            .where(IdempotencyRecord.client == client, IdempotencyRecord.key == key,
+                   IdempotencyRecord.status_code.is_(None))
+        )
+
+
+def purge_expired(session:Session) -> int:
+    '''Operación CRUD que borra las claves caducadas. Devuelve cuántas se han borrado'''
+    with session.begin():
+        return session.execute(
+            delete(IdempotencyRecord).where(IdempotencyRecord.expires_at < datetime.now(timezone.utc))
+        ).rowcount
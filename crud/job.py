@@ -0,0 +1,140 @@
+from collections.abc import Callable
+from datetime import datetime, timezone
+
+from sqlalchemy import select, update, or_
+from sqlalchemy.orm import Session
+
+from db import read_transaction
+from models.job import Job
+
+
+def create_job(session:Session, kind:str, params:dict) -> Job:
+    '''Operación CRUD que registra un trabajo nuevo en estado queued'''
+    job = Job(kind=kind, params=params, status='queued')
+    with session.begin():
+        session.add(job)
+
+    return job
+
+
+def get_job(session:Session, id:int) -> Job | None:
+    '''Operación CRUD que obtiene un trabajo por id. Si no existe, devuelve None'''
+    with read_transaction(session):
+        return session.get(Job, id)
+
+
+def claim_job(session:Session, id:int, owner:str) -> Job | None:
+    '''
+    Pasa el trabajo de queued a running a nombre de `owner`. El UPDATE condicionado garantiza que solo un worker
+    lo reclame; devuelve None si ya no estaba en cola (cancelado, reclamado por otro...)
+    '''
+    now = datetime.now(timezone.utc)
+    with session.begin():
+        claimed = session.execute(
+            update(Job)
+            .where(Job.id == id, Job.status == 'queued')
+            .values(status='running', started_at=now, owner=owner, heartbeat_at=now)
+        ).rowcount
+
+        if not claimed:
+            return None
+
+        return session.get(Job, id, populate_existing=True)
+
+
+def update_progress(session:Session, id:int, owner:str, processed:int, total:int | None = None) -> bool:
+    '''
+    Guarda el progreso del trabajo (y renueva su heartbeat). Devuelve True si se ha pedido cancelarlo o si
+    `owner` ya no lo tiene (se dio por huérfano y se ha devuelto a la cola): debe dejar de ejecutarlo
+    '''
+    values = {'processed': processed, 'heartbeat_at': datetime.now(timezone.utc)}
+    if total is not None:
+        values['total'] = total
+
+    with session.begin():
+        owned = session.execute(update(Job).where(Job.id == id, Job.owner == owner, Job.status == 'running')
+                                .values(**values)).rowcount
+        return not owned or bool(session.scalar(select(Job.cancel_requested).where(Job.id == id)))
+
+
+def heartbeat(session:Session, owner:str) -> list[int]:
+    '''Renueva el heartbeat de los trabajos en ejecución de `owner`. Devuelve sus ids (los que sigue teniendo)'''
+    with session.begin():
+        return list(session.scalars(
+            update(Job).where(Job.owner == owner, Job.status == 'running')
+            .values(heartbeat_at=datetime.now(timezone.utc)).returning(Job.id)
+        ))
+
+
+def save_checkpoint(session:Session, id:int, processed:int):
+    '''
+    Guarda el progreso del trabajo dentro de la transacción en curso: se confirma a la vez que lo procesado
+    (p.ej. un bloque importado), así al retomar tras un reinicio no se repite ni se salta nada
+    '''
+    session.execute(update(Job).where(Job.id == id).values(processed=processed))
+
+
+def finish_job(session:Session, id:int, status:str, *, owner:str | None = None, result:dict | None = None,
+               result_path:str | None = None, error:str | None = None):
+    '''
+    Operación CRUD que marca el trabajo como terminado (o lo devuelve a la cola si status == queued).
+    Con `owner`, solo si aún lo tiene: si se dio por huérfano, su estado ya es de otro proceso
+    '''
+    values = {'status': status, 'result': result, 'result_path': result_path, 'error': error, 'heartbeat_at': None}
+    values['finished_at'] = None if status == 'queued' else datetime.now(timezone.utc)
+    if status == 'queued':
+        values['owner'] = None
+
+    statement = update(Job).where(Job.id == id)
+    if owner is not None:
+        statement = statement.where(Job.owner == owner)
+    with session.begin():
+        session.execute(statement.values(**values))
+
+
+def request_cancel(session:Session, id:int) -> Job | None:
+    '''
+    Operación CRUD que pide cancelar un trabajo. Si aún está en cola se cancela directamente;
+    si está en ejecución se marca para que el worker lo detenga en su siguiente comprobación
+    '''
+    with session.begin():
+        job = session.get(Job, id)
+        if not job:
+            return None
+
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished_at = datetime.now(timezone.utc)
+        elif job.status == 'running':
+            job.cancel_requested = True
+
+    return job
+
+
+def requeue_orphaned(session:Session, owner_dead:Callable[[str], bool], stale_before:datetime) -> list[int]:
+    '''
+    Devuelve a la cola los trabajos en running cuyo proceso ya no existe: `owner_dead(owner)` lo asegura (mismo
+    equipo) o su último heartbeat es anterior a `stale_before`. Los de procesos vivos no se tocan. Los que tenían
+    pedida la cancelación se cancelan. Devuelve los ids de los devueltos a la cola
+    '''
+    with session.begin():
+        owners = session.scalars(select(Job.owner).where(Job.status == 'running', Job.owner.is_not(None))
+                                 .distinct()).all()
+        orphaned = (Job.status == 'running', or_(Job.owner.is_(None), Job.heartbeat_at.is_(None),
+                                                 Job.heartbeat_at < stale_before,
+                                                 Job.owner.in_([owner for owner in owners if owner_dead(owner)])))
+        session.execute(
+            update(Job)
+            .where(*orphaned, Job.cancel_requested)
+            .values(status='cancelled', finished_at=datetime.now(timezone.utc), owner=None, heartbeat_at=None)
+        )
+        return sorted(session.scalars(
+            update(Job).where(*orphaned).values(status='queued', started_at=None, owner=None, heartbeat_at=None)
+            .returning(Job.id)
+        ))
+
+
+def get_queued_ids(session:Session) -> list[int]:
+    '''Operación CRUD que obtiene los ids de los trabajos en cola, por orden de creación'''
+    with read_transaction(session):
+        return list(session.scalars(select(Job.id).where(Job.status == 'queued').order_by(Job.id)).all())
@@ -1,41 +1,215 @@
-from sqlalchemy import select, insert
+import heapq
+import itertools
+from datetime import datetime
+
+from sqlalchemy import select, insert, update, delete, func, text, RowMapping
 from sqlalchemy.orm import Session
-from models.user import User
+from models.user import User, USERNAME_INDEX
+from models.note import Note
+from models.change import Change
 from sqlalchemy.exc import IntegrityError
-from schemas.user import UserCreate, UserUpdate, UserPatch
+from schemas.note import NoteInDb
+from schemas.user import UserCreate, UserUpdate, UserPatch, UserRead
 from exceptions.user_exceptions import UserAlreadyExists
+from crud.change import record_change, record_changes
+from db import (shard_ids, shard_for_user, shard_for_username, allocate_user_id, fan_out, transaction,
+                read_transaction)
+
+
+def _snapshot(user:User) -> dict:
+    '''Datos públicos del usuario que se guardan en el log de cambios'''
+    return {field: getattr(user, field) for field in UserRead.model_fields}
+
+
+def _shard_of(session:Session, user_id:int) -> str | None:
+    '''Shard del usuario, para que su cambio se registre en la misma transacción (None sin sharding)'''
+    shards = shard_ids(session)
+    return shard_for_user(user_id, len(shards)) if shards is not None else None
+
+
+def _is_username_conflict(e:IntegrityError) -> bool:
+    '''
+    True si el error viene del índice único de username. Así da igual idioma, version de librerias, etc.
+    Postgres devuelve el nombre en diag.constraint_name; SQLite solo lo incluye en el mensaje
+    '''
+    constraint = getattr(getattr(e.orig, 'diag', None), 'constraint_name', None)
+    return constraint == USERNAME_INDEX or (constraint is None and USERNAME_INDEX in str(e.orig))
+
+
+# Columnas de UserRead. Las lecturas de solo consulta van por Core con estas columnas: sin instancias ORM,
+# identity map ni instrumentación de atributos, solo filas que se pasan directamente al serializador
+_READ_COLUMNS = tuple(User.__table__.c[field] for field in UserRead.model_fields)
+_NOTE_COLUMNS = tuple(Note.__table__.c[field] for field in NoteInDb.model_fields)
 
 
 def get_users(session:Session) -> list[User]:
-    '''Operación CRUD que obtiene todos los usuarios'''
-    return session.scalars(select(User)).all()
+    '''Operación CRUD que obtiene todos los usuarios (activos)'''
+    with read_transaction(session):
+        return session.scalars(select(User).where(User.is_active)).all()
 
 
 def get_user_by_id(session:Session, id:int) -> User | None:
     '''
     Operación CRUD que obtiene el usuario especificado por el parámetro id.
+    Si no existe en BD o está dado de baja, devuelve None
+    '''
+    with read_transaction(session):
+        user = session.get(User, id)
+    return user if user is not None and user.is_active else None
+
+
+def get_user_rows(session:Session, after:int | None = None, limit:int | None = None) -> list[RowMapping]:
+    '''
+    Operación CRUD de solo lectura que obtiene los datos públicos de los usuarios como filas, ordenados por id.
+    Paginación por clave: `after` es el último id de la página anterior y `limit` el tamaño de página.
+    Con sharding consulta todos los shards en paralelo y mezcla sus resultados ya ordenados (k-way merge):
+    cada shard devuelve como mucho `limit` filas, así que nunca se lee más de limit * nº de shards
+    '''
+    statement = select(*_READ_COLUMNS).where(User.is_active).order_by(User.id)
+    if after is not None:
+        statement = statement.where(User.id > after)
+    if limit is not None:
+        statement = statement.limit(limit)
+
+    if shard_ids(session) is None:
+        with read_transaction(session):
+            return session.execute(statement).mappings().all()
+
+    merged = heapq.merge(*fan_out(session, statement), key=lambda row: row['id'])
+    return list(itertools.islice(merged, limit))
+
+
+def count_users(session:Session) -> int:
+    '''Operación CRUD que cuenta los usuarios (COUNT(*): recorre la tabla entera, con sharding en todos los shards)'''
+    statement = select(func.count().label('total')).select_from(User).where(User.is_active)
+    if shard_ids(session) is None:
+        with read_transaction(session):
+            return session.scalar(statement)
+
+    return sum(rows[0]['total'] for rows in fan_out(session, statement))
+
+
+def count_users_at_seq(session:Session) -> tuple[int, int | None]:
+    '''
+    Operación CRUD que cuenta los usuarios junto con el `seq` del último cambio del log que ve el recuento.
+    Las dos subconsultas van en una misma sentencia y comparten snapshot: un alta o baja con seq mayor no está
+    contada y una con seq menor o igual sí. Con sharding el log no está en la misma BD que los usuarios (y cada
+    shard cuenta con su snapshot): devuelve seq None
+    '''
+    if shard_ids(session) is not None:
+        return count_users(session), None
+
+    statement = select(select(func.count()).select_from(User).where(User.is_active).scalar_subquery(),
+                       select(func.coalesce(func.max(Change.seq), 0)).scalar_subquery())
+    with read_transaction(session):
+        total, seq = session.execute(statement).one()
+    return total, seq
+
+
+def estimate_users(session:Session) -> int | None:
+    '''
+    Operación de solo lectura que estima el número de usuarios con las estadísticas del planificador de Postgres
+    (pg_class.reltuples, que mantienen ANALYZE y autovacuum) sin leer la tabla.
+    Incluye los usuarios dados de baja que aún no se han purgado.
+    Devuelve None si no hay estimación: en SQLite, o si la tabla aún no se ha analizado (reltuples = -1)
+    '''
+    shards = shard_ids(session)
+    bind = session.get_bind(User.__mapper__) if shards is None else session.get_bind(shard_id=shards[0])
+    if bind.dialect.name != 'postgresql':
+        return None
+
+    statement = text('SELECT reltuples::bigint AS estimate FROM pg_class WHERE oid = CAST(:table AS regclass)')
+    statement = statement.bindparams(table=User.__tablename__)
+    if shards is None:
+        with read_transaction(session):
+            estimates = [session.execute(statement).scalar_one()]
+    else:
+        estimates = [rows[0]['estimate'] for rows in fan_out(session, statement)]
+
+    return None if any(estimate < 0 for estimate in estimates) else sum(estimates)
+
+
+def get_user_row_by_id(session:Session, id:int) -> RowMapping | None:
+    '''
+    Operación CRUD de solo lectura que obtiene los datos públicos del usuario especificado como fila.
     Si no existe en BD, devuelve None
     '''
-    return session.get(User, id)
+    with read_transaction(session):
+        return session.execute(select(*_READ_COLUMNS).where(User.id == id, User.is_active)).mappings().first()
+
+
+def get_user_by_username(session:Session, username:str) -> User | None:
+    '''
+    Operación CRUD que obtiene el usuario con ese username sin distinguir mayúsculas.
+    La condición es la misma expresión que el índice único parcial (lower(username) de los activos), así que lo usa.
+    Si no existe en BD, devuelve None
+    '''
+    with read_transaction(session):
+        return session.scalars(
+            select(User).where(func.lower(User.username) == func.lower(username), User.is_active)
+        ).first()
     
 
+def username_exists(session:Session, username:str) -> bool:
+    '''
+    Operación CRUD de solo lectura que indica si algún usuario activo tiene ese username (sin distinguir
+    mayúsculas). Lee solo el índice único parcial de lower(username); con sharding, en todos los shards
+    '''
+    statement = select(User.id).where(func.lower(User.username) == func.lower(username), User.is_active).limit(1)
+    with read_transaction(session):
+        return session.execute(statement).first() is not None
+
+
+def get_usernames(session:Session, after:int | None, limit:int) -> list[RowMapping]:
+    '''
+    Operación CRUD de solo lectura que obtiene (id, username) de hasta `limit` usuarios activos ordenados por id,
+    a partir del id `after`. Recorrer la tabla así, por lotes en transacciones cortas, no mantiene un snapshot
+    abierto durante todo el recorrido (que en Postgres retendría el autovacuum)
+    '''
+    statement = select(User.id, User.username).where(User.is_active).order_by(User.id).limit(limit)
+    if after is not None:
+        statement = statement.where(User.id > after)
+    with read_transaction(session):
+        return session.execute(statement).mappings().all()
+
+
+def _username_taken_in_other_shard(session:Session, username:str, id:int | None = None) -> bool:
+    '''
+    Con sharding el índice único solo protege dentro de cada shard. Las altas van al shard del hash del
+    username, pero un usuario renombrado sigue en el suyo: se comprueba en todos (sin bloqueo entre shards)
+    '''
+    statement = select(User.id).where(func.lower(User.username) == func.lower(username), User.is_active)
+    if id is not None:
+        statement = statement.where(User.id != id)
+    return session.execute(statement).first() is not None
+
+
 def create_user(user: UserCreate, session:Session) -> User:
     '''
     Operación CRUD que inserta un registro en la tabla de Usuario.
+    Con sharding el usuario va al shard que indica el hash de su username (db.shard_for_username).
     Posibles excepciones:
     - UserAlreadyExists -> Ya existe un usuario con ese username en BD
     '''
 
     new_user = User(first_name=user.first_name, last_name=user.last_name, username=user.username,
                                                 email=user.email, age=user.age, password=user.password)
+    shards = shard_ids(session)
     try:
-        with session.begin():
+        with transaction(session):
+            if shards is not None:
+                if _username_taken_in_other_shard(session, user.username):
+                    raise UserAlreadyExists(username=user.username)
+                new_user.id = allocate_user_id(session, shard_for_username(user.username, len(shards)))
+
             session.add(new_user)
+            session.flush() # asigna el id para el log de cambios
+            record_change(session, 'user', new_user.id, 'create', _snapshot(new_user),
+                          _shard_of(session, new_user.id))
 
     except IntegrityError as e:
-        # asi da igual idioma, version de librerias, etc. Siempre devolverá el mismo nombre
-        constraint = getattr(e.orig.diag, 'constraint_name', None) 
-        if constraint == 'users_username_key': 
+        # El índice único es sobre lower(username): 'Pepe' choca con 'pepe' sin consultar antes
+        if _is_username_conflict(e):
             raise UserAlreadyExists(username=user.username)
         
         raise # Relanzar cualquier excepcion no contemplada
@@ -48,17 +222,22 @@ def update_user(id:int, user_update:UserUpdate | UserPatch, session:Session) ->
     '''Operación CRUD que actualiza un usuario (PUT/PATCH)'''
 
     try:
-        with session.begin():
+        with transaction(session):
             user = session.get(User, id)
-            if not user:
+            if not user or not user.is_active:
                 return None
             
+            if ('username' in user_update.model_fields_set and shard_ids(session) is not None
+                    and _username_taken_in_other_shard(session, user_update.username, id)):
+                raise UserAlreadyExists(username=user_update.username)
+
             for field in user_update.model_fields_set:
                 setattr(user, field, getattr(user_update, field))
 
+            record_change(session, 'user', id, 'update', _snapshot(user), _shard_of(session, id))
+
     except IntegrityError as e:
-        constraint = getattr(e.orig.diag, 'constraint_name', None)
-        if constraint == 'users_username_key':
+        if _is_username_conflict(e):
             raise UserAlreadyExists(username=user_update.username)
 
         raise    
@@ -68,14 +247,106 @@ def update_user(id:int, user_update:UserUpdate | UserPatch, session:Session) ->
 
 def delete_user(session:Session, id:int) -> User | None:
     '''
-    Operación CRUD que borra el usuario con el id especificado. 
-    Si no existe, devuelve None
+    Operación CRUD que da de baja el usuario con el id especificado (is_active = false).
+    Es un UPDATE de una fila: el usuario y sus notas se borran después, por lotes, en purge.py.
+    La fila se bloquea para que dos bajas simultáneas no registren dos cambios.
+    Si no existe o ya estaba dado de baja, devuelve None
     '''
-    with session.begin():
-        user = session.get(User, id)
-        if not user:
+    with transaction(session):
+        user = session.get(User, id, with_for_update=True)
+        if not user or not user.is_active:
             return None
 
-        session.delete(user)
+        user.is_active = False
+        record_change(session, 'user', id, 'delete', shard_id=_shard_of(session, id))
 
     return user
+
+
+def record_imported_users(session:Session, usernames:list[str]):
+    '''
+    Operación CRUD que registra en el log de cambios el alta de usuarios ya insertados en la transacción en curso
+    sin pasar por create_user (importer.py). Entre los activos los usernames son únicos (USERNAME_INDEX): la
+    consulta devuelve justo esas filas
+    '''
+    if not usernames:
+        return
+    users = session.scalars(select(User).where(User.username.in_(usernames), User.is_active)
+                            .order_by(User.id)).all()
+    record_changes(session, 'user', 'create', [(user.id, _snapshot(user)) for user in users])
+
+
+def get_user_notes(session:Session, user_id:int, since:datetime, until:datetime,
+                   limit:int) -> list[RowMapping] | None:
+    '''
+    Operación CRUD de solo lectura que obtiene las notas de un usuario creadas en [since, until) como filas,
+    de la más reciente a la más antigua. Con la tabla particionada los límites de created_at hacen que solo
+    se lean las particiones de esos meses; el índice (user_id, created_at) da el orden y corta en `limit`.
+    Si el usuario no existe (o está dado de baja) devuelve None: la comprobación va en la misma transacción,
+    con una sola conexión del pool
+    '''
+    with read_transaction(session):
+        if session.scalar(select(User.id).where(User.id == user_id, User.is_active)) is None:
+            return None
+        return session.execute(
+            select(*_NOTE_COLUMNS)
+            .where(Note.user_id == user_id, Note.created_at >= since, Note.created_at < until)
+            .order_by(Note.created_at.desc(), Note.id.desc())
+            .limit(limit)
+        ).mappings().all()
+
+
+def purge_inactive_notes(session:Session, limit:int) -> int:
+    '''
+    Operación CRUD que borra hasta `limit` notas de usuarios dados de baja. Devuelve cuántas ha borrado.
+    Las filas bloqueadas por otra transacción se saltan (SKIP LOCKED en Postgres)
+    '''
+    batch = (select(Note.id).join(User, Note.user_id == User.id).where(~User.is_active)
+             .limit(limit).with_for_update(of=Note, skip_locked=True))
+    with session.begin():
+        return session.execute(
+            delete(Note).where(Note.id.in_(batch)).execution_options(synchronize_session=False)
+        ).rowcount
+
+
+def purge_inactive_users(session:Session, limit:int) -> int:
+    '''
+    Operación CRUD que borra hasta `limit` usuarios dados de baja. Devuelve cuántos ha borrado.
+    Se llama cuando ya no les quedan notas, así el borrado en cascada no tiene nada (o casi nada) que hacer
+    '''
+    batch = select(User.id).where(~User.is_active).limit(limit).with_for_update(skip_locked=True)
+    with session.begin():
+        return session.execute(
+            delete(User).where(User.id.in_(batch)).execution_options(synchronize_session=False)
+        ).rowcount
+
+
+def get_note_count_drift(session:Session) -> list[RowMapping]:
+    '''
+    Operación CRUD que obtiene los usuarios cuyo note_count no coincide con sus notas
+    (id, note_count guardado y actual, el número real de notas)
+    '''
+    counts = select(Note.user_id, func.count().label('notes')).group_by(Note.user_id).subquery()
+    actual = func.coalesce(counts.c.notes, 0)
+    return session.execute(
+        select(User.id, User.note_count, actual.label('actual'))
+        .outerjoin(counts, counts.c.user_id == User.id)
+        .where(User.note_count != actual)
+        .order_by(User.id)
+    ).mappings().all()
+
+
+def repair_note_count(session:Session, id:int) -> int | None:
+    '''
+    Operación CRUD que recalcula el note_count de un usuario y devuelve el valor corregido (None si no existe).
+    Se bloquea antes la fila del usuario: los triggers de notes también la actualizan, así una nota creada
+    o borrada a la vez espera y no se pierde
+    '''
+    with session.begin():
+        if session.execute(select(User.id).where(User.id == id).with_for_update()).first() is None:
+            return None
+
+        actual = session.scalar(select(func.count()).select_from(Note).where(Note.user_id == id))
+        session.execute(update(User).where(User.id == id).values(note_count=actual))
+
+    return actual
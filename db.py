@@ -1,59 +1,375 @@
-from sqlalchemy import create_engine, delete
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import create_engine, delete, event, select, func, Engine, RowMapping
+from sqlalchemy.exc import OperationalError, InvalidRequestError
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import Session, sessionmaker, ORMExecuteState
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+from sqlalchemy.sql.util import find_tables
 from models.base import Base
 from models.user import User
 from models.note import Note
+from models.job import Job
+from models.idempotency import IdempotencyRecord
+from models.change import Change
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from urllib.parse import quote_plus
+import time
+import zlib
 
 from dotenv import load_dotenv
+from fastapi import Request
 import os
+import sqlite3
+
+import config
+from exceptions.deadline_exceptions import DeadlineExceeded
+from metrics import Counter
+from middleware.deadline import current_deadline, check_deadline
 
 load_dotenv()
 
 DB_USER = os.getenv('DB_USER_J')
-DB_PASSWORD = quote_plus(os.getenv('DB_PASSWORD_J')) # escapa caracteres especiales
+DB_PASSWORD = quote_plus(os.getenv('DB_PASSWORD_J', '')) # escapa caracteres especiales
 DB_HOST = os.getenv('DB_HOST_J')
 DB_PORT = os.getenv('DB_PORT_J')
 DB_NAME = os.getenv('DB_NAME_J')
 
+# Permite apuntar a otra BD (p.ej. sqlite:///journal.db en local) sin tocar las variables de Postgres
+DB_URL = os.getenv('DB_URL_J') or f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
 
-engine = create_engine(f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}')
 
-SessionLocal = sessionmaker(bind=engine)
+@event.listens_for(Engine, 'connect')
+def _sqlite_compat(dbapi_connection, connection_record):
+    '''
+    SQLite no tiene char_length (usada en los CheckConstraint de los modelos) y no aplica
+    las FK (ni el ondelete='CASCADE') salvo que se active. Se configura en cada conexión nueva
+    '''
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function('char_length', 1, lambda value: None if value is None else len(value),
+                                         deterministic=True)
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+
+# Clave de session.info con el deadline (time.monotonic) de la petición que usa la sesión
+DEADLINE = 'deadline'
+
+# Clave de session.info que indica que la sesión ya tiene abierta la transacción de un lote atómico (POST /batch)
+ATOMIC = 'atomic'
+
+
+def transaction(session:Session):
+    '''
+    Transacción de una operación CRUD de escritura. Dentro de un lote atómico no abre ninguna: la operación
+    va en la transacción del lote, que se deshace entera en cuanto una operación falla (no hace falta savepoint)
+    '''
+    if session.info.get(ATOMIC) is True:
+        return nullcontext()
+    return session.begin()
+
+
+def read_transaction(session:Session):
+    '''
+    Transacción de una operación CRUD de lectura: se confirma al terminar la lectura y la conexión vuelve al pool
+    en ese momento, no al cerrar la sesión. Dentro de una transacción en curso (una escritura, un lote atómico)
+    la lectura va en ella. Las sesiones de get_db no caducan lo leído al confirmar (expire_on_commit=False):
+    serializar la respuesta no vuelve a pedir una conexión
+    '''
+    if session.in_transaction():
+        return nullcontext()
+    return session.begin()
+
+
+# --- Sharding horizontal (opcional, config.DB_SHARD_URLS) ---
+# Los usuarios se reparten por id (shard = id % nº de shards) y cada nota vive en el shard de su usuario
+# (Note.user_id). El resto de tablas (jobs, idempotency_keys, changes) están en el shard principal; los demás
+# shards tienen además su tabla changes como cola de cambios pendientes de trasladar (crud.change.record_change).
+# Un usuario nuevo va al shard que indica el hash de su username en minúsculas: dos altas con el mismo
+# username acaban en el mismo shard y el índice único lo impide sin coordinación entre shards
+
+SHARDS = 'shards' # clave de session.info con los ids de shard ('0', '1', ...); solo en sesiones con sharding
+PRIMARY_SHARD = '0'
+SHARDED_TABLES = frozenset({User.__tablename__, Note.__tablename__})
+# Columnas cuyo valor determina el shard: users.id y notes.user_id
+SHARD_KEYS = frozenset({(User.__tablename__, 'id'), (Note.__tablename__, 'user_id')})
+
+
+def shard_for_user(user_id:int, shard_count:int) -> str:
+    return str(user_id % shard_count)
+
+
+def shard_for_username(username:str, shard_count:int) -> str:
+    return str(zlib.crc32(username.lower().encode()) % shard_count)
+
+
+class ShardRouter:
+    '''Funciones de elección de shard que necesita ShardedSession'''
+
+    def __init__(self, shard_count:int):
+        self.shard_count = shard_count
+        self.shard_ids = [str(i) for i in range(shard_count)]
+
+    def shard_chooser(self, mapper, instance, clause=None) -> str:
+        '''Shard donde se escribe una instancia nueva'''
+        table = mapper.local_table.name if mapper is not None else None
+        if table not in SHARDED_TABLES:
+            return PRIMARY_SHARD
+
+        if isinstance(instance, User):
+            if instance.id is not None:
+                return shard_for_user(instance.id, self.shard_count)
+            return shard_for_username(instance.username, self.shard_count)
+
+        if isinstance(instance, Note):
+            if instance.user_id is not None:
+                return shard_for_user(instance.user_id, self.shard_count)
+            if instance.user is not None: # usuario creado en el mismo flush: su shard ya está asignado
+                return self.shard_chooser(User.__mapper__, instance.user)
+
+        raise InvalidRequestError(f'No se puede elegir shard para {table} sin la instancia')
+
+    def identity_chooser(self, mapper, primary_key, *, lazy_loaded_from, **kw) -> list[str]:
+        '''Shards donde puede estar una clave primaria (session.get)'''
+        if lazy_loaded_from is not None:
+            return [lazy_loaded_from.identity_token]
+        if mapper.local_table.name == User.__tablename__:
+            return [shard_for_user(primary_key[0], self.shard_count)]
+        if mapper.local_table.name == Note.__tablename__:
+            return self.shard_ids # el id de la nota no dice a qué usuario pertenece
+        return [PRIMARY_SHARD]
+
+    def execute_chooser(self, orm_context:ORMExecuteState) -> list[str]:
+        '''Shards donde se ejecuta una consulta: los que fije su WHERE sobre la clave de shard o todos'''
+        if orm_context.is_select and orm_context.lazy_loaded_from is not None:
+            return [orm_context.lazy_loaded_from.identity_token]
+
+        statement = orm_context.statement
+        if not {t.name for t in find_tables(statement, include_crud=True)} & SHARDED_TABLES:
+            return [PRIMARY_SHARD]
+
+        if orm_context.is_insert:
+            # Un INSERT directo (sin instancias) se ejecutaría en todos: hay que indicar el shard
+            raise InvalidRequestError("INSERT en tablas con sharding: usa el ORM o bind_arguments={'shard_id': ...}")
+
+        parameters = orm_context.parameters if isinstance(orm_context.parameters, dict) else {}
+        shard_keys = self._shard_keys(getattr(statement, 'whereclause', None), parameters)
+        if shard_keys is None:
+            return self.shard_ids
+        return sorted({shard_for_user(key, self.shard_count) for key in shard_keys})
+
+    def _shard_keys(self, where, parameters:dict) -> list[int] | None:
+        '''
+        Valores de la clave de shard fijados por el WHERE (col == x o col IN (...)), o None si no lo fija.
+        Solo se miran las condiciones unidas con AND: con OR podría haber filas en otros shards
+        '''
+        if where is None:
+            return None
+        conditions = where.clauses if isinstance(where, BooleanClauseList) and where.operator is operators.and_ \
+            else [where]
+
+        for condition in conditions:
+            if not isinstance(condition, BinaryExpression) or not isinstance(condition.right, BindParameter):
+                continue
+            table = getattr(condition.left, 'table', None)
+            if table is None or (table.name, getattr(condition.left, 'name', None)) not in SHARD_KEYS:
+                continue
+            # session.get pasa la clave primaria como parámetro de la ejecución
+            value = parameters.get(condition.right.key, condition.right.effective_value)
+            if value is None:
+                continue
+            if condition.operator is operators.eq:
+                return [value]
+            if condition.operator is operators.in_op:
+                return list(value)
+        return None
+
+
+def shard_ids(session:Session) -> list[str] | None:
+    '''Shards de la sesión o None si no usa sharding'''
+    return session.info[SHARDS] if isinstance(session, ShardedSession) else None
+
+
+def sharded_sessionmaker(engines:list[Engine]) -> sessionmaker:
+    '''sessionmaker de ShardedSession sobre `engines` (el primero es el shard principal)'''
+    router = ShardRouter(len(engines))
+    return sessionmaker(class_=ShardedSession, shards=dict(zip(router.shard_ids, engines)),
+                        shard_chooser=router.shard_chooser, identity_chooser=router.identity_chooser,
+                        execute_chooser=router.execute_chooser, info={SHARDS: router.shard_ids})
+
+
+def init_shards(engines:list[Engine]):
+    '''
+    Crea las tablas (las globales solo en el principal; changes en todos, como cola del log de cambios).
+    En Postgres además alinea las secuencias de users y notes para que cada shard genere ids con
+    id % nº de shards == su índice
+    '''
+    for index, shard_engine in enumerate(engines):
+        tables = None if index == 0 else [User.__table__, Note.__table__, Change.__table__]
+        Base.metadata.create_all(shard_engine, tables=tables)
+        if shard_engine.dialect.name != 'postgresql':
+            continue
+
+        with shard_engine.begin() as connection:
+            for table in (User.__tablename__, Note.__tablename__):
+                sequence = connection.exec_driver_sql(f"SELECT pg_get_serial_sequence('{table}', 'id')").scalar()
+                current = connection.exec_driver_sql(f'SELECT coalesce(max(id), 0) FROM {table}').scalar()
+                connection.exec_driver_sql(f'ALTER SEQUENCE {sequence} INCREMENT BY {len(engines)}')
+                connection.exec_driver_sql(
+                    f"SELECT setval('{sequence}', {_next_id(current, index, len(engines))}, false)")
 
-def get_db():
-    with SessionLocal() as session:
-        yield session
+
+def _next_id(current:int, shard_index:int, shard_count:int) -> int:
+    '''Primer id mayor que `current` que corresponde al shard'''
+    return current + ((shard_index - current) % shard_count or shard_count)
+
+
+def allocate_user_id(session:Session, shard_id:str) -> int | None:
+    '''
+    Id para un usuario nuevo en el shard. En Postgres lo genera la secuencia del shard (None).
+    En SQLite no hay secuencias con incremento: el siguiente id del shard a partir del máximo
+    (SQLite serializa las escrituras, basta para uso local)
+    '''
+    if session.get_bind(shard_id=shard_id).dialect.name == 'postgresql':
+        return None
+    current = session.execute(select(func.coalesce(func.max(User.id), 0)),
+                              bind_arguments={'shard_id': shard_id}).scalar()
+    return _next_id(current, int(shard_id), len(shard_ids(session)))
+
+
+# Un ejecutor por shard: cada uno con tantos hilos como conexiones de su pool hay para peticiones
+_fan_out_executors:dict[str, ThreadPoolExecutor] = {}
+
+
+def _fan_out_executor(shard_id:str) -> ThreadPoolExecutor:
+    executor = _fan_out_executors.get(shard_id)
+    if executor is None:
+        # Dos hilos pueden crearlo a la vez: se queda el primero (el otro aún no ha arrancado ningún hilo)
+        executor = _fan_out_executors.setdefault(shard_id, ThreadPoolExecutor(
+            config.DB_REQUEST_CONNECTIONS, thread_name_prefix=f'shard-fan-out-{shard_id}'))
+    return executor
+
+
+def fan_out(session:Session, statement) -> list[list[RowMapping]]:
+    '''
+    Ejecuta una consulta de solo lectura en todos los shards a la vez, cada uno con su propia conexión
+    (y el mismo deadline que la sesión). Devuelve las filas de cada shard por separado.
+    Las consultas a cada shard van a su propio ejecutor: por muchas peticiones que hagan fan-out a la vez,
+    nunca hay más consultas sobre un shard que conexiones de su pool para peticiones (config.DB_REQUEST_CONNECTIONS);
+    el resto espera en la cola del ejecutor, no en el pool (donde saltaría pool_timeout)
+    '''
+    def run(shard_id:str) -> list[RowMapping]:
+        with Session(session.get_bind(shard_id=shard_id), info={DEADLINE: session.info.get(DEADLINE)}) as shard:
+            return shard.execute(statement).mappings().all()
+
+    futures = [_fan_out_executor(shard_id).submit(run, shard_id) for shard_id in shard_ids(session)]
+    return [future.result() for future in futures]
+
+
+# Tamaño del pool sacado de config, el mismo que dimensiona el threadpool y los límites de admisión
+def _create_engine(url:str) -> Engine:
+    return create_engine(url, pool_size=config.DB_POOL_SIZE, max_overflow=config.DB_MAX_OVERFLOW,
+                         pool_timeout=config.DB_POOL_TIMEOUT)
+
+
+if config.DB_SHARD_URLS:
+    shard_engines = [_create_engine(url) for url in config.DB_SHARD_URLS]
+    engine = shard_engines[0]
+    SessionLocal = sharded_sessionmaker(shard_engines)
+else:
+    shard_engines = []
+    engine = _create_engine(DB_URL)
+    SessionLocal = sessionmaker(bind=engine)
+
+
+def _discard_inherited_connections():
+    '''
+    En el hijo de un fork (servidores que importan la app antes de crear los procesos): las conexiones del pool
+    son sockets compartidos con el padre y usarlas desde los dos procesos corrompe el protocolo.
+    dispose(close=False) las olvida sin cerrarlas (siguen siendo del padre) y el pool abre otras.
+    Los hilos del fan-out tampoco sobreviven al fork: se crean otros ejecutores al usarlos
+    '''
+    for bind in shard_engines or [engine]:
+        bind.dispose(close=False)
+    _fan_out_executors.clear()
+
+
+os.register_at_fork(after_in_child=_discard_inherited_connections)
+
+QUERY_CANCELED = '57014' # SQLSTATE de Postgres al saltar statement_timeout
+
+
+@event.listens_for(Session, 'after_begin')
+def _apply_deadline(session, transaction, connection):
+    '''
+    Cada transacción de una sesión con deadline se limita a lo que le quede a la petición:
+    Postgres cancela la consulta en lugar de retener la conexión del pool
+    '''
+    deadline = session.info.get(DEADLINE)
+    if deadline is None:
+        return
+
+    left = check_deadline(deadline)
+    if connection.dialect.name == 'postgresql':
+        # SET no admite parámetros; es un entero calculado aquí
+        connection.exec_driver_sql(f'SET LOCAL statement_timeout = {max(int(left * 1000), 1)}')
+
+
+# Clave de session.info con la ruta de la petición ('GET /users/{id}') y el instante en que la sesión
+# tomó una conexión del pool (al empezar su transacción)
+ROUTE = 'route'
+_HOLD_START = 'hold_start'
+
+HOLD_SECONDS = Counter('journal_db_connection_hold_seconds_total',
+                       'Segundos con una conexión del pool ocupada por las peticiones', ('route',))
+HOLDS = Counter('journal_db_connection_holds_total', 'Veces que una petición ha ocupado una conexión', ('route',))
+
+
+@event.listens_for(Session, 'after_begin')
+def _hold_started(session, transaction, connection):
+    if ROUTE in session.info:
+        session.info.setdefault(_HOLD_START, time.perf_counter())
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _hold_ended(session, transaction):
+    # Al terminar la transacción raíz la sesión devuelve la conexión al pool
+    if transaction.parent is not None:
+        return
+    start = session.info.pop(_HOLD_START, None)
+    if start is not None:
+        HOLD_SECONDS.inc(time.perf_counter() - start, route=session.info[ROUTE])
+        HOLDS.inc(route=session.info[ROUTE])
+
+
+def get_db(request:Request):
+    '''
+    Sesión por petición. Hereda el deadline de la petición (middleware.deadline) y convierte
+    la cancelación por statement_timeout en DeadlineExceeded (504).
+    La sesión no ocupa conexión hasta la primera consulta y la devuelve al terminar cada transacción de crud
+    (ver read_transaction); las rutas la declaran con scope='function', así se cierra al volver del endpoint,
+    antes de enviar la respuesta. Cuánto tiempo ocupa cada ruta una conexión: journal_db_connection_hold_*
+    '''
+    route = request.scope.get('route')
+    info = {DEADLINE: current_deadline(), ROUTE: f'{request.method} {getattr(route, "path", request.url.path)}'}
+    with SessionLocal(expire_on_commit=False, info=info) as session:
+        try:
+            yield session
+        except OperationalError as e:
+            if getattr(e.orig, 'pgcode', None) == QUERY_CANCELED:
+                raise DeadlineExceeded() from e
+            raise
 
 
 def main():
     # Base.metadata.drop_all(engine)
     # Base.metadata.create_all(engine)
-    # insertSampleData() 
+    # init_shards(shard_engines) # con sharding, en lugar de create_all
+    # datos de prueba: python -m seed <num_usuarios> (ver seed.py)
     # deleteSampleData()
 
     pass
 
-#Datos de prueba
-def insertSampleData():
-    with SessionLocal() as session:
-        with session.begin():
-            users = [
-                User(first_name="squidward", last_name="Tentacles", username='squidtent', age=22, password='12345678'),
-                User(first_name="Eugene", last_name="H. Krabs", username='ehkrabs', age=20, password='12345678'),
-                User(first_name="Pepe", last_name="Ruiz", username='ejemplo', age=24, email='correo@hotmail.com', password='12345678')
-            ] 
-            
-
-            users[0].notes.append(Note(title='Nota 1', description='Esta es una descripcion de ejemplo'))
-            users[0].notes.append(Note(title='Nota 2', description='Probando 2 notas en un mismo usuario'))
-            users[1].notes.append(Note(title='Ultima nota', description='Nueva nota en nuevo user'))
-
-
-            session.add_all(users)
-           
-
 def deleteSampleData():
     with SessionLocal() as session:
         with session.begin():
@@ -0,0 +1,160 @@
+'''
+Difusión en tiempo real de los cambios de usuarios y notas (GET /events por SSE y /events/ws por WebSocket).
+
+Los cambios que crud.change.record_change deja en la sesión se publican cuando la transacción se
+confirma (crud.change.on_changes_committed) y se descartan si se deshace. La publicación ocurre en
+el hilo del threadpool que ejecutó el endpoint, así que se pasa al event loop con call_soon_threadsafe.
+Con varios procesos (serve.py) se publican todos, los de este incluidos, al leerlos del log de cambios
+(change_feed.py): cada proceso los emite en el mismo orden de seq que el log. Con uno solo, dos commits
+concurrentes pueden publicarse en orden inverso: las conexiones no descartan un evento por llegar tarde.
+
+El reparto está pensado para muchas conexiones en un solo worker:
+- Los suscriptores se indexan por filtro (id de usuario o todos), así cada evento solo recorre los suyos.
+- Cada evento se serializa una única vez (SSE y JSON) y se comparte entre todas las conexiones.
+- Cada conexión tiene un buffer acotado; si un cliente lento lo llena se le desconecta y puede
+  reconectar con Last-Event-ID para recuperar lo perdido desde el log de cambios.
+'''
+import asyncio
+import itertools
+import json
+from collections import deque
+from datetime import datetime
+from functools import cached_property
+
+import config
+from change_feed import on_changes
+from metrics import Counter, Gauge
+
+
+SUBSCRIBERS = Gauge('journal_events_subscribers', 'Conexiones SSE / WebSocket abiertas')
+PUBLISHED = Counter('journal_events_published_total', 'Cambios publicados')
+SLOW_DISCONNECTS = Counter('journal_events_slow_disconnects_total', 'Conexiones cerradas por no leer a tiempo')
+
+
+def _json_default(value):
+    # mismo formato que ChangeRead.model_dump(mode='json'), usado al reenviar desde el log
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+class ChangeEvent:
+    '''Cambio publicado. Las representaciones se calculan una vez y se comparten entre conexiones'''
+
+    def __init__(self, change:dict):
+        self.change = change
+
+    @property
+    def seq(self) -> int:
+        return self.change['seq']
+
+    @property
+    def user_id(self) -> int | None:
+        '''Usuario al que afecta el cambio (el propio usuario o el dueño de la nota)'''
+        if self.change['entity'] == 'user':
+            return self.change['entity_id']
+        return (self.change.get('data') or {}).get('user_id')
+
+    @cached_property
+    def json(self) -> str:
+        return json.dumps(self.change, default=_json_default)
+
+    @cached_property
+    def sse(self) -> bytes:
+        name = f"{self.change['entity']}.{self.change['op']}"
+        return f'id: {self.seq}\nevent: {name}\ndata: {self.json}\n\n'.encode()
+
+
+class Subscriber:
+    '''Una conexión: buffer acotado + señal para despertar al consumidor'''
+
+    def __init__(self, user_id:int | None, buffer_size:int):
+        self.user_id = user_id
+        self.buffer:deque[ChangeEvent] = deque()
+        self.buffer_size = buffer_size
+        self.overflowed = False
+        self.closed = False
+        self.ready = asyncio.Event()
+
+    def push(self, change_event:ChangeEvent):
+        if len(self.buffer) >= self.buffer_size:
+            self.overflowed = True
+        else:
+            self.buffer.append(change_event)
+        self.ready.set()
+
+    def close(self):
+        '''Despierta al consumidor para que termine (p.ej. el cliente se ha desconectado)'''
+        self.closed = True
+        self.ready.set()
+
+    async def next_batch(self, timeout:float | None = None) -> list[ChangeEvent]:
+        '''Espera eventos (como mucho `timeout` segundos) y devuelve todos los pendientes'''
+        if not self.buffer and not self.overflowed and not self.closed:
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self.ready.clear()
+
+        batch = list(self.buffer)
+        self.buffer.clear()
+        return batch
+
+
+class Broker:
+
+    def __init__(self):
+        self._by_user:dict[int | None, set[Subscriber]] = {}
+        self._loop:asyncio.AbstractEventLoop | None = None
+
+    def subscribe(self, user_id:int | None = None, buffer_size:int | None = None) -> Subscriber:
+        '''Registra una conexión. user_id None = todos los cambios. Debe llamarse desde el event loop'''
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(user_id, buffer_size or config.EVENTS_BUFFER_SIZE)
+        self._by_user.setdefault(user_id, set()).add(subscriber)
+        SUBSCRIBERS.inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber:Subscriber):
+        subscribers = self._by_user.get(subscriber.user_id)
+        if subscribers and subscriber in subscribers:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._by_user[subscriber.user_id]
+            SUBSCRIBERS.dec()
+
+    def publish(self, changes:list[dict]):
+        '''Publica cambios ya confirmados. Se puede llamar desde cualquier hilo'''
+        loop = self._loop
+        if not changes or loop is None or not self._by_user or loop.is_closed():
+            return
+
+        change_events = [ChangeEvent(change) for change in changes]
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is loop:
+            self._fanout(change_events)
+            return
+
+        try:
+            loop.call_soon_threadsafe(self._fanout, change_events)
+        except RuntimeError: # el loop se ha cerrado (parada del servidor)
+            pass
+
+    def _fanout(self, change_events:list[ChangeEvent]):
+        for change_event in change_events:
+            PUBLISHED.inc()
+            # Cada suscriptor está en un único conjunto (el de su filtro): no hace falta deduplicar
+            targets = itertools.chain(self._by_user.get(None, ()), self._by_user.get(change_event.user_id, ()))
+            for subscriber in targets:
+                if subscriber.overflowed:
+                    continue
+                subscriber.push(change_event)
+                if subscriber.overflowed:
+                    SLOW_DISCONNECTS.inc()
+
+
+broker = Broker()
+on_changes(broker.publish, in_order=True)
@@ -0,0 +1,6 @@
+class DeadlineExceeded(Exception):
+    '''Se ha agotado el tiempo disponible para la petición'''
+
+    def __init__(self):
+        self.message = 'Se ha agotado el tiempo disponible para la petición'
+        super().__init__(self.message)
@@ -0,0 +1,7 @@
+class JobCancelled(Exception):
+    '''Se ha pedido cancelar el trabajo (o el proceso se está parando)'''
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.message = f"El trabajo {job_id} ha sido cancelado"
+        super().__init__(self.message)
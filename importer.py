@@ -0,0 +1,261 @@
+'''
+Importación masiva de usuarios y notas desde CSV o NDJSON.
+
+Las filas se validan por bloques contra UserCreate / NoteCreate y se cargan con COPY FROM STDIN
+en Postgres (executemany por bloques en cualquier otra BD). Cada bloque va en su propia transacción;
+si un bloque viola alguna restricción (p.ej. username duplicado) se reintenta fila a fila con
+savepoints para aislar las filas culpables. Las filas rechazadas se escriben en un fichero NDJSON.
+Los usuarios importados se registran en el log de cambios (crud.user.record_imported_users) con un
+único INSERT por bloque.
+
+Uso (CLI):
+    python importer.py users usuarios.csv [--chunk-size 5000] [--errors errores.ndjson]
+    python importer.py notes notas.ndjson
+'''
+import argparse
+import csv
+import io
+import itertools
+import json
+import time
+from collections.abc import Callable, Iterable, Iterator
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert, Table
+from sqlalchemy.exc import IntegrityError, DataError
+from sqlalchemy.orm import Session
+
+from models.user import User
+from models.note import Note
+from schemas.user import UserCreate
+from schemas.note import NoteCreate
+from schemas.imports import ImportReport
+
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# tipo -> (schema de validación, tabla destino, valores fijos que no vienen en el fichero)
+IMPORTABLE:dict[str, tuple[type[BaseModel], Table, dict]] = {
+    'users': (UserCreate, User.__table__, {'is_active': True}),
+    'notes': (NoteCreate, Note.__table__, {}),
+}
+
+FORMATS = ('csv', 'ndjson')
+
+FORMAT_BY_CONTENT_TYPE = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+
+def format_from_filename(filename:str) -> str:
+    '''Deduce el formato a partir de la extensión del fichero'''
+    return 'csv' if filename.lower().endswith('.csv') else 'ndjson'
+
+
+def format_from_content_type(content_type:str) -> str | None:
+    '''Deduce el formato a partir de la cabecera Content-Type. None si no está soportado'''
+    return FORMAT_BY_CONTENT_TYPE.get(content_type.split(';')[0].strip().lower())
+
+
+def iter_rows(source:Iterable[str], fmt:str) -> Iterator[tuple[int, dict | None, str | None]]:
+    '''
+    Recorre el fichero de entrada devolviendo (nº de línea, fila, error de formato).
+    En CSV las celdas vacías se convierten en None (p.ej. email opcional)
+    '''
+    if fmt == 'csv':
+        reader = csv.DictReader(source)
+        for row in reader:
+            yield reader.line_num, {k: (v if v != '' else None) for k, v in row.items()}, None
+        return
+
+    for line_num, line in enumerate(source, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_num, None, f'JSON inválido: {e.msg}'
+            continue
+
+        if isinstance(row, dict):
+            yield line_num, row, None
+        else:
+            yield line_num, None, 'Cada línea debe ser un objeto JSON'
+
+
+def _chunks(iterable:Iterable, size:int) -> Iterator[list]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _copy_rows(session:Session, table:Table, rows:list[dict]):
+    '''Carga las filas con COPY FROM STDIN usando un CSV en memoria (solo Postgres/psycopg2)'''
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC) # sin comillas -> NULL, con comillas -> texto
+    writer.writerows([row[c] for c in columns] for row in rows)
+    buffer.seek(0)
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {table.name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+
+def load_rows(session:Session, table:Table, rows:list[dict]):
+    '''Carga un bloque de filas ya validadas: COPY en Postgres, INSERT multi-fila (executemany) en el resto'''
+    if session.get_bind().dialect.name == 'postgresql':
+        _copy_rows(session, table, rows)
+    else:
+        session.execute(insert(table), rows)
+
+
+class _ErrorWriter:
+    '''Escribe las filas rechazadas en NDJSON. El fichero solo se crea si hay algún rechazo'''
+
+    def __init__(self, path:str | None, append:bool = False):
+        self.path = path
+        self.mode = 'a' if append else 'w'
+        self._file = None
+
+    def write(self, line_num:int, row:dict | None, errors:list | str):
+        if self.path is None:
+            return
+        if self._file is None:
+            self._file = open(self.path, self.mode, encoding='utf-8')
+        self._file.write(json.dumps({'line': line_num, 'row': row, 'errors': errors}, default=str) + '\n')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def import_rows(kind:str, source:Iterable[str], fmt:str, session:Session, *,
+                chunk_size:int = DEFAULT_CHUNK_SIZE, errors_path:str | None = None,
+                progress:Callable[[ImportReport], None] | None = None, skip:int = 0,
+                checkpoint:Callable[[Session, int], None] | None = None) -> ImportReport:
+    '''
+    Importa las filas de `source` (líneas de texto en formato csv o ndjson) en la tabla de `kind`.
+    Devuelve un ImportReport con los contadores finales; `progress` se llama tras cada bloque, cuando
+    este ya está confirmado. `skip` permite retomar una importación saltando las filas ya procesadas.
+    `checkpoint(session, filas_leídas)` se llama dentro de la transacción de cada bloque: lo que guarde
+    se confirma con las filas del bloque o se descarta con ellas (p.ej. el punto desde el que retomar)
+    '''
+    schema, table, defaults = IMPORTABLE[kind]
+    report = ImportReport(kind=kind, rows_read=skip)
+    errors = _ErrorWriter(errors_path, append=skip > 0)
+    start = time.perf_counter()
+
+    try:
+        for chunk in _chunks(itertools.islice(iter_rows(source, fmt), skip, None), chunk_size):
+            valid:list[tuple[int, dict]] = []
+            for line_num, row, error in chunk:
+                report.rows_read += 1
+                if error:
+                    report.rows_rejected += 1
+                    errors.write(line_num, row, error)
+                    continue
+                try:
+                    valid.append((line_num, schema.model_validate(row).model_dump() | defaults))
+                except ValidationError as e:
+                    report.rows_rejected += 1
+                    errors.write(line_num, row, e.errors(include_url=False, include_context=False))
+
+            if valid:
+                _import_chunk(session, table, valid, report, errors, checkpoint)
+            elif checkpoint:
+                with session.begin():
+                    checkpoint(session, report.rows_read)
+
+            report.elapsed = time.perf_counter() - start
+            if progress:
+                progress(report)
+    finally:
+        errors.close()
+
+    if report.rows_rejected:
+        report.errors_file = errors_path
+    return report
+
+
+def _import_chunk(session:Session, table:Table, valid:list[tuple[int, dict]], report:ImportReport,
+                  errors:_ErrorWriter, checkpoint:Callable[[Session, int], None] | None = None):
+    try:
+        with session.begin():
+            load_rows(session, table, [row for _, row in valid])
+            _record_imported(session, table, [row for _, row in valid])
+            if checkpoint:
+                checkpoint(session, report.rows_read)
+        report.rows_imported += len(valid)
+        return
+
+    except (IntegrityError, DataError):
+        pass
+
+    # Algún registro del bloque viola una restricción: fila a fila con savepoints para aislarlo
+    with session.begin():
+        imported = []
+        for line_num, row in valid:
+            try:
+                with session.begin_nested():
+                    session.execute(insert(table), row)
+                report.rows_imported += 1
+                imported.append(row)
+
+            except (IntegrityError, DataError) as e:
+                report.rows_rejected += 1
+                errors.write(line_num, row, str(e.orig).strip())
+
+        _record_imported(session, table, imported)
+        if checkpoint:
+            checkpoint(session, report.rows_read)
+
+
+def _record_imported(session:Session, table:Table, rows:list[dict]):
+    '''
+    Registra el alta de los usuarios importados en el log de cambios, en la transacción del bloque: así los ven
+    la caché, los contadores, los eventos y el filtro de usernames de todos los procesos. Las notas no tienen
+    una clave con la que recuperar sus ids tras el COPY y no se registran
+    '''
+    if table is not User.__table__:
+        return
+    from crud.user import record_imported_users # import tardío: crud importa db (ver main)
+    record_imported_users(session, [row['username'] for row in rows])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Importación masiva de usuarios y notas (CSV / NDJSON)')
+    parser.add_argument('kind', choices=IMPORTABLE)
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS, help='Por defecto se deduce de la extensión')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--errors', help='Fichero NDJSON de filas rechazadas (por defecto <path>.errors.ndjson)')
+    args = parser.parse_args()
+
+    from db import SessionLocal # import tardío: no conectar con la BD solo por importar el módulo
+
+    def print_progress(report:ImportReport):
+        print(f'\r{report.rows_read} leídas, {report.rows_imported} importadas, '
+              f'{report.rows_rejected} rechazadas ({report.rows_per_sec:.0f} filas/s)', end='', flush=True)
+
+    with open(args.path, encoding='utf-8', newline='') as source, SessionLocal() as session:
+        report = import_rows(args.kind, source, args.format or format_from_filename(args.path), session,
+                             chunk_size=args.chunk_size, errors_path=args.errors or f'{args.path}.errors.ndjson',
+                             progress=print_progress)
+
+    print(f'\nImportación terminada en {report.elapsed:.1f}s')
+    if report.errors_file:
+        print(f'Filas rechazadas en {report.errors_file}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+'''
+Ejecución de trabajos largos (exportaciones, importaciones, purgas) en segundo plano, dentro del propio proceso.
+
+- Pool de workers acotado (config.JOB_WORKERS), cada uno con su propia sesión de BD.
+- El estado de cada trabajo se guarda en la tabla jobs, con el proceso que lo ejecuta (owner: máquina, boot_id
+  y pid) y su heartbeat, que ese proceso renueva cada config.JOB_HEARTBEAT_INTERVAL segundos. Al arrancar y en
+  cada heartbeat, los trabajos en running de un proceso muerto (mismo equipo: el pid ya no existe o el equipo
+  se ha reiniciado) o sin heartbeat desde hace config.JOB_HEARTBEAT_TIMEOUT segundos (otro equipo) vuelven a
+  la cola y se relanzan. Los de otros procesos vivos (p.ej. los demás workers de serve.py) no se tocan. Si un
+  proceso pierde un trabajo así (se quedó sin heartbeat demasiado tiempo), lo deja al guardar su progreso.
+- Cancelación cooperativa: el handler llama a ctx.progress() / ctx.check_cancelled() y, si se ha pedido
+  cancelar, se lanza JobCancelled.
+- Los ficheros de resultado se guardan en config.JOBS_DIR y se descargan con GET /jobs/{id}/result.
+'''
+import logging
+import os
+import socket
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session, sessionmaker
+
+import config
+from crud import job as crud_job
+from exceptions.job_exceptions import JobCancelled
+from models.user import User
+from schemas.user import UserRead
+
+
+logger = logging.getLogger(__name__)
+
+# kind -> handler(ctx, params) -> dict | None (resultado que se guarda en job.result)
+HANDLERS:dict[str, Callable[['JobContext', dict], dict | None]] = {}
+
+
+def _boot_id() -> str:
+    '''Id del arranque del sistema (Linux): distingue un pid reutilizado tras reiniciar el equipo'''
+    try:
+        with open('/proc/sys/kernel/random/boot_id', encoding='ascii') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+_HOST = socket.gethostname()
+_BOOT_ID = _boot_id()
+
+
+def current_owner() -> str:
+    '''Owner de los trabajos de este proceso. El pid se lee cada vez: cambia en los hijos de un fork'''
+    return f'{_HOST}:{_BOOT_ID}:{os.getpid()}'
+
+
+def owner_dead(owner:str) -> bool:
+    '''
+    True si seguro que el proceso `owner` ya no existe: es de este equipo y el equipo se ha reiniciado o el pid
+    no existe. De otro equipo no se puede saber: esos se dan por huérfanos solo por el heartbeat
+    '''
+    host, boot_id, pid = owner.rsplit(':', 2)
+    if host != _HOST:
+        return False
+    if boot_id != _BOOT_ID:
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError): # existe, pero es de otro usuario
+        return False
+    return False
+
+
+def job_handler(kind:str):
+    '''Decorador que registra la función como handler de los trabajos de tipo `kind`'''
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+class JobContext:
+    '''Lo que un handler puede hacer con su trabajo: abrir sesiones, informar del progreso, dejar un fichero...'''
+
+    def __init__(self, runner:'JobRunner', job_id:int, cancel_event:Event, resume_from:int = 0):
+        self.runner = runner
+        self.job_id = job_id
+        self.cancel_event = cancel_event
+        self.resume_from = resume_from # progreso guardado antes de un reinicio
+        self.result_path:str | None = None
+        self._last_saved = 0.0
+
+    def session(self) -> Session:
+        return self.runner.session_factory()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.job_id)
+
+    def progress(self, processed:int, total:int | None = None, force:bool = False):
+        '''Guarda el progreso (como mucho cada config.JOB_PROGRESS_INTERVAL segundos) y comprueba la cancelación'''
+        self.check_cancelled()
+
+        now = time.monotonic()
+        if not force and total is None and now - self._last_saved < config.JOB_PROGRESS_INTERVAL:
+            return
+
+        self._last_saved = now
+        with self.session() as session:
+            if crud_job.update_progress(session, self.job_id, self.runner.owner, processed, total):
+                self.cancel_event.set()
+        self.check_cancelled()
+
+    def will_rerun(self) -> bool:
+        '''
+        Si el trabajo interrumpido se volverá a ejecutar (este proceso se detiene o se lo ha quedado otro): sus
+        ficheros de entrada deben seguir ahí. Si no se puede consultar la BD, se supone que sí
+        '''
+        if self.runner._stopping:
+            return True
+        try:
+            with self.session() as session:
+                job = crud_job.get_job(session, self.job_id)
+                return job is not None and job.status in ('queued', 'running') and job.owner != self.runner.owner
+        except Exception:
+            logger.exception('Error consultando el trabajo %s', self.job_id)
+            return True
+
+    def result_file(self, filename:str) -> str:
+        '''Ruta del fichero de resultado del trabajo (se podrá descargar cuando termine)'''
+        os.makedirs(self.runner.files_dir, exist_ok=True)
+        self.result_path = os.path.join(self.runner.files_dir, f'job-{self.job_id}-{filename}')
+        return self.result_path
+
+
+class JobRunner:
+
+    def __init__(self, session_factory:sessionmaker, workers:int, files_dir:str):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.files_dir = files_dir
+        self.owner = current_owner()
+        self._executor:ThreadPoolExecutor | None = None
+        self._cancel_events:dict[int, Event] = {}
+        self._running:set[int] = set() # reclamados por este proceso
+        self._lock = Lock()
+        self._stopping = False
+        self._stop_heartbeat = Event()
+        self._heartbeat_thread:Thread | None = None
+
+    def start(self):
+        '''Arranca los workers y relanza los trabajos pendientes (incluidos los huérfanos de un reinicio)'''
+        self.owner = current_owner()
+        self._stopping = False
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+
+        with self.session_factory() as session:
+            self._requeue_orphaned(session)
+            pending = crud_job.get_queued_ids(session)
+
+        for job_id in pending:
+            self._dispatch(job_id)
+
+        self._stop_heartbeat.clear()
+        self._heartbeat_thread = Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+        self._heartbeat_thread.start()
+
+    def _requeue_orphaned(self, session:Session) -> list[int]:
+        stale_before = datetime.now(timezone.utc) - timedelta(seconds=config.JOB_HEARTBEAT_TIMEOUT)
+        requeued = crud_job.requeue_orphaned(session, owner_dead, stale_before)
+        if requeued:
+            logger.warning('Trabajos huérfanos devueltos a la cola: %s', requeued)
+        return requeued
+
+    def _heartbeat(self):
+        while not self._stop_heartbeat.wait(config.JOB_HEARTBEAT_INTERVAL):
+            try:
+                with self.session_factory() as session:
+                    owned = set(crud_job.heartbeat(session, self.owner))
+                    requeued = self._requeue_orphaned(session)
+            except Exception:
+                # p.ej. la BD no responde: se reintenta en el siguiente intervalo
+                logger.exception('Error renovando el heartbeat de los trabajos')
+                continue
+
+            with self._lock:
+                # Dados por huérfanos mientras este proceso no podía renovar el heartbeat: ya son de otro
+                lost = [self._cancel_events[job_id] for job_id in self._running - owned
+                        if job_id in self._cancel_events]
+            for event in lost:
+                event.set()
+            for job_id in requeued:
+                self._dispatch(job_id)
+
+    def stop(self, wait:bool = True):
+        '''Para los workers. Los trabajos en curso se interrumpen y vuelven a la cola para el próximo arranque'''
+        if self._executor is None:
+            return
+
+        self._stopping = True
+        self._stop_heartbeat.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+        with self._lock:
+            for event in self._cancel_events.values():
+                event.set()
+
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._executor = None
+
+    def submit(self, kind:str, params:dict) -> int:
+        '''Registra un trabajo y lo encola. Devuelve su id'''
+        if kind not in HANDLERS:
+            raise ValueError(f'Tipo de trabajo desconocido: {kind}')
+
+        with self.session_factory() as session:
+            job_id = crud_job.create_job(session, kind, params).id
+
+        if self._executor is not None:
+            self._dispatch(job_id)
+        return job_id
+
+    def cancel(self, job_id:int):
+        '''Avisa al worker que ejecuta el trabajo (si está en este proceso) de que debe cancelarlo'''
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+        if event:
+            event.set()
+
+    def _dispatch(self, job_id:int):
+        with self._lock:
+            self._cancel_events[job_id] = Event()
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id:int):
+        with self._lock:
+            cancel_event = self._cancel_events.setdefault(job_id, Event())
+
+        try:
+            with self.session_factory() as session:
+                job = crud_job.claim_job(session, job_id, self.owner)
+                if job is None:
+                    return
+                kind, params, processed = job.kind, dict(job.params), job.processed
+
+            with self._lock:
+                self._running.add(job_id)
+            ctx = JobContext(self, job_id, cancel_event, resume_from=processed)
+            self._execute(ctx, kind, params)
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+                self._running.discard(job_id)
+
+    def _execute(self, ctx:JobContext, kind:str, params:dict):
+        try:
+            result = HANDLERS[kind](ctx, params)
+
+        except JobCancelled:
+            status = 'queued' if self._stopping else 'cancelled'
+            with self.session_factory() as session:
+                crud_job.finish_job(session, ctx.job_id, status, owner=self.owner)
+
+        except Exception as e:
+            logger.exception('Error en el trabajo %s (%s)', ctx.job_id, kind)
+            with self.session_factory() as session:
+                crud_job.finish_job(session, ctx.job_id, 'failed', owner=self.owner, error=f'{type(e).__name__}: {e}')
+
+        else:
+            with self.session_factory() as session:
+                crud_job.finish_job(session, ctx.job_id, 'succeeded', owner=self.owner, result=result,
+                                    result_path=ctx.result_path)
+
+
+## HANDLERS ##
+
+@job_handler('export_users')
+def export_users(ctx:JobContext, params:dict) -> dict:
+    '''Exporta todos los usuarios activos a un fichero NDJSON'''
+    path = ctx.result_file('users.ndjson')
+    exported = 0
+
+    with ctx.session() as session, open(path, 'w', encoding='utf-8') as f:
+        ctx.progress(0, session.scalar(select(func.count()).select_from(User).where(User.is_active)))
+
+        users = session.scalars(select(User).where(User.is_active).order_by(User.id)
+                                .execution_options(yield_per=1000))
+        for user in users:
+            f.write(UserRead.model_validate(user).model_dump_json() + '\n')
+            exported += 1
+            if exported % 1000 == 0:
+                ctx.progress(exported)
+                session.expunge_all() # no acumular todo el listado en el identity map
+
+    ctx.progress(exported, force=True)
+    return {'rows': exported}
+
+
+@job_handler('import')
+def import_file(ctx:JobContext, params:dict) -> dict:
+    '''
+    Importa el fichero subido (params: kind, path, format, chunk_size) usando importer.import_rows.
+    El punto desde el que retomar (processed) se guarda en la misma transacción que cada bloque: tras un
+    reinicio se sigue justo después del último bloque confirmado, sin duplicar filas
+    '''
+    from importer import import_rows
+
+    def checkpoint(session:Session, rows_read:int):
+        crud_job.save_checkpoint(session, ctx.job_id, rows_read)
+
+    errors_path = ctx.result_file('errors.ndjson')
+    rerun = False
+    try:
+        with ctx.session() as session, open(params['path'], encoding='utf-8', newline='') as source:
+            report = import_rows(params['kind'], source, params['format'], session,
+                                 chunk_size=params.get('chunk_size', 5000), errors_path=errors_path,
+                                 progress=lambda r: ctx.progress(r.rows_read), skip=ctx.resume_from,
+                                 checkpoint=checkpoint)
+    except BaseException:
+        rerun = ctx.will_rerun()
+        raise
+    finally:
+        # El fichero subido solo hace falta para retomar la importación: si ha terminado, ha fallado o se ha
+        # cancelado, no se queda en config.JOBS_DIR
+        if not rerun:
+            with suppress(FileNotFoundError):
+                os.remove(params['path'])
+
+    if not report.errors_file:
+        ctx.result_path = None
+    return report.model_dump()
+
+
+def _default_runner() -> JobRunner:
+    from db import SessionLocal
+    return JobRunner(SessionLocal, config.JOB_WORKERS, config.JOBS_DIR)
+
+
+runner = _default_runner()
@@ -1,7 +1,64 @@
-from fastapi import FastAPI
-from routers import user
+from contextlib import asynccontextmanager
+
+from anyio import to_thread
+from fastapi import FastAPI, Request
+
+import config
+from middleware.concurrency import ConcurrencyLimitMiddleware
+from middleware.compression import CompressionMiddleware
+from middleware.idempotency import IdempotencyMiddleware
+from middleware.deadline import DeadlineMiddleware, deadline_exceeded_response
+from middleware.profiling import ProfilingMiddleware
+from exceptions.deadline_exceptions import DeadlineExceeded
+from db import engine, shard_engines
+from job_runner import runner
+from partitions import ensure_partitions
+from purge import worker as purge_worker
+from change_feed import feed as change_feed
+from username_filter import username_filter
+from routers import user, metrics, imports, jobs, changes, events, profiles, batch
+
+
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    # El threadpool se dimensiona con el mismo config que el pool de conexiones (ver config.THREADPOOL_SIZE)
+    to_thread.current_default_thread_limiter().total_tokens = config.THREADPOOL_SIZE
+    ensure_partitions(shard_engines or [engine])
+    change_feed.start()
+    runner.start()
+    purge_worker.start()
+    username_filter.start()
+    yield
+    username_filter.stop()
+    purge_worker.stop()
+    runner.stop()
+    change_feed.stop()
+
+
+app = FastAPI(title='Journal', version='1.0.0', lifespan=lifespan)
+
+# Middlewares
+# El último añadido es el más externo: las repeticiones con Idempotency-Key no consumen hueco del limitador
+app.add_middleware(ConcurrencyLimitMiddleware)
+app.add_middleware(DeadlineMiddleware) # por fuera del limitador: el tiempo en cola cuenta para el deadline
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(CompressionMiddleware)
+# Solo se instala si está activado: sin él no hay ningún coste por petición
+if config.PROFILE_SAMPLE_RATE or config.PROFILE_SECRET:
+    app.add_middleware(ProfilingMiddleware)
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request:Request, exc:DeadlineExceeded):
+    return deadline_exceeded_response()
 
-app = FastAPI(title='Journal', version='1.0.0')
 
 # Routers
 app.include_router(user.router)
+app.include_router(metrics.router)
+app.include_router(imports.router)
+app.include_router(jobs.router)
+app.include_router(changes.router)
+app.include_router(events.router)
+app.include_router(profiles.router)
+app.include_router(batch.router)
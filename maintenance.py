@@ -0,0 +1,86 @@
+'''
+Tareas de mantenimiento de la BD.
+
+Uso:
+    python -m maintenance note-counts [--repair] [--install-triggers]
+    python -m maintenance purge-users [--batch-size N] [--max-seconds S]
+    python -m maintenance partitions [--drop]
+
+note-counts comprueba que users.note_count coincide con el número real de notas de cada usuario.
+Con --repair corrige las diferencias y con --install-triggers (re)crea antes los triggers que lo mantienen
+(necesario en BD creadas antes de existir la columna; create_all solo los crea junto con la tabla notes).
+Sale con código 1 si quedan diferencias sin corregir.
+
+purge-users hace una pasada de la purga de usuarios dados de baja (ver purge.py), igual que el worker
+de la API. Sale con código 1 si se agota el tiempo antes de terminar.
+
+partitions crea las particiones mensuales futuras de notes y separa las que quedan fuera de la retención
+(config.NOTES_RETENTION_MONTHS); con --drop además las borra. Ver partitions.py. Pensado para lanzarlo a diario.
+'''
+import argparse
+import sys
+
+from crud.user import get_note_count_drift, repair_note_count
+from models.note import install_note_count_triggers
+
+
+def note_counts(session_factory, engines, repair:bool = False, install_triggers:bool = False) -> int:
+    '''Devuelve cuántos usuarios siguen con el note_count desincronizado'''
+    if install_triggers:
+        for engine in engines:
+            with engine.begin() as connection:
+                install_note_count_triggers(connection)
+        print('Triggers de note_count instalados')
+
+    with session_factory() as session:
+        drift = get_note_count_drift(session)
+
+    for row in drift:
+        print(f"usuario {row['id']}: note_count={row['note_count']}, notas={row['actual']}")
+    print(f'{len(drift)} usuarios con note_count desincronizado')
+
+    if not repair or not drift:
+        return len(drift)
+
+    for row in drift:
+        with session_factory() as session:
+            repair_note_count(session, row['id'])
+    print(f'{len(drift)} usuarios corregidos')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tareas de mantenimiento de la BD')
+    commands = parser.add_subparsers(dest='command', required=True)
+    counts = commands.add_parser('note-counts', help='Comprueba (y corrige) users.note_count')
+    counts.add_argument('--repair', action='store_true', help='Corrige las diferencias encontradas')
+    counts.add_argument('--install-triggers', action='store_true', help='(Re)crea los triggers de note_count')
+    purge_users = commands.add_parser('purge-users', help='Borra los usuarios dados de baja y sus notas')
+    purge_users.add_argument('--batch-size', type=int, default=None, help='Filas por lote')
+    purge_users.add_argument('--max-seconds', type=float, default=None, help='Duración máxima de la pasada')
+    partitions = commands.add_parser('partitions', help='Crea las particiones futuras de notes y aplica la retención')
+    partitions.add_argument('--drop', action='store_true', help='Borra las particiones separadas por la retención')
+    args = parser.parse_args()
+
+    import db # import tardío: no conectar con la BD solo por importar el módulo
+
+    if args.command == 'note-counts':
+        engines = db.shard_engines or [db.engine]
+        remaining = note_counts(db.SessionLocal, engines, args.repair, args.install_triggers)
+        sys.exit(1 if remaining else 0)
+
+    if args.command == 'purge-users':
+        from purge import purge
+        report = purge(db.shard_engines or [db.engine], args.batch_size, args.max_seconds)
+        print(report.model_dump_json(indent=2))
+        sys.exit(0 if report.finished else 1)
+
+    if args.command == 'partitions':
+        from partitions import maintain
+        result = maintain(db.shard_engines or [db.engine], args.drop)
+        print(f"Particiones creadas: {', '.join(result['created']) or '-'}")
+        print(f"Particiones {'borradas' if args.drop else 'separadas'}: {', '.join(result['removed']) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
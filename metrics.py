@@ -0,0 +1,76 @@
+'''
+Métricas en memoria del proceso, expuestas en formato de texto de Prometheus (GET /metrics).
+Son contadores/gauges sencillos protegidos por un lock: los endpoints síncronos corren en el threadpool
+'''
+from threading import Lock
+
+
+_registry:list['_Metric'] = []
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name:str, description:str, labels:tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values:dict[tuple, float] = {}
+        self._lock = Lock()
+        _registry.append(self)
+
+    def _key(self, labels:dict) -> tuple:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _add(self, amount:float, labels:dict):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = list(self._values.items())
+
+        for key, value in items:
+            if key:
+                label_str = ','.join(f'{label}="{v}"' for label, v in zip(self.labels, key))
+                lines.append(f'{self.name}{{{label_str}}} {value:g}')
+            else:
+                lines.append(f'{self.name} {value:g}')
+        return lines
+
+
+class Counter(_Metric):
+    '''Valor que solo crece (peticiones rechazadas, filas procesadas...)'''
+    kind = 'counter'
+
+    def inc(self, amount:float = 1, **labels):
+        self._add(amount, labels)
+
+
+class Gauge(_Metric):
+    '''Valor que sube y baja (peticiones en cola, conexiones abiertas...)'''
+    kind = 'gauge'
+
+    def inc(self, amount:float = 1, **labels):
+        self._add(amount, labels)
+
+    def dec(self, amount:float = 1, **labels):
+        self._add(-amount, labels)
+
+    def set(self, value:float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+def render() -> str:
+    '''Devuelve todas las métricas registradas en formato de exposición de Prometheus'''
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
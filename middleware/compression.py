@@ -0,0 +1,192 @@
+'''
+Compresión de respuestas negociada por Accept-Encoding (zstd > br > gzip).
+
+- Las respuestas pequeñas (menos de config.COMPRESSION_MIN_SIZE bytes) se envían sin comprimir.
+- Las respuestas en streaming se comprimen trozo a trozo, sin acumular el cuerpo en memoria.
+- zstd y brotli son opcionales: si su librería no está instalada simplemente no se ofrecen.
+'''
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Tipos que ya van comprimidos o que no deben retenerse en un buffer del compresor
+EXCLUDED_CONTENT_TYPES = ('text/event-stream', 'image/', 'video/', 'audio/', 'application/zip',
+                          'application/gzip', 'application/zstd')
+
+
+class GzipCompressor:
+    def __init__(self, level:int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> formato gzip
+
+    def compress(self, data:bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, level:int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data:bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self, level:int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data:bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def available_encodings() -> dict[str, tuple[type, int]]:
+    '''Codificaciones soportadas en orden de preferencia -> (clase compresora, nivel)'''
+    encodings = {}
+    if zstandard is not None:
+        encodings['zstd'] = (ZstdCompressor, config.ZSTD_LEVEL)
+    if brotli is not None:
+        encodings['br'] = (BrotliCompressor, config.BROTLI_QUALITY)
+    encodings['gzip'] = (GzipCompressor, config.GZIP_LEVEL)
+    return encodings
+
+
+def negotiate(accept_encoding:str, encodings:dict) -> str | None:
+    '''
+    Elige la codificación a partir de la cabecera Accept-Encoding. Se descartan las que el cliente
+    marca con q=0 y, entre las aceptadas, gana la de mayor q (a igualdad, la preferida por el servidor)
+    '''
+    accepted:dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+
+    wildcard = accepted.get('*')
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = accepted.get(encoding, wildcard if wildcard is not None else 0.0)
+        if q > best_q:
+            best, best_q = encoding, q
+
+    return best
+
+
+class CompressionMiddleware:
+    '''Middleware ASGI que comprime el cuerpo de la respuesta con la mejor codificación aceptada'''
+
+    def __init__(self, app:ASGIApp, minimum_size:int | None = None):
+        self.app = app
+        self.minimum_size = config.COMPRESSION_MIN_SIZE if minimum_size is None else minimum_size
+        self.encodings = available_encodings()
+
+    async def __call__(self, scope:Scope, receive:Receive, send:Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get('accept-encoding', ''), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        compressor_class, level = self.encodings[encoding]
+        responder = _CompressionResponder(send, encoding, compressor_class, level, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    '''Estado de una respuesta: retiene el http.response.start hasta ver el primer trozo del cuerpo'''
+
+    def __init__(self, send:Send, encoding:str, compressor_class:type, level:int, minimum_size:int):
+        self._send = send
+        self.encoding = encoding
+        self.compressor_class = compressor_class
+        self.level = level
+        self.minimum_size = minimum_size
+        self.start_message:Message | None = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def send(self, message:Message):
+        if message['type'] == 'http.response.start':
+            headers = Headers(raw=message['headers'])
+            content_type = headers.get('content-type', '')
+            self.passthrough = ('content-encoding' in headers
+                                or content_type.startswith(EXCLUDED_CONTENT_TYPES))
+            self.start_message = message
+            if self.passthrough:
+                await self._send(message)
+            return
+
+        if message['type'] != 'http.response.body' or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+        if self.compressor is None:
+            # Primer trozo: se decide si comprimir
+            headers = MutableHeaders(raw=self.start_message['headers'])
+            declared_length = headers.get('content-length')
+            size = len(body) if not more_body else int(declared_length) if declared_length else None
+
+            if size is not None and size < self.minimum_size:
+                self.passthrough = True
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+
+            self.compressor = self.compressor_class(self.level)
+            headers['Content-Encoding'] = self.encoding
+            headers.add_vary_header('Accept-Encoding')
+
+            if not more_body:
+                compressed = self.compressor.compress(body) + self.compressor.finish()
+                headers['Content-Length'] = str(len(compressed))
+                await self._send(self.start_message)
+                await self._send({'type': 'http.response.body', 'body': compressed})
+                return
+
+            # Streaming: la longitud final no se conoce
+            del headers['Content-Length']
+            await self._send(self.start_message)
+
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.finish()
+
+        if chunk or not more_body:
+            await self._send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
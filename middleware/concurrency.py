@@ -0,0 +1,136 @@
+'''
+Control de admisión delante del pool de conexiones.
+
+Cuando Postgres se ralentiza, las peticiones se acumulan en el threadpool esperando una conexión
+hasta que el cliente hace timeout. Este middleware limita cuántas peticiones de cada clase
+(lecturas / escrituras) se ejecutan a la vez, deja esperar a unas pocas en una cola acotada
+y rechaza el resto al instante con 503 + Retry-After.
+'''
+import asyncio
+from collections import deque
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+import config
+from metrics import Counter, Gauge
+from middleware.deadline import remaining, deadline_exceeded_response
+
+
+READ_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+QUEUE_DEPTH = Gauge('journal_admission_queue_depth', 'Peticiones esperando turno', ('route_class',))
+IN_FLIGHT = Gauge('journal_admission_in_flight', 'Peticiones en ejecución', ('route_class',))
+REJECTED = Counter('journal_admission_rejected_total', 'Peticiones rechazadas con 503', ('route_class', 'reason'))
+
+
+class Limiter:
+    '''
+    Semáforo con cola de espera acotada. No usa asyncio.Semaphore para no quedar ligado
+    a un event loop concreto (el TestClient crea uno nuevo por petición)
+    '''
+
+    def __init__(self, route_class:str, limit:int, queue_size:int, timeout:float):
+        self.route_class = route_class
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self._waiters:deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout:float | None = None) -> str | None:
+        '''
+        Intenta obtener un hueco. Devuelve None si lo consigue o el motivo del rechazo:
+        - 'queue_full' -> la cola de espera está llena
+        - 'timeout' -> se ha esperado más de `timeout` segundos (por defecto self.timeout)
+        '''
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            IN_FLIGHT.inc(route_class=self.route_class)
+            return None
+
+        if len(self._waiters) >= self.queue_size:
+            return 'queue_full'
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        QUEUE_DEPTH.inc(route_class=self.route_class)
+        handed_over = False
+        try:
+            # asyncio.wait no cancela el futuro al expirar, así se puede comprobar si release() llegó a tiempo
+            await asyncio.wait({waiter}, timeout=self.timeout if timeout is None else timeout)
+            handed_over = True
+        finally:
+            QUEUE_DEPTH.dec(route_class=self.route_class)
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            elif not handed_over and not waiter.cancelled():
+                # Cancelada (p.ej. el cliente se desconecta) justo después de que release() le cediera
+                # el hueco: nadie lo va a liberar, se pasa al siguiente
+                self.release()
+
+        if waiter.cancelled():
+            return 'timeout'
+
+        # release() nos ha traspasado su hueco, in_flight no cambia
+        return None
+
+    def release(self):
+        '''Libera el hueco, cediéndoselo directamente al primero de la cola si lo hay'''
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.in_flight -= 1
+        IN_FLIGHT.dec(route_class=self.route_class)
+
+
+class ConcurrencyLimitMiddleware:
+    '''Middleware ASGI que aplica un Limiter por clase de ruta (lectura / escritura)'''
+
+    def __init__(self, app:ASGIApp, exclude_paths:tuple[str, ...] = ('/metrics', '/events')):
+        self.app = app
+        self.exclude_paths = exclude_paths
+        self.limiters = {
+            'read': Limiter('read', config.LIMIT_READS, config.QUEUE_SIZE_READS, config.QUEUE_TIMEOUT),
+            'write': Limiter('write', config.LIMIT_WRITES, config.QUEUE_SIZE_WRITES, config.QUEUE_TIMEOUT),
+        }
+
+    async def __call__(self, scope:Scope, receive:Receive, send:Send):
+        # Las conexiones de larga duración (SSE) no ocupan hueco: no usan el pool mientras esperan
+        if scope['type'] != 'http' or scope['path'].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        route_class = 'read' if scope['method'] in READ_METHODS else 'write'
+        limiter = self.limiters[route_class]
+
+        # No se espera turno más allá del deadline de la petición (middleware.deadline)
+        left = remaining()
+        reason = await limiter.acquire(None if left is None else max(min(left, limiter.timeout), 0))
+        if reason == 'timeout' and left is not None and left <= limiter.timeout:
+            REJECTED.inc(route_class=route_class, reason='deadline')
+            await deadline_exceeded_response()(scope, receive, send)
+            return
+        if reason:
+            REJECTED.inc(route_class=route_class, reason=reason)
+            response = JSONResponse(
+                {'detail': 'Servicio saturado, inténtelo de nuevo más tarde'},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(config.RETRY_AFTER)}
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
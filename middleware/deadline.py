@@ -0,0 +1,100 @@
+'''
+Deadlines por petición.
+
+Cada petición recibe un presupuesto de tiempo: el de la cabecera X-Request-Timeout (segundos) o el
+por defecto de su ruta. El instante límite se guarda en un contextvar, que se copia a los hilos del
+threadpool donde corren get_db y los endpoints síncronos, así cualquier llamada posterior puede
+consultar cuánto le queda (remaining()):
+- la cola de admisión no espera más allá del límite (middleware.concurrency),
+- cada transacción de get_db se abre con SET LOCAL statement_timeout = lo que quede (db.py), así
+  Postgres cancela la consulta en vez de dejar la conexión ocupada indefinidamente.
+
+Si se agota se responde 504. La respuesta lleva X-Request-Timeout con el presupuesto aplicado.
+'''
+import time
+from contextvars import ContextVar
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import config
+from exceptions.deadline_exceptions import DeadlineExceeded
+
+
+HEADER = 'x-request-timeout'
+
+_deadline:ContextVar[float | None] = ContextVar('deadline', default=None)
+
+
+def current_deadline() -> float | None:
+    '''Instante límite (time.monotonic) de la petición en curso, o None fuera de una petición'''
+    return _deadline.get()
+
+
+def remaining(deadline:float | None = None) -> float | None:
+    '''Segundos que le quedan a la petición en curso (None si no tiene límite)'''
+    deadline = current_deadline() if deadline is None else deadline
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(deadline:float | None = None) -> float | None:
+    '''Devuelve lo que queda del presupuesto o lanza DeadlineExceeded si ya no queda nada'''
+    left = remaining(deadline)
+    if left is not None and left <= 0:
+        raise DeadlineExceeded()
+    return left
+
+
+def deadline_exceeded_response() -> JSONResponse:
+    return JSONResponse({'detail': DeadlineExceeded().message}, status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+
+
+class DeadlineMiddleware:
+    '''Fija el deadline de cada petición HTTP. Debe ir por fuera del control de admisión'''
+
+    def __init__(self, app:ASGIApp, route_timeouts:dict[str, float] | None = None,
+                 exclude_paths:tuple[str, ...] = ('/metrics', '/events')):
+        self.app = app
+        # Presupuesto por defecto por prefijo de ruta (el prefijo más largo que coincida)
+        self.route_timeouts = sorted((route_timeouts if route_timeouts is not None
+                                      else {'/imports': config.REQUEST_TIMEOUT_IMPORTS}).items(),
+                                     key=lambda item: len(item[0]), reverse=True)
+        self.exclude_paths = exclude_paths
+
+    def default_timeout(self, path:str) -> float:
+        for prefix, timeout in self.route_timeouts:
+            if path.startswith(prefix):
+                return timeout
+        return config.REQUEST_TIMEOUT
+
+    async def __call__(self, scope:Scope, receive:Receive, send:Send):
+        # Las conexiones de larga duración (SSE) no tienen deadline
+        if scope['type'] != 'http' or scope['path'].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        timeout = self.default_timeout(scope['path'])
+        requested = Headers(scope=scope).get(HEADER)
+        if requested is not None:
+            try:
+                timeout = float(requested)
+                if not timeout > 0: # también descarta nan
+                    raise ValueError
+            except ValueError:
+                await JSONResponse({'detail': f'{HEADER} debe ser un número de segundos mayor que 0'},
+                                   status_code=status.HTTP_400_BAD_REQUEST)(scope, receive, send)
+                return
+            timeout = min(timeout, config.REQUEST_TIMEOUT_MAX)
+
+        async def send_with_timeout(message:Message):
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message)['X-Request-Timeout'] = f'{timeout:g}'
+            await send(message)
+
+        token = _deadline.set(time.monotonic() + timeout)
+        try:
+            await self.app(scope, receive, send_with_timeout)
+        finally:
+            _deadline.reset(token)
@@ -0,0 +1,290 @@
+'''
+Soporte de la cabecera Idempotency-Key en POST / PUT / PATCH.
+
+La primera petición con una clave se ejecuta normalmente y su respuesta (status + cuerpo) se guarda,
+por cliente y clave, en una LRU en memoria y en la tabla idempotency_keys. Los reintentos con la misma
+clave reciben la respuesta original sin volver a ejecutar el endpoint (ni tocar crud.user).
+
+- Si la clave se reutiliza con otra petición (otro método, ruta o cuerpo) -> 422.
+- Si llega un duplicado mientras la original sigue en curso, espera a que termine y devuelve su respuesta
+  (409 si la espera supera config.IDEMPOTENCY_WAIT_TIMEOUT).
+- Las respuestas 5xx no se guardan: el cliente puede reintentar.
+- El cuerpo de la petición se resume (sha256) a medida que llega y se guarda en un fichero temporal en
+  memoria que pasa a disco por encima de config.IDEMPOTENCY_MAX_BODY: una subida de varios MB a /imports
+  no se queda entera en memoria.
+
+Con varios procesos (serve.py) la LRU es de cada uno, pero solo guarda respuestas terminadas, que no cambian:
+la reserva de la clave (crud.idempotency.claim_key) y la espera de los duplicados van por la tabla, así que un
+reintento que llega a otro proceso tampoco vuelve a ejecutar el endpoint.
+'''
+import asyncio
+import hashlib
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from fastapi import status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy.orm import sessionmaker
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import config
+from crud import idempotency as crud_idempotency
+from models.idempotency import IdempotencyRecord
+
+
+METHODS = frozenset({'POST', 'PUT', 'PATCH'})
+HEADER = 'idempotency-key'
+CLIENT_HEADER = 'x-client-id'
+# Las columnas de idempotency_keys: una cabecera más larga no se podría guardar (DataError en Postgres)
+MAX_KEY_LENGTH = IdempotencyRecord.__table__.c.key.type.length
+MAX_CLIENT_LENGTH = IdempotencyRecord.__table__.c.client.type.length
+
+
+class StoredResponse(NamedTuple):
+    fingerprint:str
+    status_code:int | None
+    content_type:str | None
+    body:bytes | None
+    expires_at:datetime | None = None
+
+
+class LRUCache:
+    '''
+    LRU mínima sobre OrderedDict con caducidad por entrada (la misma que el registro en BD: pasado
+    IDEMPOTENCY_TTL la clave ya no repite la respuesta). Solo se usa desde el event loop, no necesita lock
+    '''
+
+    def __init__(self, max_entries:int):
+        self.max_entries = max_entries
+        self._data:OrderedDict = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if time.monotonic() >= expires:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value, ttl:float):
+        if ttl <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
+class IdempotencyMiddleware:
+
+    def __init__(self, app:ASGIApp, session_factory:sessionmaker | None = None):
+        self.app = app
+        self._session_factory = session_factory
+        self.cache = LRUCache(config.IDEMPOTENCY_CACHE_SIZE)
+        self._in_flight:dict[tuple[str, str], asyncio.Future] = {}
+        self._last_purge = time.monotonic()
+
+    @property
+    def session_factory(self) -> sessionmaker:
+        if self._session_factory is None:
+            from db import SessionLocal # import tardío: el middleware se crea antes de que haga falta la BD
+            self._session_factory = SessionLocal
+        return self._session_factory
+
+    async def __call__(self, scope:Scope, receive:Receive, send:Send):
+        if scope['type'] != 'http' or scope['method'] not in METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        key = headers.get(HEADER)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await JSONResponse({'detail': f'Idempotency-Key debe tener entre 1 y {MAX_KEY_LENGTH} caracteres'},
+                               status_code=status.HTTP_400_BAD_REQUEST)(scope, receive, send)
+            return
+
+        client = headers.get(CLIENT_HEADER) or (scope['client'][0] if scope.get('client') else 'anonymous')
+        if len(client) > MAX_CLIENT_LENGTH:
+            await JSONResponse({'detail': f'X-Client-Id debe tener como mucho {MAX_CLIENT_LENGTH} caracteres'},
+                               status_code=status.HTTP_400_BAD_REQUEST)(scope, receive, send)
+            return
+        cache_key = (client, key)
+        with tempfile.SpooledTemporaryFile(max_size=config.IDEMPOTENCY_MAX_BODY) as body:
+            # Mismo resumen que sha256(método \0 ruta \0 query \0 cuerpo), calculado sin juntar el cuerpo
+            digest = hashlib.sha256(b'\0'.join([scope['method'].encode(), scope['path'].encode(),
+                                                scope['query_string'], b'']))
+            await _read_body(receive, body, digest)
+            fingerprint = digest.hexdigest()
+
+            stored = await self._wait_for_stored_or_claim(cache_key, fingerprint)
+            if stored is not None:
+                await self._replay(stored, fingerprint, scope, receive, send)
+                return
+
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[cache_key] = future
+            try:
+                await self._execute(cache_key, fingerprint, body, scope, receive, send)
+            finally:
+                self._in_flight.pop(cache_key, None)
+                future.set_result(None)
+
+    async def _wait_for_stored_or_claim(self, cache_key:tuple[str, str], fingerprint:str) -> StoredResponse | None:
+        '''
+        Devuelve la respuesta guardada para la clave o None si esta petición ha reservado la clave y debe ejecutarse.
+        Un StoredResponse con status_code None significa que se ha agotado la espera a la petición original
+        '''
+        deadline = time.monotonic() + config.IDEMPOTENCY_WAIT_TIMEOUT
+        poll = 0.05
+
+        while True:
+            stored = self.cache.get(cache_key)
+            if stored is not None:
+                return stored
+
+            # Duplicado en este mismo proceso: se espera al futuro de la original, sin consultar la BD
+            in_flight = self._in_flight.get(cache_key)
+            if in_flight is not None:
+                try:
+                    await asyncio.wait_for(asyncio.shield(in_flight), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    return StoredResponse(fingerprint, None, None, None)
+                continue
+
+            stored = await run_in_threadpool(self._claim, cache_key, fingerprint)
+            if stored is None:
+                return None
+
+            if stored.status_code is not None:
+                self.cache.put(cache_key, stored, _seconds_left(stored.expires_at))
+                return stored
+
+            if stored.fingerprint != fingerprint or time.monotonic() >= deadline:
+                return stored
+
+            # La original está en curso en otro proceso
+            await asyncio.sleep(poll)
+            poll = min(poll * 2, 1)
+
+    def _claim(self, cache_key:tuple[str, str], fingerprint:str) -> StoredResponse | None:
+        with self.session_factory() as session:
+            record = crud_idempotency.claim_key(session, *cache_key, fingerprint, config.IDEMPOTENCY_TTL,
+                                                config.IDEMPOTENCY_LOCK_TIMEOUT)
+            if record is None:
+                return None
+            return StoredResponse(record.fingerprint, record.status_code, record.content_type, record.body,
+                                  record.expires_at)
+
+    async def _replay(self, stored:StoredResponse, fingerprint:str, scope:Scope, receive:Receive, send:Send):
+        if stored.fingerprint != fingerprint:
+            response = JSONResponse({'detail': 'Idempotency-Key ya utilizada con una petición distinta'},
+                                    status_code=status.HTTP_422_UNPROCESSABLE_CONTENT)
+        elif stored.status_code is None:
+            response = JSONResponse({'detail': 'Hay una petición con la misma Idempotency-Key en curso'},
+                                    status_code=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+        else:
+            response = Response(stored.body, status_code=stored.status_code, media_type=stored.content_type,
+                                headers={'Idempotent-Replayed': 'true'})
+        await response(scope, receive, send)
+
+    async def _execute(self, cache_key:tuple[str, str], fingerprint:str, body:tempfile.SpooledTemporaryFile,
+                       scope:Scope, receive:Receive, send:Send):
+        '''Ejecuta la petición reenviando la respuesta al cliente y guardando una copia'''
+        response_start:Message | None = None
+        chunks:list[bytes] = []
+        size = 0
+
+        async def capture(message:Message):
+            nonlocal response_start, size
+            if message['type'] == 'http.response.start':
+                response_start = message
+            elif message['type'] == 'http.response.body' and size <= config.IDEMPOTENCY_MAX_BODY:
+                chunk = message.get('body', b'')
+                chunks.append(chunk)
+                size += len(chunk)
+            await send(message)
+
+        stored = None
+        try:
+            await self.app(scope, _replay_body(body, receive), capture)
+        finally:
+            if (response_start is not None and response_start['status'] < 500
+                    and size <= config.IDEMPOTENCY_MAX_BODY):
+                content_type = Headers(raw=response_start['headers']).get('content-type')
+                stored = StoredResponse(fingerprint, response_start['status'], content_type, b''.join(chunks))
+                await run_in_threadpool(self._complete, cache_key, stored)
+                self.cache.put(cache_key, stored, config.IDEMPOTENCY_TTL)
+            else:
+                await run_in_threadpool(self._release, cache_key)
+
+        if stored is not None and time.monotonic() - self._last_purge > config.IDEMPOTENCY_PURGE_INTERVAL:
+            self._last_purge = time.monotonic()
+            await run_in_threadpool(self._purge)
+
+    def _complete(self, cache_key:tuple[str, str], stored:StoredResponse):
+        with self.session_factory() as session:
+            crud_idempotency.complete_key(session, *cache_key, stored.status_code, stored.content_type, stored.body)
+
+    def _release(self, cache_key:tuple[str, str]):
+        with self.session_factory() as session:
+            crud_idempotency.release_key(session, *cache_key)
+
+    def _purge(self):
+        with self.session_factory() as session:
+            crud_idempotency.purge_expired(session)
+
+
+def _seconds_left(expires_at:datetime | None) -> float:
+    if expires_at is None:
+        return config.IDEMPOTENCY_TTL
+    if expires_at.tzinfo is None: # SQLite no guarda la zona: se guardó en UTC
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return (expires_at - datetime.now(timezone.utc)).total_seconds()
+
+
+# Tamaño de los fragmentos en que se vuelve a entregar el cuerpo guardado
+_BODY_CHUNK = 64 * 1024
+
+
+async def _read_body(receive:Receive, body:tempfile.SpooledTemporaryFile, digest):
+    '''Lee el cuerpo entero guardándolo en `body` y añadiéndolo al resumen `digest` fragmento a fragmento'''
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunk = message.get('body', b'')
+        digest.update(chunk)
+        body.write(chunk)
+        if not message.get('more_body', False):
+            break
+    body.seek(0)
+
+
+def _replay_body(body:tempfile.SpooledTemporaryFile, receive:Receive) -> Receive:
+    '''receive que entrega el cuerpo ya leído por fragmentos y después delega en el original (para http.disconnect)'''
+    finished = False
+
+    async def wrapped() -> Message:
+        nonlocal finished
+        if not finished:
+            chunk = body.read(_BODY_CHUNK)
+            finished = len(chunk) < _BODY_CHUNK
+            return {'type': 'http.request', 'body': chunk, 'more_body': not finished}
+        return await receive()
+
+    return wrapped
@@ -0,0 +1,238 @@
+'''
+Profiling por muestreo de peticiones concretas.
+
+Una petición se perfila si trae una cabecera X-Profile firmada (ver profile_token) o si le toca por
+muestreo (1 de cada config.PROFILE_SAMPLE_RATE). Mientras dura, un hilo toma cada
+config.PROFILE_INTERVAL segundos las pilas de los hilos ocupados (event loop y threadpool) con
+sys._current_frames; así se ve si el tiempo se va en SQLAlchemy, en validar con Pydantic o en
+serializar a JSON. Con otras peticiones en curso a la vez sus pilas también aparecen en la muestra.
+
+Cada perfil se guarda en config.PROFILE_DIR en formato speedscope (https://www.speedscope.app),
+etiquetado con la plantilla de la ruta (p.ej. GET /users/{id}), y se puede descargar también como
+pilas colapsadas (flamegraph.pl). Solo se conservan los config.PROFILE_MAX_FILES más recientes.
+
+Sin muestreo ni secreto el middleware no se instala (main.py): coste cero cuando está desactivado.
+'''
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import config
+
+
+HEADER = 'x-profile'
+SUFFIX = '.speedscope.json'
+PROFILE_ID = re.compile(r'^\d+-[0-9a-f]+$')
+
+# Un hilo cuya pila termina en estos ficheros está esperando (event loop sin trabajo, threadpool libre...)
+IDLE_FILES = frozenset({'threading.py', 'queue.py', 'selectors.py'})
+
+Frame = tuple[str, str, int] # (función, fichero, línea de la definición)
+
+
+def profile_token(secret:str, ttl:float = 300) -> str:
+    '''Valor de X-Profile válido durante `ttl` segundos: "<caducidad>.<hmac-sha256 de la caducidad>"'''
+    expires = str(int(time.time() + ttl))
+    return f'{expires}.{hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()}'
+
+
+def verify_token(secret:str, token:str) -> bool:
+    expires, _, signature = token.partition('.')
+    if not secret or not expires.isdigit() or int(expires) < time.time():
+        return False
+    expected = hmac.new(secret.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+class Sampler:
+    '''Hilo que acumula las pilas de los hilos ocupados hasta que se llama a stop()'''
+
+    def __init__(self, interval:float):
+        self.interval = interval
+        self.stacks:Counter[tuple[Frame, ...]] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own and os.path.basename(frame.f_code.co_filename) not in IDLE_FILES:
+                    self.stacks[_stack(frame)] += 1
+
+    def to_speedscope(self, name:str, duration_ms:float, metadata:dict) -> dict:
+        frames:dict[Frame, int] = {}
+        samples, weights = [], []
+        for stack, count in self.stacks.items():
+            samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+            weights.append(count * self.interval * 1000)
+
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'journal',
+            'shared': {'frames': [{'name': n, 'file': f, 'line': l} for n, f, l in frames]},
+            'profiles': [{
+                'type': 'sampled', 'name': name, 'unit': 'milliseconds',
+                'startValue': 0, 'endValue': duration_ms, 'samples': samples, 'weights': weights,
+            }],
+            'metadata': metadata,
+        }
+
+
+def _stack(frame) -> tuple[Frame, ...]:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+def to_collapsed(profile:dict) -> str:
+    '''Convierte un perfil speedscope a pilas colapsadas ("raíz;...;hoja muestras" por línea)'''
+    frames = profile['shared']['frames']
+    interval_ms = profile['metadata']['interval_ms']
+    data = profile['profiles'][0]
+    lines = []
+    for stack, weight in zip(data['samples'], data['weights']):
+        names = ';'.join(f"{frames[i]['name']} ({os.path.basename(frames[i]['file'])}:{frames[i]['line']})"
+                         for i in stack)
+        lines.append(f'{names} {max(round(weight / interval_ms), 1)}')
+    return '\n'.join(lines) + '\n'
+
+
+class ProfileStore:
+    '''Perfiles en disco, acotados a los `max_files` más recientes'''
+
+    def __init__(self, directory:str | None = None, max_files:int | None = None):
+        self.directory = Path(directory or config.PROFILE_DIR)
+        self.max_files = max_files or config.PROFILE_MAX_FILES
+
+    def new_id(self) -> str:
+        # empieza por los milisegundos: el orden por nombre es el cronológico
+        return f'{time.time_ns() // 1_000_000}-{secrets.token_hex(3)}'
+
+    def path(self, profile_id:str) -> Path | None:
+        '''Ruta del perfil o None si el id no es válido (evita salirse de la carpeta)'''
+        return self.directory / f'{profile_id}{SUFFIX}' if PROFILE_ID.match(profile_id) else None
+
+    def save(self, profile_id:str, profile:dict):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.directory / f'.{profile_id}.tmp'
+        tmp.write_text(json.dumps(profile, separators=(',', ':')))
+        tmp.replace(self.path(profile_id))
+
+        for old in self._files()[:-self.max_files]:
+            old.unlink(missing_ok=True)
+
+    def load(self, profile_id:str) -> dict | None:
+        path = self.path(profile_id)
+        if path is None or not path.is_file():
+            return None
+        return json.loads(path.read_text())
+
+    def recent(self) -> list[dict]:
+        '''Metadatos de los perfiles guardados, del más reciente al más antiguo'''
+        result = []
+        for path in reversed(self._files()):
+            try:
+                result.append(json.loads(path.read_text())['metadata'])
+            except (OSError, ValueError, KeyError): # borrado por la rotación mientras se listaba
+                continue
+        return result
+
+    def _files(self) -> list[Path]:
+        if not self.directory.is_dir():
+            return []
+        return sorted(self.directory.glob(f'*{SUFFIX}'), key=lambda p: int(p.name.split('-', 1)[0]))
+
+
+class ProfilingMiddleware:
+
+    def __init__(self, app:ASGIApp, sample_rate:int | None = None, secret:str | None = None,
+                 interval:float | None = None, store:ProfileStore | None = None,
+                 exclude_paths:tuple[str, ...] = ('/metrics', '/events', '/admin/profiles')):
+        self.app = app
+        self.sample_rate = config.PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.secret = config.PROFILE_SECRET if secret is None else secret
+        self.interval = interval or config.PROFILE_INTERVAL
+        self.store = store or ProfileStore()
+        self.exclude_paths = exclude_paths
+        self._counter = itertools.count(1)
+
+    def should_profile(self, scope:Scope) -> bool:
+        token = Headers(scope=scope).get(HEADER)
+        if token is not None and verify_token(self.secret, token):
+            return True
+        return self.sample_rate > 0 and next(self._counter) % self.sample_rate == 0
+
+    async def __call__(self, scope:Scope, receive:Receive, send:Send):
+        if (scope['type'] != 'http' or scope['path'].startswith(self.exclude_paths)
+                or not self.should_profile(scope)):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = self.store.new_id()
+        status_code = None
+
+        async def send_with_id(message:Message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                MutableHeaders(scope=message)['X-Profile-Id'] = profile_id
+            await send(message)
+
+        sampler = Sampler(self.interval)
+        created_at = datetime.now(timezone.utc)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            sampler.stop()
+            duration_ms = (time.perf_counter() - start) * 1000
+            # El router deja la ruta en el scope; la plantilla agrupa /users/1 y /users/2
+            route = getattr(scope.get('route'), 'path', scope['path'])
+            name = f"{scope['method']} {route}"
+            metadata = {
+                'id': profile_id, 'method': scope['method'], 'route': route, 'path': scope['path'],
+                'status_code': status_code, 'duration_ms': round(duration_ms, 3),
+                'samples': sum(sampler.stacks.values()), 'interval_ms': self.interval * 1000,
+                'created_at': created_at.isoformat(),
+            }
+            profile = sampler.to_speedscope(name, duration_ms, metadata)
+            await run_in_threadpool(self.store.save, profile_id, profile)
+
+
+def main():
+    '''Genera una cabecera X-Profile válida: python -m middleware.profiling [ttl_segundos]'''
+    if not config.PROFILE_SECRET:
+        sys.exit('PROFILE_SECRET_J no está definido')
+    ttl = float(sys.argv[1]) if len(sys.argv) > 1 else 300
+    print(f'X-Profile: {profile_token(config.PROFILE_SECRET, ttl)}')
+
+
+if __name__ == '__main__':
+    main()
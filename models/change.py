@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import BigInteger, Integer, String, DateTime, JSON
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class Change(Base):
+    '''
+    Registro append-only de cambios sobre usuarios y notas. `seq` es creciente y sirve de cursor
+    para GET /changes; un cambio 'delete' no lleva datos (tombstone).
+    Con sharding, en los demás shards la tabla es la cola de cambios pendientes de pasar al log del
+    principal (crud.change.relay_changes); `source` (shard:seq de origen) evita trasladar uno dos veces
+    '''
+
+    __tablename__ = 'changes'
+    # En SQLite, sin AUTOINCREMENT un seq borrado (la cola de un shard al trasladarse) se volvería a usar
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    # BigInteger en Postgres; en SQLite solo INTEGER PRIMARY KEY es autoincremental
+    seq:Mapped[int] = mapped_column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True)
+    entity:Mapped[str] = mapped_column(String(10), nullable=False)  # user | note
+    entity_id:Mapped[int] = mapped_column(Integer, nullable=False)
+    op:Mapped[str] = mapped_column(String(10), nullable=False)      # create | update | delete
+    data:Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    source:Mapped[Optional[str]] = mapped_column(String(32), nullable=True, unique=True)
+    # Proceso que lo ha añadido al log (crud.change.process_id): change_feed reparte solo los de otros procesos
+    process:Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
+    changed_at:Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False,
+                                                default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'Change(seq={self.seq}, entity={self.entity}, entity_id={self.entity_id}, op={self.op})'
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Integer, String, DateTime, LargeBinary
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class IdempotencyRecord(Base):
+    '''Respuesta guardada para una Idempotency-Key. status_code NULL indica que la petición original sigue en curso'''
+
+    __tablename__ = 'idempotency_keys'
+
+    client:Mapped[str] = mapped_column(String(100), primary_key=True)
+    key:Mapped[str] = mapped_column(String(255), primary_key=True)
+    fingerprint:Mapped[str] = mapped_column(String(64), nullable=False) # sha256 de método + ruta + cuerpo
+    status_code:Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    content_type:Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    body:Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    created_at:Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    expires_at:Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f'IdempotencyRecord(client={self.client}, key={self.key}, status_code={self.status_code})'
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import Integer, String, Boolean, DateTime, JSON
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class Job(Base):
+    '''Trabajo en segundo plano (exportaciones, importaciones, purgas). Su estado vive en BD para sobrevivir a reinicios'''
+
+    __tablename__ = 'jobs'
+
+    id:Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind:Mapped[str] = mapped_column(String(30), nullable=False)
+    # queued -> running -> succeeded | failed | cancelled
+    status:Mapped[str] = mapped_column(String(10), nullable=False, default='queued', index=True)
+    params:Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
+    processed:Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    total:Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    result:Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    result_path:Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    error:Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    cancel_requested:Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    # Proceso que lo ejecuta (máquina:boot_id:pid) y última vez que dio señales de vida (job_runner.JobRunner)
+    owner:Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    heartbeat_at:Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    created_at:Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, default=_now)
+    started_at:Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at:Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f'Job(id={self.id}, kind={self.kind}, status={self.status})'
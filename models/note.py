@@ -1,8 +1,11 @@
 from __future__ import annotations
 
-from sqlalchemy import Integer, String, CheckConstraint, ForeignKey
+from datetime import datetime, timezone
+
+from sqlalchemy import Integer, String, DateTime, CheckConstraint, ForeignKey, Index, event, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
+import config
 from .base import Base
 
 from typing import TYPE_CHECKING
@@ -10,14 +13,29 @@ from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .user import User
 
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class Note(Base):
+    '''
+    Con config.NOTES_PARTITIONED la tabla se crea en Postgres particionada por meses de created_at
+    (ver partitions.py). Una clave única de una tabla particionada debe incluir la columna de partición,
+    así que la clave primaria pasa a ser (id, created_at); para el ORM la identidad sigue siendo id
+    '''
 
     __tablename__ = 'notes'
 
-    id:Mapped[int] = mapped_column(Integer, primary_key=True)
+    # autoincrement explícito: con la clave compuesta SQLAlchemy ya no lo deduce (SERIAL en Postgres)
+    id:Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     title:Mapped[str] = mapped_column(String(20), nullable=False)
     description:Mapped[str] = mapped_column(String(150), nullable=False)
     user_id:Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'))
+    created_at:Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, default=_now,
+                                                server_default=func.now(), primary_key=config.NOTES_PARTITIONED)
+    updated_at:Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, default=_now,
+                                                server_default=func.now(), onupdate=_now)
 
     user:Mapped[User] = relationship(back_populates="notes")
 
@@ -25,9 +43,80 @@ class Note(Base):
         desc =  self.description[:40]+'...' if len(self.description) > 40  else self.description
         return f'Note(title={self.title}, description={desc})'
     
+    __mapper_args__ = {'primary_key': [id]}
+
     __table_args__ = (
         CheckConstraint('char_length(title) >= 2', 'min_title'),
-        CheckConstraint('char_length(description) >= 5', 'min_des')
+        CheckConstraint('char_length(description) >= 5', 'min_des'),
+        # Notas de un usuario (purga, borrado en cascada) y sus notas recientes (crud.user.get_user_notes)
+        Index('notes_user_id_created_at_idx', user_id, created_at),
+        {'postgresql_partition_by': 'RANGE (created_at)'} if config.NOTES_PARTITIONED else {},
     )
 
 
+# users.note_count se mantiene en la propia BD: cubre el ORM, los INSERT / COPY masivos de las importaciones
+# y los borrados en cascada (delete(User) sin pasar por el ORM), que ningún evento de Python vería.
+# En Postgres los triggers son por sentencia con tablas de transición: una importación de 100k notas
+# hace un UPDATE por usuario afectado, no uno por nota
+NOTE_COUNT_DDL = {
+    'postgresql': [
+        '''
+        CREATE OR REPLACE FUNCTION notes_update_note_count() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                UPDATE users SET note_count = users.note_count - c.n
+                FROM (SELECT user_id, count(*) AS n FROM old_notes GROUP BY user_id) c WHERE users.id = c.user_id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE users SET note_count = users.note_count + c.n
+                FROM (SELECT user_id, count(*) AS n FROM new_notes GROUP BY user_id) c WHERE users.id = c.user_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        'DROP TRIGGER IF EXISTS notes_note_count_insert ON notes',
+        'DROP TRIGGER IF EXISTS notes_note_count_delete ON notes',
+        'DROP TRIGGER IF EXISTS notes_note_count_update ON notes',
+        '''CREATE TRIGGER notes_note_count_insert AFTER INSERT ON notes REFERENCING NEW TABLE AS new_notes
+           FOR EACH STATEMENT EXECUTE FUNCTION notes_update_note_count()''',
+        '''CREATE TRIGGER notes_note_count_delete AFTER DELETE ON notes REFERENCING OLD TABLE AS old_notes
+           FOR EACH STATEMENT EXECUTE FUNCTION notes_update_note_count()''',
+        '''CREATE TRIGGER notes_note_count_update AFTER UPDATE ON notes
+           REFERENCING OLD TABLE AS old_notes NEW TABLE AS new_notes
+           FOR EACH STATEMENT EXECUTE FUNCTION notes_update_note_count()''',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS notes_note_count_insert',
+        'DROP TRIGGER IF EXISTS notes_note_count_delete',
+        'DROP TRIGGER IF EXISTS notes_note_count_update',
+        '''CREATE TRIGGER notes_note_count_insert AFTER INSERT ON notes BEGIN
+               UPDATE users SET note_count = note_count + 1 WHERE id = NEW.user_id;
+           END''',
+        '''CREATE TRIGGER notes_note_count_delete AFTER DELETE ON notes BEGIN
+               UPDATE users SET note_count = note_count - 1 WHERE id = OLD.user_id;
+           END''',
+        '''CREATE TRIGGER notes_note_count_update AFTER UPDATE OF user_id ON notes BEGIN
+               UPDATE users SET note_count = note_count - 1 WHERE id = OLD.user_id;
+               UPDATE users SET note_count = note_count + 1 WHERE id = NEW.user_id;
+           END''',
+    ],
+}
+
+
+def install_note_count_triggers(connection):
+    '''Crea (o reemplaza) los triggers de note_count. create_all lo hace solo al crear la tabla notes'''
+    for statement in NOTE_COUNT_DDL.get(connection.dialect.name, []):
+        connection.exec_driver_sql(statement)
+
+
+@event.listens_for(Note.__table__, 'after_create')
+def _create_note_count_triggers(target, connection, **kw):
+    install_note_count_triggers(connection)
+
+
+@event.listens_for(Note.__table__, 'after_create')
+def _create_partitions(target, connection, **kw):
+    if config.NOTES_PARTITIONED and connection.dialect.name == 'postgresql':
+        from partitions import create_partitions # import tardío: partitions importa este módulo
+        create_partitions(connection)
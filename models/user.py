@@ -1,7 +1,7 @@
 # Debe ir primero; convierte las anotaciones en strings, permitiendo referencias a clases aún no definidas
 from __future__ import annotations
 
-from sqlalchemy import Integer, String, Boolean, CheckConstraint
+from sqlalchemy import Integer, String, Boolean, CheckConstraint, Index, func, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .base import Base #el . (importacion relativa) es igual a paquete actual. Python sabe que debe buscar dentro de models/
 from typing import Optional, TYPE_CHECKING
@@ -10,17 +10,30 @@ if TYPE_CHECKING: #false en tiempo de ejecucion
     from .note import Note  # Import solo para el type checker; evita warnings y previene import circular en runtime
 
 
+# Índice único sobre lower(username): sirve las búsquedas por username y a la vez impide 'Pepe' y 'pepe'.
+# Solo entre usuarios activos: el username de un usuario dado de baja queda libre
+USERNAME_INDEX = 'users_username_lower_key'
+
+# DELETE /users/{id} solo marca is_active = false (ver purge.py). Las lecturas filtran por `User.is_active`
+# y los índices parciales llevan la misma expresión que genera SQLAlchemy en cada dialecto, así el
+# planificador puede usarlos; los usuarios dados de baja no ocupan sitio en ellos
+ACTIVE = {'postgresql_where': text('is_active'), 'sqlite_where': text('is_active = 1')}
+INACTIVE = {'postgresql_where': text('NOT is_active'), 'sqlite_where': text('is_active = 0')}
+
+
 class User(Base):
     __tablename__ = 'users'
 
     id:Mapped[int] = mapped_column(Integer, primary_key=True)
     first_name:Mapped[str] = mapped_column(String(25), nullable=False)
     last_name:Mapped[str] = mapped_column(String(30), nullable=False)
-    username:Mapped[str] = mapped_column(String(20), unique=True, nullable=False)
+    username:Mapped[str] = mapped_column(String(20), nullable=False) # único sin distinguir mayúsculas, ver USERNAME_INDEX
     email:Mapped[Optional[str]] = mapped_column(String, nullable=True)
     age:Mapped[int] = mapped_column(Integer, nullable=False)
     password:Mapped[str] = mapped_column(String, nullable=False)
     is_active:Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
+    # Desnormalizado: lo mantienen los triggers de notes (ver models/note.py), nunca se escribe desde Python
+    note_count:Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
 
     # esto es a nivel de orm, no de esquema de db
     notes:Mapped[list[Note]] = relationship(
@@ -31,6 +44,13 @@ class User(Base):
         )
 
 
+    def __init__(self, **kwargs):
+        # Un usuario nuevo está activo y no tiene notas; así lo reflejan también antes del INSERT
+        kwargs.setdefault('is_active', True)
+        kwargs.setdefault('note_count', 0)
+        super().__init__(**kwargs)
+
+
     #metodo que define como se ve en consola el objeto al imprimirlo o inspeccionarlo
     def __repr__(self):
         return f'User(id={self.id}, first_name={self.first_name}, last_name={self.last_name}, username={self.username})'
@@ -41,5 +61,8 @@ class User(Base):
         CheckConstraint('char_length(password) >= 8', 'password_min_length'),
         CheckConstraint('char_length(first_name) >= 2', 'first_name_min_length'),
         CheckConstraint('char_length(last_name) >= 2', 'last_name_min_length'),
-        CheckConstraint('char_length(username) >= 3', 'username_min_length')
+        CheckConstraint('char_length(username) >= 3', 'username_min_length'),
+        Index(USERNAME_INDEX, func.lower(username), unique=True, **ACTIVE),
+        Index('users_active_id_idx', id, **ACTIVE), # listados y COUNT por id
+        Index('users_inactive_id_idx', id, **INACTIVE) # pendientes de purgar
     )
\ No newline at end of file
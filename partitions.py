@@ -0,0 +1,146 @@
+'''
+Particionado mensual de la tabla notes en Postgres (config.NOTES_PARTITIONED).
+
+La tabla se parte por rangos de created_at, una partición por mes: notes_p2026_10 = [2026-10-01, 2026-11-01) UTC.
+- Las lecturas de notas llevan siempre límites de created_at (crud.user.get_user_notes), así el planificador
+  descarta las particiones de otros meses (partition pruning) y solo recorre índices pequeños.
+- No hay partición por defecto: insertar una nota de un mes sin partición falla. Se crean
+  config.NOTES_PARTITIONS_AHEAD meses por adelantado al crear la tabla, al arrancar la API y con
+  `python -m maintenance partitions`, que conviene lanzar a diario (cron).
+- Retención: las particiones de meses anteriores a config.NOTES_RETENTION_MONTHS se separan de la tabla
+  (DETACH) y, si se pide, se borran. Es inmediato, frente a un DELETE de millones de filas que además deja
+  filas muertas para el autovacuum. Sin DELETE los triggers de note_count no se disparan, así que las notas
+  de la partición se descuentan en la misma transacción.
+
+En SQLite (y en Postgres sin particionar) todas las funciones no hacen nada.
+'''
+import logging
+import re
+from datetime import date, datetime, timezone
+
+from sqlalchemy import Connection, Engine
+
+import config
+from models.note import Note
+
+
+logger = logging.getLogger(__name__)
+
+_PARTITION_NAME = re.compile(rf'{Note.__tablename__}_p(\d{{4}})_(\d{{2}})')
+
+
+def month_start(value:date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month:date, months:int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month:date) -> str:
+    return f'{Note.__tablename__}_p{month:%Y_%m}'
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def is_partitioned(connection:Connection) -> bool:
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.exec_driver_sql(
+        f"SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('{Note.__tablename__}'))"
+    ).scalar()
+
+
+def list_partitions(connection:Connection) -> list[date]:
+    '''Meses que tienen partición, ordenados'''
+    if not is_partitioned(connection):
+        return []
+    names = connection.exec_driver_sql(
+        f"SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        f"WHERE i.inhparent = '{Note.__tablename__}'::regclass"
+    ).scalars()
+    return sorted(date(int(m[1]), int(m[2]), 1) for m in map(_PARTITION_NAME.fullmatch, names) if m)
+
+
+def create_partitions(connection:Connection, start:date | None = None, ahead:int | None = None,
+                      today:date | None = None) -> list[str]:
+    '''
+    Crea las particiones que falten desde el mes de `start` (por defecto el actual) hasta `ahead` meses después
+    del actual. Devuelve los nombres de las creadas
+    '''
+    if not is_partitioned(connection):
+        return []
+    ahead = config.NOTES_PARTITIONS_AHEAD if ahead is None else ahead
+    current = month_start(today or _today())
+    month = month_start(start) if start is not None else current
+    existing = set(list_partitions(connection))
+
+    created = []
+    while month <= add_months(current, ahead):
+        if month not in existing:
+            name = partition_name(month)
+            connection.exec_driver_sql(
+                f"CREATE TABLE {name} PARTITION OF {Note.__tablename__} "
+                f"FOR VALUES FROM ('{month} 00:00+00') TO ('{add_months(month, 1)} 00:00+00')"
+            )
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def apply_retention(connection:Connection, keep_months:int | None = None, drop:bool = False,
+                    today:date | None = None) -> list[str]:
+    '''
+    Separa de la tabla las particiones de los meses anteriores a los `keep_months` últimos meses completos
+    (además del actual) y, con `drop`, las borra. Devuelve sus nombres. keep_months = 0: no se toca nada
+    '''
+    keep_months = config.NOTES_RETENTION_MONTHS if keep_months is None else keep_months
+    if keep_months <= 0 or not is_partitioned(connection):
+        return []
+    cutoff = add_months(month_start(today or _today()), -keep_months)
+
+    removed = []
+    for month in list_partitions(connection):
+        if month >= cutoff:
+            break
+        name = partition_name(month)
+        # Sin escrituras en la partición hasta el DETACH, así el descuento de note_count es exacto
+        connection.exec_driver_sql(f'LOCK TABLE {name} IN SHARE MODE')
+        connection.exec_driver_sql(
+            f'UPDATE users SET note_count = users.note_count - c.n '
+            f'FROM (SELECT user_id, count(*) AS n FROM {name} GROUP BY user_id) c WHERE users.id = c.user_id'
+        )
+        connection.exec_driver_sql(f'ALTER TABLE {Note.__tablename__} DETACH PARTITION {name}')
+        if drop:
+            connection.exec_driver_sql(f'DROP TABLE {name}')
+        removed.append(name)
+    return removed
+
+
+def maintain(engines:list[Engine], drop:bool = False) -> dict[str, list[str]]:
+    '''Crea las particiones futuras y aplica la retención en cada BD (shard), cada una en su transacción'''
+    result = {'created': [], 'removed': []}
+    for engine in engines:
+        with engine.begin() as connection:
+            result['created'] += create_partitions(connection)
+        with engine.begin() as connection:
+            result['removed'] += apply_retention(connection, drop=drop)
+    return result
+
+
+def ensure_partitions(engines:list[Engine]):
+    '''Al arrancar la API: crea las particiones futuras que falten. Un error no impide arrancar, solo se registra'''
+    if not config.NOTES_PARTITIONED:
+        return
+    for engine in engines:
+        try:
+            with engine.begin() as connection:
+                created = create_partitions(connection)
+        except Exception:
+            logger.exception('Error creando las particiones de %s', Note.__tablename__)
+            continue
+        if created:
+            logger.info('Particiones creadas: %s', ', '.join(created))
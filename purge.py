@@ -0,0 +1,123 @@
+'''
+Purga de los usuarios dados de baja.
+
+DELETE /users/{id} solo marca is_active = false: borrar de golpe un usuario con muchas notas (en cascada)
+mantenía bloqueos y la petición durante mucho tiempo. Aquí se borran después, en segundo plano:
+primero sus notas y luego los propios usuarios, en lotes de config.PURGE_BATCH_SIZE filas.
+
+- Cada lote es una transacción corta con su propio statement_timeout (config.PURGE_BATCH_TIMEOUT),
+  así los bloqueos y el WAL generados por lote quedan acotados, y entre lotes se hace una pausa.
+- Las filas bloqueadas por otra transacción se saltan (SKIP LOCKED): varios procesos pueden purgar a la vez.
+- Una pasada dura como mucho config.PURGE_MAX_SECONDS; lo que quede se borra en la siguiente.
+
+PurgeWorker lanza una pasada cada config.PURGE_INTERVAL segundos en un hilo del proceso. Con sharding, en cada
+pasada traslada también al log principal los cambios que se quedaron en la cola de su shard porque el traslado
+tras el commit falló (crud.change.relay_changes).
+También se puede lanzar a mano con `python -m maintenance purge-users`.
+'''
+import logging
+import time
+from threading import Event, Thread
+
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+
+import config
+from crud.change import relay_pending_changes
+from crud.user import purge_inactive_notes, purge_inactive_users
+from db import DEADLINE, engine, shard_engines
+from metrics import Counter
+from schemas.purge import PurgeReport
+
+
+PURGED = Counter('journal_purged_rows_total', 'Filas de usuarios dados de baja borradas', ('table',))
+
+logger = logging.getLogger(__name__)
+
+
+def purge(engines:list[Engine], batch_size:int | None = None, max_seconds:float | None = None,
+          pause:float | None = None, stop:Event | None = None) -> PurgeReport:
+    '''Una pasada de purga sobre cada BD (shard). Termina cuando no queda nada, se agota el tiempo o se pide parar'''
+    batch_size = batch_size or config.PURGE_BATCH_SIZE
+    max_seconds = config.PURGE_MAX_SECONDS if max_seconds is None else max_seconds
+    pause = config.PURGE_PAUSE if pause is None else pause
+    stop = stop or Event()
+
+    report = PurgeReport()
+    start = time.monotonic()
+    end = start + max_seconds
+    steps = ((purge_inactive_notes, 'notes'), (purge_inactive_users, 'users'))
+
+    for bind in engines:
+        for purge_batch, table in steps:
+            while True:
+                if time.monotonic() >= end or stop.is_set():
+                    report.elapsed = round(time.monotonic() - start, 3)
+                    return report
+
+                with Session(bind, info={DEADLINE: time.monotonic() + config.PURGE_BATCH_TIMEOUT}) as session:
+                    deleted = purge_batch(session, batch_size)
+
+                report.batches += 1
+                PURGED.inc(deleted, table=table)
+                if table == 'notes':
+                    report.notes_deleted += deleted
+                else:
+                    report.users_deleted += deleted
+
+                if deleted < batch_size:
+                    break
+                stop.wait(pause)
+
+    report.elapsed = round(time.monotonic() - start, 3)
+    report.finished = True
+    return report
+
+
+class PurgeWorker:
+    '''Hilo que lanza una pasada de purge() cada `interval` segundos'''
+
+    def __init__(self, engines:list[Engine], interval:float):
+        self.engines = engines
+        self.interval = interval
+        self._stop = Event()
+        self._thread:Thread | None = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='purge', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''Para el worker. Un lote en curso termina (es corto); no se empieza ninguno más'''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if len(self.engines) > 1:
+                try:
+                    relayed = relay_pending_changes(self.engines)
+                    if relayed:
+                        logger.warning('%s cambios trasladados con retraso al log principal', relayed)
+                except Exception:
+                    logger.exception('Error trasladando al log principal los cambios pendientes de los shards')
+
+            try:
+                report = purge(self.engines, stop=self._stop)
+            except Exception:
+                # p.ej. un lote cancelado por statement_timeout: se reintenta en la siguiente pasada
+                logger.exception('Error purgando usuarios dados de baja')
+                continue
+
+            if report.users_deleted or report.notes_deleted:
+                logger.info('Purga: %s usuarios y %s notas en %ss', report.users_deleted,
+                            report.notes_deleted, report.elapsed)
+
+
+worker = PurgeWorker(shard_engines or [engine], config.PURGE_INTERVAL)
@@ -0,0 +1,179 @@
+'''
+Caché de los bytes finales de las respuestas de colecciones (p.ej. GET /users/).
+
+Cada entrada guarda el cuerpo ya serializado junto con la "generación" de la entidad cuando se calculó.
+Cualquier escritura confirmada sobre la entidad incrementa la generación (change_feed.on_changes: las de otros
+procesos, hasta config.CHANGE_FEED_INTERVAL segundos después), con lo que todas sus entradas pasan a estar
+obsoletas sin tener que recorrerlas.
+
+Stale-while-revalidate: una entrada obsoleta (por generación o por TTL) se sigue sirviendo durante
+config.RESPONSE_CACHE_STALE_TTL segundos mientras un único refresco en segundo plano la recalcula;
+si no hay entrada, las peticiones concurrentes esperan a un único cálculo (si se cancela la petición que
+calcula, lo retoma una de las que esperan). Así no hay estampida cuando caduca.
+'''
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from threading import Lock
+from typing import NamedTuple
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+
+import config
+from change_feed import on_changes
+from metrics import Counter
+
+
+REQUESTS = Counter('journal_response_cache_requests_total', 'Peticiones a la caché de respuestas',
+                   ('cache', 'result'))
+
+logger = logging.getLogger(__name__)
+
+_caches:list['ResponseCache'] = []
+
+
+class _Entry(NamedTuple):
+    body:bytes
+    generation:int
+    created_at:float
+
+
+class ResponseCache:
+
+    def __init__(self, name:str, entity:str, ttl:float | None = None, stale_ttl:float | None = None,
+                 max_entries:int | None = None):
+        self.name = name
+        self.entity = entity
+        self.ttl = config.RESPONSE_CACHE_TTL if ttl is None else ttl
+        self.stale_ttl = config.RESPONSE_CACHE_STALE_TTL if stale_ttl is None else stale_ttl
+        self.max_entries = max_entries or config.RESPONSE_CACHE_MAX_ENTRIES
+        self.generation = 0
+        self._entries:OrderedDict[str, _Entry] = OrderedDict()
+        self._refreshing:set[str] = set()
+        self._in_flight:dict[str, asyncio.Future[bytes | None]] = {}
+        self._refresh_tasks:set[asyncio.Task] = set() # referencias fuertes: el loop solo guarda referencias débiles
+        self._lock = Lock() # los refrescos y bump() se ejecutan en otros hilos
+        _caches.append(self)
+
+    def bump(self):
+        '''Invalida todas las entradas (se llama tras cada escritura confirmada de la entidad)'''
+        with self._lock:
+            self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._refreshing.clear()
+
+    def _lookup(self, key:str) -> _Entry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key:str, entry:_Entry):
+        with self._lock:
+            current = self._entries.get(key)
+            # un cálculo más antiguo que termina tarde no pisa uno más reciente
+            if current is None or current.generation <= entry.generation:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _compute(self, key:str, render:Callable[[], bytes]) -> bytes:
+        generation = self.generation # se lee antes de consultar: si hay una escritura a mitad, queda obsoleta
+        body = render()
+        self._store(key, _Entry(body, generation, time.monotonic()))
+        return body
+
+    def _refresh(self, key:str, render:Callable[[], bytes]):
+        try:
+            self._compute(key, render)
+        except Exception:
+            # se seguirá sirviendo la versión antigua hasta que caduque o un refresco funcione
+            logger.exception('Error refrescando la caché %s (%s)', self.name, key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def get(self, key:str, render:Callable[[], bytes],
+                  background_render:Callable[[], bytes] | None = None) -> tuple[bytes, str]:
+        '''
+        Devuelve (cuerpo, estado) con estado 'hit', 'stale' o 'miss'. `render` se ejecuta en el threadpool
+        cuando no hay nada que servir; `background_render` (por defecto `render`) se usa para los refrescos
+        en segundo plano, que terminan después de la petición y no pueden usar su sesión
+        '''
+        entry = self._lookup(key)
+        now = time.monotonic()
+
+        if entry is not None:
+            age = now - entry.created_at
+            if entry.generation == self.generation and age < self.ttl:
+                REQUESTS.inc(cache=self.name, result='hit')
+                return entry.body, 'hit'
+
+            if age < self.ttl + self.stale_ttl:
+                with self._lock:
+                    start_refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                if start_refresh:
+                    # En el threadpool de anyio, como las peticiones: su límite (config.THREADPOOL_SIZE) sale del
+                    # pool de conexiones y los refrescos no abren sesiones por encima de él
+                    task = asyncio.create_task(run_in_threadpool(self._refresh, key, background_render or render))
+                    self._refresh_tasks.add(task)
+                    task.add_done_callback(self._refresh_tasks.discard)
+                REQUESTS.inc(cache=self.name, result='stale')
+                return entry.body, 'stale'
+
+        # Sin nada que servir: un único cálculo para todas las peticiones concurrentes
+        REQUESTS.inc(cache=self.name, result='miss')
+        while (in_flight := self._in_flight.get(key)) is not None:
+            body = await asyncio.shield(in_flight)
+            if body is not None:
+                return body, 'miss'
+            # Se ha cancelado la petición que calculaba (cliente desconectado, deadline): la primera de las que
+            # esperaban lo calcula con su `render` y el resto la espera a ella
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            body = await run_in_threadpool(self._compute, key, render)
+            future.set_result(body)
+            return body, 'miss'
+        except asyncio.CancelledError:
+            future.set_result(None)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # marcado como recuperado aunque nadie más estuviera esperando
+            raise
+        finally:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+
+def cache_key(request:Request) -> str:
+    '''Clave de caché: ruta + parámetros de consulta ordenados'''
+    return f'{request.url.path}?{"&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))}'
+
+
+def clear_all():
+    '''Vacía todas las cachés (tests, cambios masivos fuera de crud...)'''
+    for cache in _caches:
+        cache.clear()
+
+
+@on_changes
+def _invalidate(changes:list[dict]):
+    entities = {change['entity'] for change in changes}
+    for cache in _caches:
+        if cache.entity in entities:
+            cache.bump()
+
+
+users_cache = ResponseCache('users', 'user')
@@ -0,0 +1,234 @@
+'''
+POST /batch: varias operaciones sobre usuarios en una sola llamada HTTP.
+
+Las operaciones se ejecutan en orden, en la misma sesión (get_db), llamando directamente a crud.user
+sin volver a pasar por HTTP ni por los middlewares. Están todas las rutas de /users, con sus parámetros de
+consulta en `path` (p.ej. /users/1/notes?limit=10). Cada una devuelve el status y el cuerpo que devolvería
+su ruta, pero no sus cabeceras: GET /users/ no se sirve de la caché de respuestas (X-Cache) y no admite
+`count` (X-Total-Count), que da 400.
+- independent: cada operación confirma su propia transacción; un fallo no afecta a las demás. Un error de la BD
+  (OperationalError, DataError...) o un deadline agotado da el 500 / 504 que daría la ruta y la sesión se
+  deshace antes de la siguiente operación.
+- atomic: una única transacción para todo el lote (ver db.transaction). La primera operación que falla
+  deshace el lote; las siguientes no se ejecutan (424).
+'''
+import logging
+import re
+from collections.abc import Callable
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qsl
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from crud.user import get_user_rows, get_user_row_by_id, get_user_by_username, create_user, update_user, \
+    delete_user, get_user_notes
+from db import get_db, shard_ids, ATOMIC, QUERY_CANCELED
+from exceptions.deadline_exceptions import DeadlineExceeded
+from exceptions.user_exceptions import UserAlreadyExists
+from routers.user import NOT_FOUND, USERNAME_NOT_FOUND, notes_range
+from schemas.batch import BatchOperation, BatchRequest, BatchResponse, BatchResult
+from schemas.note import NoteInDb
+from schemas.user import UserRead, UserCreate, UserUpdate, UserPatch
+from username_filter import username_filter
+
+
+router = APIRouter(prefix='/batch', tags=['Batch'])
+
+NOT_EXECUTED = 'No se ha ejecutado: una operación anterior del lote ha fallado'
+
+logger = logging.getLogger(__name__)
+
+
+class _Rollback(Exception):
+    '''Deshace la transacción del lote atómico al salir del `with session.begin()`'''
+
+
+# Parámetros de consulta de las rutas de routers.user, con las mismas restricciones
+class _UsersQuery(BaseModel):
+    after:int | None = None
+    limit:int | None = Field(None, gt=0, le=10_000)
+
+
+class _AvailabilityQuery(BaseModel):
+    username:str = Field(min_length=3, max_length=20, pattern=r'^\S+$')
+
+
+class _NotesQuery(BaseModel):
+    since:datetime | None = None
+    until:datetime | None = None
+    limit:int = Field(100, gt=0, le=1000)
+
+
+def _user(user) -> dict:
+    return UserRead.model_validate(user).model_dump(mode='json')
+
+
+def _validate(schema:type[BaseModel], data:dict | None, location:str = 'body') -> BaseModel:
+    # Mismo formato de error que la validación de FastAPI (422)
+    try:
+        return schema.model_validate(data or {})
+    except ValidationError as e:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_CONTENT, [
+            {**error, 'loc': (location, *error['loc'])}
+            for error in e.errors(include_url=False, include_context=False)
+        ])
+
+
+def _list(session:Session, body:dict | None, query:dict) -> BatchResult:
+    if 'count' in query:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, 'count no está disponible en un lote (no hay cabeceras)')
+    params = _validate(_UsersQuery, query, 'query')
+    rows = get_user_rows(session, params.after, params.limit)
+    return BatchResult(status=status.HTTP_200_OK, body=[_user(row) for row in rows])
+
+
+def _availability(session:Session, body:dict | None, query:dict) -> BatchResult:
+    username = _validate(_AvailabilityQuery, query, 'query').username
+    return BatchResult(status=status.HTTP_200_OK,
+                       body={'username': username, 'available': not username_filter.is_taken(session, username)})
+
+
+def _notes(session:Session, id:str, body:dict | None, query:dict) -> BatchResult:
+    params = _validate(_NotesQuery, query, 'query')
+    since, until = notes_range(params.since, params.until)
+    notes = get_user_notes(session, int(id), since, until, params.limit)
+    if notes is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, NOT_FOUND)
+    return BatchResult(status=status.HTTP_200_OK,
+                       body=[NoteInDb.model_validate(dict(note)).model_dump(mode='json') for note in notes])
+
+
+def _get(session:Session, id:str, body:dict | None, query:dict) -> BatchResult:
+    user = get_user_row_by_id(session, int(id))
+    if not user:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, NOT_FOUND)
+    return BatchResult(status=status.HTTP_200_OK, body=_user(user))
+
+
+def _get_by_username(session:Session, username:str, body:dict | None, query:dict) -> BatchResult:
+    user = get_user_by_username(session, username)
+    if not user:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, USERNAME_NOT_FOUND)
+    return BatchResult(status=status.HTTP_200_OK, body=_user(user))
+
+
+def _create(session:Session, body:dict | None, query:dict) -> BatchResult:
+    user = create_user(_validate(UserCreate, body), session)
+    return BatchResult(status=status.HTTP_201_CREATED, body=_user(user))
+
+
+def _update(schema:type[UserUpdate] | type[UserPatch]):
+    def update(session:Session, id:str, body:dict | None, query:dict) -> BatchResult:
+        user = update_user(int(id), _validate(schema, body), session)
+        if not user:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, NOT_FOUND)
+        return BatchResult(status=status.HTTP_200_OK, body=_user(user))
+    return update
+
+
+def _delete(session:Session, id:str, body:dict | None, query:dict) -> BatchResult:
+    if not delete_user(session, int(id)):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, NOT_FOUND)
+    return BatchResult(status=status.HTTP_204_NO_CONTENT)
+
+
+_USER = re.compile(r'/users/(\d+)')
+_USER_NOTES = re.compile(r'/users/(\d+)/notes')
+_BY_USERNAME = re.compile(r'/users/by-username/([^/]+)')
+_AVAILABILITY = re.compile(r'/users/availability')
+_USERS = re.compile(r'/users/?')
+
+# (patrón de la ruta, método) -> operación. Los grupos del patrón se pasan como argumentos posicionales,
+# seguidos del cuerpo y de los parámetros de consulta
+_ROUTES:dict[tuple[re.Pattern, str], Callable[..., BatchResult]] = {
+    (_USERS, 'GET'): _list,
+    (_AVAILABILITY, 'GET'): _availability,
+    (_USER, 'GET'): _get,
+    (_USER, 'PUT'): _update(UserUpdate),
+    (_USER, 'PATCH'): _update(UserPatch),
+    (_USER, 'DELETE'): _delete,
+    (_BY_USERNAME, 'GET'): _get_by_username,
+    (_USER_NOTES, 'GET'): _notes,
+    (_USERS, 'POST'): _create,
+}
+
+
+def _execute(session:Session, operation:BatchOperation) -> BatchResult:
+    url = urlsplit(operation.path)
+    query = dict(parse_qsl(url.query, keep_blank_values=True)) # con un parámetro repetido, el último (como Starlette)
+    path_found = False
+    for (pattern, method), route in _ROUTES.items():
+        match = pattern.fullmatch(url.path)
+        if match is None:
+            continue
+        if method != operation.method:
+            path_found = True
+            continue
+
+        try:
+            return route(session, *match.groups(), operation.body, query)
+        except HTTPException as e:
+            return BatchResult(status=e.status_code, body={'detail': e.detail})
+        except UserAlreadyExists as e:
+            return BatchResult(status=status.HTTP_400_BAD_REQUEST, body={'detail': e.message})
+        except DeadlineExceeded as e:
+            return BatchResult(status=status.HTTP_504_GATEWAY_TIMEOUT, body={'detail': e.message})
+        except SQLAlchemyError as e:
+            # Lo mismo que get_db y el servidor harían con la ruta: statement_timeout -> 504, el resto -> 500
+            if isinstance(e, OperationalError) and getattr(e.orig, 'pgcode', None) == QUERY_CANCELED:
+                return BatchResult(status=status.HTTP_504_GATEWAY_TIMEOUT, body={'detail': DeadlineExceeded().message})
+            logger.exception('Error en la operación %s %s del lote', operation.method, operation.path)
+            return BatchResult(status=status.HTTP_500_INTERNAL_SERVER_ERROR, body={'detail': 'Internal Server Error'})
+
+    if path_found:
+        return BatchResult(status=status.HTTP_405_METHOD_NOT_ALLOWED, body={'detail': 'Method Not Allowed'})
+    return BatchResult(status=status.HTTP_404_NOT_FOUND, body={'detail': 'Not Found'})
+
+
+@router.post('/', responses={
+    501: {'description': 'El modo atomic no está disponible con sharding (una transacción por shard)'}
+})
+def batch(request:BatchRequest, session:Session = Depends(get_db, scope='function')) -> BatchResponse:
+    '''
+    Ejecuta en orden una lista de operaciones sobre /users (GET, POST, PUT, PATCH, DELETE) y devuelve
+    el status y el cuerpo de cada una (sin cabeceras: GET /users/ no admite `count`).
+    Modo independent: cada operación se confirma por separado.
+    Modo atomic: todas o ninguna; tras el primer fallo el resto no se ejecuta (424)
+    '''
+    if request.mode == 'independent':
+        results = []
+        for operation in request.operations:
+            try:
+                results.append(_execute(session, operation))
+            finally:
+                # Las lecturas (y el refresco tras un commit) abren una transacción implícita, y una operación
+                # que falla a medias puede dejar la suya sin cerrar: se deshace antes de la siguiente
+                if session.in_transaction():
+                    session.rollback()
+        return BatchResponse(mode=request.mode, committed=True, results=results)
+
+    if shard_ids(session) is not None:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail='El modo atomic no está disponible con sharding')
+
+    results = []
+    session.info[ATOMIC] = True
+    try:
+        with session.begin():
+            for operation in request.operations:
+                result = _execute(session, operation)
+                results.append(result)
+                if result.status >= 400:
+                    raise _Rollback()
+        committed = True
+    except _Rollback:
+        committed = False
+    finally:
+        session.info.pop(ATOMIC, None)
+
+    not_executed = BatchResult(status=status.HTTP_424_FAILED_DEPENDENCY, body={'detail': NOT_EXECUTED})
+    results += [not_executed] * (len(request.operations) - len(results))
+    return BatchResponse(mode=request.mode, committed=committed, results=results)
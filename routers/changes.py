@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from crud.change import get_changes
+from db import get_db
+from schemas.change import ChangePage
+
+
+router = APIRouter(prefix='/changes', tags=['Changes'])
+
+
+@router.get('/')
+def get_page(since:int = Query(0, ge=0, description='Último seq recibido (0 para empezar desde el principio)'),
+             limit:int = Query(1000, gt=0, le=10_000),
+             user_id:int | None = Query(None, description='Solo cambios de este usuario (y sus notas)'),
+             db:Session = Depends(get_db, scope='function')) -> ChangePage:
+    '''
+    Cambios de usuarios y notas posteriores al cursor `since`, en orden. Permite a otros sistemas
+    sincronizar su copia de forma incremental en vez de descargar GET /users/ completo
+    '''
+    changes = get_changes(db, since, limit + 1, user_id) # uno de más para saber si quedan cambios
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    return ChangePage(changes=changes, next_cursor=changes[-1].seq if changes else since, has_more=has_more)
@@ -0,0 +1,131 @@
+import asyncio
+
+from fastapi import APIRouter, Header, Query, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+import config
+from crud.change import get_changes
+from db import SessionLocal # sesión propia y corta: get_db la mantendría abierta toda la conexión
+from events import broker, ChangeEvent, Subscriber
+from schemas.change import ChangeRead
+
+
+router = APIRouter(prefix='/events', tags=['Events'])
+
+
+def _load_backlog(since:int, user_id:int | None) -> tuple[list[ChangeEvent], bool]:
+    '''
+    Cambios posteriores a `since` (Last-Event-ID) para no perder nada entre reconexiones, como mucho
+    config.EVENTS_REPLAY_LIMIT. Devuelve también si había más (el cliente debe pedir el resto)
+    '''
+    with SessionLocal() as session:
+        changes = get_changes(session, since, config.EVENTS_REPLAY_LIMIT + 1, user_id)
+        change_events = [ChangeEvent(ChangeRead.model_validate(c).model_dump(mode='json')) for c in changes]
+
+    return change_events[:config.EVENTS_REPLAY_LIMIT], len(change_events) > config.EVENTS_REPLAY_LIMIT
+
+
+async def _subscribe(user_id:int | None, last_event_id:int | None) -> tuple[Subscriber, list[ChangeEvent], bool]:
+    '''
+    Se suscribe antes de leer el backlog para no perder cambios confirmados mientras tanto;
+    los que lleguen por los dos caminos se descartan después por seq (ver _replayed_seq)
+    '''
+    subscriber = broker.subscribe(user_id)
+    backlog, truncated = [], False
+    if last_event_id is not None:
+        try:
+            backlog, truncated = await run_in_threadpool(_load_backlog, last_event_id, user_id)
+        except BaseException:
+            broker.unsubscribe(subscriber)
+            raise
+
+    return subscriber, backlog, truncated
+
+
+def _replayed_seq(last_event_id:int | None, backlog:list[ChangeEvent]) -> int:
+    '''
+    Último seq que el cliente ya tiene (Last-Event-ID o el backlog, que va en orden): los eventos en vivo hasta
+    él son duplicados. Es fijo: en vivo los cambios no llegan en orden de seq (cada commit los publica desde su
+    hilo), así que compararlos con el último enviado descartaría los que se adelantan
+    '''
+    return backlog[-1].seq if backlog else last_event_id or 0
+
+
+@router.get('/', response_class=StreamingResponse, responses={
+    200: {'content': {'text/event-stream': {}}, 'description': 'Flujo de eventos SSE'}
+})
+async def stream(user_id:int | None = Query(None, description='Solo cambios de este usuario'),
+                 last_event_id:int | None = Header(None)):
+    '''
+    Cambios de usuarios y notas en tiempo real (Server-Sent Events). Cada evento lleva como id el seq
+    del log de cambios: al reconectar con Last-Event-ID se reenvía lo perdido. Si es más de
+    EVENTS_REPLAY_LIMIT se envía esa parte, un evento `resync` con el último seq enviado y se cierra el
+    flujo: el cliente reconecta (EventSource lo hace solo, con ese Last-Event-ID) o sigue con GET /changes
+    '''
+    subscriber, backlog, truncated = await _subscribe(user_id, last_event_id)
+
+    async def event_stream():
+        try:
+            replayed = _replayed_seq(last_event_id, backlog)
+            yield b'retry: 3000\n\n'
+            for change_event in backlog:
+                yield change_event.sse
+            if truncated:
+                yield f'event: resync\ndata: {{"since": {replayed}}}\n\n'.encode()
+                return
+
+            while True:
+                batch = await subscriber.next_batch(config.EVENTS_HEARTBEAT)
+                chunk = b''.join(e.sse for e in batch if e.seq > replayed)
+
+                if subscriber.overflowed:
+                    yield chunk + b'event: overflow\ndata: {}\n\n'
+                    return
+                yield chunk or b': keep-alive\n\n'
+        finally:
+            broker.unsubscribe(subscriber)
+
+    return StreamingResponse(event_stream(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@router.websocket('/ws')
+async def websocket(websocket:WebSocket, user_id:int | None = None, last_event_id:int | None = None):
+    '''
+    Igual que GET /events/ pero por WebSocket: un mensaje JSON por cambio. Si el backlog supera
+    EVENTS_REPLAY_LIMIT se cierra con 1008 'resync' tras enviarlo: hay que reconectar con el último seq recibido
+    '''
+    await websocket.accept()
+    subscriber, backlog, truncated = await _subscribe(user_id, last_event_id)
+
+    async def watch_disconnect():
+        # Sin esto una conexión cerrada no se detectaría hasta el siguiente envío
+        while (await websocket.receive())['type'] != 'websocket.disconnect':
+            pass
+        subscriber.close()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        replayed = _replayed_seq(last_event_id, backlog)
+        for change_event in backlog:
+            await websocket.send_text(change_event.json)
+        if truncated:
+            await websocket.close(code=1008, reason='resync')
+            return
+
+        while not subscriber.closed:
+            for change_event in await subscriber.next_batch():
+                if change_event.seq > replayed:
+                    await websocket.send_text(change_event.json)
+
+            if subscriber.overflowed:
+                # 1008: política incumplida. El cliente debe reconectar con last_event_id
+                await websocket.close(code=1008, reason='overflow')
+                return
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        broker.unsubscribe(subscriber)
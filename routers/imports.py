@@ -0,0 +1,50 @@
+import os
+import uuid
+from io import TextIOWrapper
+from tempfile import SpooledTemporaryFile
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Request, status, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+import config
+from db import get_db, shard_ids
+from importer import import_rows, format_from_content_type, DEFAULT_CHUNK_SIZE
+from schemas.imports import ImportReport
+
+
+router = APIRouter(prefix='/imports', tags=['Imports'])
+
+
+@router.post('/{kind}', responses={
+    415: {'description': 'Content-Type no soportado (text/csv o application/x-ndjson)'},
+    501: {'description': 'No disponible con sharding (los INSERT masivos no saben a qué shard va cada fila)'}
+})
+async def import_data(kind:Literal['users', 'notes'], request:Request,
+                      chunk_size:int = Query(DEFAULT_CHUNK_SIZE, gt=0, le=100_000),
+                      db:Session = Depends(get_db, scope='function')) -> ImportReport:
+    '''
+    Importa usuarios o notas en bloque. El cuerpo de la petición es el propio fichero (CSV o NDJSON),
+    que se recibe en streaming y se vuelca a un fichero temporal antes de cargarlo
+    '''
+    if shard_ids(db) is not None:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail='La importación masiva no está disponible con sharding')
+
+    fmt = format_from_content_type(request.headers.get('content-type', ''))
+    if fmt is None:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail='Content-Type no soportado (text/csv o application/x-ndjson)')
+
+    with SpooledTemporaryFile(max_size=config.IMPORT_SPOOL_SIZE) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+
+        os.makedirs(config.IMPORT_ERRORS_DIR, exist_ok=True)
+        errors_path = os.path.join(config.IMPORT_ERRORS_DIR, f'{kind}-{uuid.uuid4().hex}.errors.ndjson')
+
+        source = TextIOWrapper(spool, encoding='utf-8', newline='')
+        return await run_in_threadpool(import_rows, kind, source, fmt, db, chunk_size=chunk_size,
+                                       errors_path=errors_path)
@@ -0,0 +1,110 @@
+import os
+import uuid
+from contextlib import suppress
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Request, status, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+
+import config
+from crud.job import get_job, request_cancel
+from db import get_db, shard_ids
+from importer import format_from_content_type, DEFAULT_CHUNK_SIZE
+from job_runner import runner
+from schemas.job import JobRead
+
+
+router = APIRouter(prefix='/jobs', tags=['Jobs'])
+
+NOT_FOUND = 'El trabajo con id especificado no existe'
+
+
+@router.post('/exports/users', status_code=status.HTTP_202_ACCEPTED)
+def export_users(db:Session = Depends(get_db, scope='function')) -> JobRead:
+    '''Lanza la exportación de todos los usuarios a NDJSON. El fichero se descarga con GET /jobs/{id}/result'''
+    job_id = runner.submit('export_users', {})
+    return get_job(db, job_id)
+
+
+@router.post('/imports/{kind}', status_code=status.HTTP_202_ACCEPTED, responses={
+    415: {'description': 'Content-Type no soportado (text/csv o application/x-ndjson)'},
+    501: {'description': 'No disponible con sharding (los INSERT masivos no saben a qué shard va cada fila)'}
+})
+async def import_data(kind:Literal['users', 'notes'], request:Request,
+                      chunk_size:int = Query(DEFAULT_CHUNK_SIZE, gt=0, le=100_000),
+                      db:Session = Depends(get_db, scope='function')) -> JobRead:
+    '''
+    Igual que POST /imports/{kind}, pero el fichero se guarda en disco y se importa en segundo plano.
+    El progreso se consulta con GET /jobs/{id}
+    '''
+    if shard_ids(db) is not None:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail='La importación masiva no está disponible con sharding')
+
+    fmt = format_from_content_type(request.headers.get('content-type', ''))
+    if fmt is None:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail='Content-Type no soportado (text/csv o application/x-ndjson)')
+
+    os.makedirs(config.JOBS_DIR, exist_ok=True)
+    path = os.path.join(config.JOBS_DIR, f'upload-{uuid.uuid4().hex}.{fmt}')
+    try:
+        with open(path, 'wb') as f:
+            async for chunk in request.stream():
+                f.write(chunk)
+
+        params = {'kind': kind, 'path': path, 'format': fmt, 'chunk_size': chunk_size}
+        job_id = await run_in_threadpool(runner.submit, 'import', params)
+    except BaseException:
+        # Sin trabajo registrado nadie lo borraría (lo hace job_runner.import_file al terminar)
+        with suppress(FileNotFoundError):
+            os.remove(path)
+        raise
+    return await run_in_threadpool(get_job, db, job_id)
+
+
+@router.get('/{id}', responses={
+    404: {'description': NOT_FOUND}
+})
+def get_by_id(id:int, db:Session = Depends(get_db, scope='function')) -> JobRead:
+    '''Estado y progreso de un trabajo'''
+    job = get_job(db, id)
+    if job:
+        return job
+
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
+
+
+@router.post('/{id}/cancel', responses={
+    404: {'description': NOT_FOUND},
+    409: {'description': 'El trabajo ya ha terminado'}
+})
+def cancel(id:int, db:Session = Depends(get_db, scope='function')) -> JobRead:
+    '''Cancela un trabajo en cola o en ejecución'''
+    job = request_cancel(db, id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
+
+    if job.status in ('succeeded', 'failed'):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='El trabajo ya ha terminado')
+
+    runner.cancel(id)
+    return job
+
+
+@router.get('/{id}/result', response_class=FileResponse, responses={
+    404: {'description': NOT_FOUND},
+    409: {'description': 'El trabajo no tiene fichero de resultado'}
+})
+def get_result(id:int, db:Session = Depends(get_db, scope='function')):
+    '''Descarga el fichero generado por el trabajo (exportación, filas rechazadas de una importación...)'''
+    job = get_job(db, id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
+
+    if job.status != 'succeeded' or not job.result_path or not os.path.exists(job.result_path):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='El trabajo no tiene fichero de resultado')
+
+    return FileResponse(job.result_path, filename=os.path.basename(job.result_path))
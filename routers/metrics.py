@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+import metrics
+
+
+router = APIRouter(tags=['Metrics'])
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+def get_metrics() -> str:
+    '''Métricas del proceso en formato de texto de Prometheus'''
+    return metrics.render()
@@ -0,0 +1,55 @@
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse
+
+import config
+from middleware.profiling import ProfileStore, to_collapsed, verify_token
+from schemas.profile import ProfileInfo
+
+
+def require_profile_token(x_profile:str | None = Header(None)):
+    '''
+    Los perfiles muestran rutas de las peticiones y la estructura del código: se piden con la misma cabecera
+    X-Profile firmada que activa el perfilado (python -m middleware.profiling). Sin PROFILE_SECRET_J no hay
+    acceso por la API (los ficheros siguen en PROFILE_DIR_J)
+    '''
+    if x_profile is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Falta la cabecera X-Profile')
+    if not verify_token(config.PROFILE_SECRET, x_profile):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='X-Profile no válida o caducada')
+
+
+router = APIRouter(prefix='/admin/profiles', tags=['Admin'], dependencies=[Depends(require_profile_token)],
+                   responses={401: {'description': 'Falta la cabecera X-Profile'},
+                              403: {'description': 'X-Profile no válida o caducada'}})
+
+store = ProfileStore()
+
+NOT_FOUND = 'El perfil con id especificado no existe'
+
+
+@router.get('/')
+async def list_profiles() -> list[ProfileInfo]:
+    '''Perfiles de peticiones guardados (ver middleware.profiling), del más reciente al más antiguo'''
+    return await run_in_threadpool(store.recent)
+
+
+@router.get('/{profile_id}', responses={
+    200: {'content': {'application/json': {}, 'text/plain': {}},
+          'description': 'Perfil en formato speedscope o en pilas colapsadas'},
+    404: {'description': NOT_FOUND}
+})
+async def get_profile(profile_id:str, format:Literal['speedscope', 'collapsed'] = Query('speedscope')):
+    '''Descarga un perfil: speedscope (se abre en https://www.speedscope.app) o pilas colapsadas (flamegraph.pl)'''
+    if format == 'speedscope':
+        path = store.path(profile_id)
+        if path is None or not path.is_file():
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
+        return FileResponse(path, media_type='application/json', filename=path.name)
+
+    profile = await run_in_threadpool(store.load, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
+    return PlainTextResponse(to_collapsed(profile))
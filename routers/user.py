@@ -1,38 +1,137 @@
-from fastapi import APIRouter, Depends, status, HTTPException
+from datetime import datetime, timedelta, timezone
+from typing import Literal
+
+from fastapi import APIRouter, Depends, status, HTTPException, Request, Response, Query
+from fastapi.concurrency import run_in_threadpool
+from pydantic_core import to_json
 from sqlalchemy.orm import Session
 
-from crud.user import get_users, get_user_by_id, create_user, delete_user, update_user
-from schemas.user import UserRead, UserCreate, UserUpdate, UserPatch
-from db import get_db
+import config
+from crud.user import get_user_rows, get_user_row_by_id, get_user_by_username, create_user, delete_user, update_user, \
+    get_user_notes
+from schemas.note import NoteInDb
+from schemas.user import UserRead, UserCreate, UserUpdate, UserPatch, UsernameAvailability
+from db import get_db, SessionLocal
 from exceptions.user_exceptions import UserAlreadyExists
+from response_cache import users_cache, cache_key
+from row_counts import users_counter, total_count_headers
+from username_filter import username_filter
 
 
 router = APIRouter(prefix='/users', tags=['Users'])
 
+NOT_FOUND = 'El usuario con id especificado no existe'
+USERNAME_NOT_FOUND = 'No existe un usuario con ese username'
+
+def _render_users(session:Session, after:int | None, limit:int | None) -> bytes:
+    # Filas de Core con las columnas de UserRead, serializadas tal cual: ya se validaron al escribirlas y
+    # volver a pasarlas por UserRead (EmailStr sobre todo) costaba más que la consulta
+    return to_json([dict(row) for row in get_user_rows(session, after, limit)])
+
+
+def _render_users_background(after:int | None, limit:int | None) -> bytes:
+    with SessionLocal() as session:
+        return _render_users(session, after, limit)
+
+
+@router.get('/', response_model=list[UserRead])
+async def get_all(request:Request,
+                  after:int | None = Query(None, description='Id del último usuario de la página anterior'),
+                  limit:int | None = Query(None, gt=0, le=10_000, description='Tamaño de página (sin él, todos)'),
+                  count:Literal['exact', 'estimated'] | None = Query(
+                      None, description='Añade el total de usuarios en X-Total-Count (ver row_counts)'),
+                  db: Session = Depends(get_db, scope='function')):
+    '''
+    Obtiene los usuarios registrados ordenados por id, todos o por páginas (after + limit).
+    La respuesta ya serializada se cachea hasta la siguiente escritura (ver response_cache);
+    la cabecera X-Cache indica si viene de caché (hit / stale / miss).
+    Con `count` se añade el total en X-Total-Count y el modo con que se ha obtenido en X-Total-Count-Mode
+    '''
+    body, cache_status = await users_cache.get(cache_key(request), lambda: _render_users(db, after, limit),
+                                               lambda: _render_users_background(after, limit))
+    headers = {'X-Cache': cache_status}
+    if count is not None:
+        headers.update(total_count_headers(*await run_in_threadpool(users_counter.total, db, count)))
+    return Response(body, media_type='application/json', headers=headers)
+
+
+@router.get('/availability')
+def availability(username:str = Query(min_length=3, max_length=20, pattern=r'^\S+$'),
+                 db:Session = Depends(get_db, scope='function')) -> UsernameAvailability:
+    '''
+    Indica si el username está libre (sin distinguir mayúsculas), para comprobarlo mientras se escribe.
+    Casi siempre responde el filtro de Bloom en memoria sin tocar la BD (ver username_filter).
+    Es orientativo: el alta puede fallar igualmente si otro usuario lo coge antes
+    '''
+    return UsernameAvailability(username=username, available=not username_filter.is_taken(db, username))
+
+
+@router.get('/by-username/{username}', responses={
+    404: {'description': 'No existe un usuario con ese username'}
+})
+def get_by_username(username:str, db:Session = Depends(get_db, scope='function')) -> UserRead:
+    '''Recupera un usuario por su username, sin distinguir mayúsculas'''
+
+    user = get_user_by_username(db, username)
+    if user:
+        return user
 
-@router.get('/')
-def get_all(db: Session = Depends(get_db)) -> list[UserRead]:
-    '''Obtiene todos los usuarios registrados'''
-    return get_users(db)
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=USERNAME_NOT_FOUND)
 
 
 @router.get('/{id}', responses={
     404: {'description': 'El usuario con id especificado no existe'}
 })
-def get_by_id(id:int, db:Session = Depends(get_db)) -> UserRead: 
+def get_by_id(id:int, db:Session = Depends(get_db, scope='function')) -> UserRead: 
     '''Recupera la información de un usuario específico'''
 
-    user = get_user_by_id(db, id)
+    user = get_user_row_by_id(db, id)
     if user:
         return user
     
-    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='El usuario con id especificado no existe')
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
+
+
+def _utc(value:datetime) -> datetime:
+    # Sin zona se entiende UTC, igual que se guarda created_at
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def notes_range(since:datetime | None, until:datetime | None) -> tuple[datetime, datetime]:
+    '''Rango [since, until) de GET /users/{id}/notes con sus valores por defecto. 422 si está vacío o es muy largo'''
+    until = _utc(until) if until is not None else datetime.now(timezone.utc)
+    since = _utc(since) if since is not None else until - timedelta(days=config.NOTES_RECENT_DAYS)
+    if since >= until or until - since > timedelta(days=config.NOTES_MAX_WINDOW_DAYS):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                            detail=f'El rango debe ser no vacío y de como mucho {config.NOTES_MAX_WINDOW_DAYS} días')
+    return since, until
+
+
+@router.get('/{id}/notes', responses={
+    404: {'description': 'El usuario con id especificado no existe'},
+    422: {'description': 'Rango de fechas vacío o mayor que el máximo permitido'}
+})
+def get_notes(id:int,
+              since:datetime | None = Query(None, description='Desde (incluido); por defecto NOTES_RECENT_DAYS atrás'),
+              until:datetime | None = Query(None, description='Hasta (excluido); por defecto ahora'),
+              limit:int = Query(100, gt=0, le=1000),
+              db:Session = Depends(get_db, scope='function')) -> list[NoteInDb]:
+    '''
+    Obtiene las notas de un usuario creadas en [since, until), de la más reciente a la más antigua.
+    El rango siempre está acotado (como mucho NOTES_MAX_WINDOW_DAYS días): con la tabla particionada
+    solo se leen las particiones de esos meses
+    '''
+    since, until = notes_range(since, until)
+    notes = get_user_notes(db, id, since, until, limit)
+    if notes is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
+    return notes
 
 
 @router.post('/', status_code=status.HTTP_201_CREATED, responses={
     400: {'description': 'El usuario con el username especificado ya existe'}
 })
-def create(user:UserCreate, db:Session = Depends(get_db)) -> UserRead:
+def create(user:UserCreate, db:Session = Depends(get_db, scope='function')) -> UserRead:
     ''' Crea un nuevo usuario en el sistema'''
 
     try:
@@ -46,7 +145,7 @@ def create(user:UserCreate, db:Session = Depends(get_db)) -> UserRead:
     400: {'description': 'El usuario con el username especificado ya existe'},
     404: {'description':'El usuario con id especificado no existe'}
 })
-def put(id:int, user_update:UserUpdate, session: Session = Depends(get_db)) -> UserRead:
+def put(id:int, user_update:UserUpdate, session: Session = Depends(get_db, scope='function')) -> UserRead:
     '''Actualiza un usuario del sistema'''
     return _handle_update(id, user_update, session)
 
@@ -55,7 +154,7 @@ def put(id:int, user_update:UserUpdate, session: Session = Depends(get_db)) -> U
     400: {'description': 'El usuario con el username especificado ya existe'},
     404: {'description':'El usuario con id especificado no existe'}
 })
-def patch(id:int, user_patch:UserPatch, session:Session = Depends(get_db)) -> UserRead:
+def patch(id:int, user_patch:UserPatch, session:Session = Depends(get_db, scope='function')) -> UserRead:
     '''Actualiza un usuario del sistema parcialmente'''
     return _handle_update(id, user_patch, session)
     
@@ -64,12 +163,12 @@ def patch(id:int, user_patch:UserPatch, session:Session = Depends(get_db)) -> Us
         404: {"description": "El usuario con id especificado no existe"}
     }
 )
-def delete(id:int, session:Session = Depends(get_db)) -> None:
-    '''Elimina un usuario del sistema'''
+def delete(id:int, session:Session = Depends(get_db, scope='function')) -> None:
+    '''Elimina un usuario del sistema. Se da de baja al momento; sus datos y notas se borran después (ver purge)'''
     user = delete_user(session, id)
 
     if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='El usuario con id especificado no existe')
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
   
         
 
@@ -82,7 +181,7 @@ def _handle_update(id:int, user:UserUpdate | UserPatch, session:Session):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
 
     if not user_updated:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='El usuario con id especificado no existe')
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
     
 
     return user_updated
\ No newline at end of file
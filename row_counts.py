@@ -0,0 +1,126 @@
+'''
+Totales de filas para la cabecera X-Total-Count de los listados (p.ej. GET /users/?count=exact).
+
+SELECT COUNT(*) recorre la tabla entera (Postgres no guarda el número de filas), así que con decenas de
+millones tarda segundos. Hay dos modos:
+- exact: se cuenta una vez y el total se guarda en memoria; después se ajusta con cada alta y baja del log
+  de cambios (crud.user, importaciones), también las de otros procesos (change_feed.on_changes). Se vuelve a
+  contar cada config.ROW_COUNT_TTL segundos, lo que acota el desfase por escrituras que no pasan por el log.
+  Las altas y bajas confirmadas mientras se cuenta se suman solo si su `seq` es posterior al último cambio
+  que ve el COUNT (crud.user.count_users_at_seq): ni se pierden ni se cuentan dos veces. Con sharding no hay
+  ese seq y se suman todas: una confirmada justo al empezar el COUNT puede contarse dos veces hasta el
+  siguiente recuento.
+- estimated: estadísticas del planificador de Postgres (pg_class.reltuples), sin leer la tabla.
+  En SQLite no existen y se cuenta con COUNT, igual que si la tabla aún no se ha analizado.
+
+La cabecera X-Total-Count-Mode indica con qué modo se ha obtenido el total ('exact' o 'estimated').
+'''
+import time
+from collections.abc import Callable
+from threading import Lock
+
+from sqlalchemy.orm import Session
+
+import config
+from change_feed import on_changes
+from crud.user import count_users_at_seq, estimate_users
+from metrics import Counter
+
+
+COUNTS = Counter('journal_row_counts_total', 'Totales de filas servidos', ('entity', 'mode'))
+
+# Variación del número de filas según la operación del log de cambios
+_DELTAS = {'create': 1, 'delete': -1}
+
+_counters:list['RowCounter'] = []
+
+
+class RowCounter:
+    '''Total de filas de una entidad: contador en memoria (modo exact) + estimación (modo estimated)'''
+
+    def __init__(self, entity:str, count:Callable[[Session], tuple[int, int | None]],
+                 estimate:Callable[[Session], int | None], ttl:float | None = None):
+        '''`count` devuelve (total, seq del último cambio del log que ve el recuento o None si no se sabe)'''
+        self.entity = entity
+        self._count = count
+        self._estimate = estimate
+        self.ttl = config.ROW_COUNT_TTL if ttl is None else ttl
+        self._value:int | None = None
+        self._counted_at = 0.0
+        self._counting = False
+        self._pending:list[tuple[int, int]] = [] # (seq, variación) confirmados mientras se cuenta
+        self._lock = Lock() # los cambios llegan desde los hilos del threadpool
+        self._count_lock = Lock() # un único COUNT a la vez
+        _counters.append(self)
+
+    def apply(self, delta:int, seq:int):
+        with self._lock:
+            if self._value is not None:
+                self._value += delta
+            if self._counting:
+                # El COUNT en curso puede verlo o no según cuándo tome su snapshot: lo decide su seq
+                self._pending.append((seq, delta))
+
+    def clear(self):
+        with self._lock:
+            self._value = None
+
+    def _fresh(self) -> bool:
+        return self._value is not None and time.monotonic() - self._counted_at < self.ttl
+
+    def exact(self, session:Session) -> int:
+        '''Total del contador en memoria. Mientras otra petición recuenta se sirve el que ya había'''
+        with self._lock:
+            if self._fresh() or (self._counting and self._value is not None):
+                return self._value
+
+        with self._count_lock:
+            with self._lock:
+                if self._fresh(): # otro hilo acaba de contar
+                    return self._value
+                self._counting = True
+                self._pending = []
+            try:
+                total, seen = self._count(session)
+            finally:
+                with self._lock:
+                    self._counting = False
+
+            with self._lock:
+                self._value = total + sum(delta for seq, delta in self._pending if seen is None or seq > seen)
+                self._counted_at = time.monotonic()
+                return self._value
+
+    def estimated(self, session:Session) -> tuple[int, str]:
+        '''Devuelve (total, modo usado): sin estimación disponible se cuenta con COUNT'''
+        estimate = self._estimate(session)
+        if estimate is None:
+            return self._count(session)[0], 'exact'
+        return estimate, 'estimated'
+
+    def total(self, session:Session, mode:str) -> tuple[int, str]:
+        total, used = (self.exact(session), mode) if mode == 'exact' else self.estimated(session)
+        COUNTS.inc(entity=self.entity, mode=used)
+        return total, used
+
+
+def total_count_headers(total:int, mode:str) -> dict[str, str]:
+    return {'X-Total-Count': str(total), 'X-Total-Count-Mode': mode}
+
+
+def clear_all():
+    '''Olvida todos los contadores (tests, cambios masivos fuera de crud...)'''
+    for counter in _counters:
+        counter.clear()
+
+
+@on_changes
+def _apply_changes(changes:list[dict]):
+    for counter in _counters:
+        for change in changes:
+            delta = _DELTAS.get(change['op'], 0)
+            if delta and change['entity'] == counter.entity:
+                counter.apply(delta, change['seq'])
+
+
+users_counter = RowCounter('user', count_users_at_seq, estimate_users)
@@ -0,0 +1,29 @@
+from typing import Any, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+import config
+
+
+class BatchOperation(BaseModel):
+    method:Literal['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+    path:str = Field(examples=['/users/1'])
+    body:Optional[dict] = None
+
+
+class BatchRequest(BaseModel):
+    # atomic: todas las operaciones en una transacción, la primera que falla deshace el lote entero.
+    # independent: cada operación se confirma por separado, aunque otras fallen
+    mode:Literal['atomic', 'independent'] = 'independent'
+    operations:list[BatchOperation] = Field(min_length=1, max_length=config.BATCH_MAX_OPERATIONS)
+
+
+class BatchResult(BaseModel):
+    status:int
+    body:Any = None
+
+
+class BatchResponse(BaseModel):
+    mode:Literal['atomic', 'independent']
+    committed:bool # en modo atomic, si el lote se ha confirmado; en independent, siempre True
+    results:list[BatchResult]
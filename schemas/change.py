@@ -0,0 +1,21 @@
+from datetime import datetime
+from typing import Optional, Literal
+
+from pydantic import BaseModel, ConfigDict
+
+
+class ChangeRead(BaseModel):
+    seq:int
+    entity:Literal['user', 'note']
+    entity_id:int
+    op:Literal['create', 'update', 'delete']
+    data:Optional[dict] = None
+    changed_at:datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ChangePage(BaseModel):
+    changes:list[ChangeRead]
+    next_cursor:int  # se pasa como `since` en la siguiente llamada
+    has_more:bool
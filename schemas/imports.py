@@ -0,0 +1,26 @@
+from pydantic import BaseModel, computed_field
+
+
+class ImportReport(BaseModel):
+    kind:str
+    rows_read:int = 0
+    rows_imported:int = 0
+    rows_rejected:int = 0
+    elapsed:float = 0
+    errors_file:str | None = None
+
+    @computed_field
+    @property
+    def rows_per_sec(self) -> float:
+        return round(self.rows_read / self.elapsed, 1) if self.elapsed else 0.0
+
+
+class SeedReport(BaseModel):
+    users:int = 0
+    notes:int = 0
+    elapsed:float = 0
+
+    @computed_field
+    @property
+    def rows_per_sec(self) -> float:
+        return round((self.users + self.notes) / self.elapsed, 1) if self.elapsed else 0.0
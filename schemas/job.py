@@ -0,0 +1,20 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict
+
+
+class JobRead(BaseModel):
+    id:int
+    kind:str
+    status:str
+    processed:int
+    total:Optional[int] = None
+    result:Optional[dict] = None
+    error:Optional[str] = None
+    cancel_requested:bool
+    created_at:datetime
+    started_at:Optional[datetime] = None
+    finished_at:Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel, Field, ConfigDict
 from typing import Optional
 from .user import UserRead
@@ -24,3 +25,5 @@ class NoteUpdate(NoteBase):
 
 class NoteInDb(NoteCreate):
     id:int
+    created_at:datetime
+    updated_at:datetime
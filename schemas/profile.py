@@ -0,0 +1,16 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class ProfileInfo(BaseModel):
+    id:str
+    method:str
+    route:str
+    path:str
+    status_code:Optional[int] = None
+    duration_ms:float
+    samples:int
+    interval_ms:float
+    created_at:datetime
@@ -0,0 +1,9 @@
+from pydantic import BaseModel
+
+
+class PurgeReport(BaseModel):
+    users_deleted:int = 0
+    notes_deleted:int = 0
+    batches:int = 0
+    elapsed:float = 0
+    finished:bool = False # no queda nada por purgar (si es False se ha agotado el tiempo de la pasada)
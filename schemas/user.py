@@ -13,6 +13,7 @@ class UserBase(BaseModel):
 
 class UserRead(UserBase):
     id:int
+    note_count:int = 0 # desnormalizado en users, no cuesta un COUNT por usuario
     
 
 class UserCreate(UserBase):
@@ -32,6 +33,11 @@ class UserPatch(UserBase):
 
 
 
+class UsernameAvailability(BaseModel):
+    username:str
+    available:bool
+
+
 class UserInDb(UserRead):
     password:str = Field(min_length=8)
     is_active:bool = True
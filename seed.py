@@ -0,0 +1,199 @@
+'''
+Generador de datos sintéticos para benchmarks y pruebas de carga (sustituye a db.insertSampleData).
+
+Crea N usuarios y sus notas de forma determinista: con la misma semilla y los mismos parámetros se obtienen
+exactamente las mismas filas, sea cual sea el tamaño de bloque.
+- Notas por usuario con distribución de Zipf acotada: P(k) ∝ 1 / (k + 1)^s para k = 0..max_notes.
+  La mayoría tiene pocas notas y unos pocos muchas, como en los datos reales.
+- Edades válidas (normal alrededor de 38 años recortada a las restricciones de la tabla),
+  usernames únicos (nombre + id en hexadecimal) y email en ~70% de los usuarios.
+- Fechas de creación de las notas uniformes en los `days` días anteriores a `end` (por defecto el inicio del
+  día actual en UTC, así dos cargas del mismo día coinciden). Con notes particionada se crean antes las
+  particiones de esos meses (ver partitions.py).
+
+Las filas se generan por bloques y se cargan con importer.load_rows (COPY en Postgres, INSERT multi-fila en
+SQLite), un bloque por transacción: la memoria no depende de N. Los ids de usuario se asignan aquí, a partir
+del mayor existente, para poder generar sus notas sin consultar la BD.
+
+Uso:
+    python -m seed 1000000 [--max-notes 50] [--zipf-s 1.1] [--days 365] [--seed 42] [--chunk-size 10000] [--url URL]
+'''
+import argparse
+import bisect
+import itertools
+import random
+import sys
+import time
+from collections.abc import Callable, Iterator
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Engine, create_engine, select, func, text
+from sqlalchemy.orm import Session
+
+from importer import load_rows
+from models.note import Note
+from models.user import User
+from partitions import create_partitions
+from schemas.imports import SeedReport
+
+
+DEFAULT_MAX_NOTES = 50
+DEFAULT_ZIPF_S = 1.1
+DEFAULT_DAYS = 365
+DEFAULT_SEED = 42
+DEFAULT_CHUNK_SIZE = 10_000
+
+_CATALOG_BITS = 12
+_CATALOG_SIZE = 2 ** _CATALOG_BITS # descripciones distintas
+
+FIRST_NAMES = ('Ana', 'Lucia', 'Maria', 'Paula', 'Laura', 'Carmen', 'Sofia', 'Elena', 'Marta', 'Julia', 'Irene',
+               'Pepe', 'Juan', 'Pablo', 'Hugo', 'Mario', 'Daniel', 'Alvaro', 'Diego', 'Javier', 'Carlos', 'Sergio',
+               'Eugene', 'Squidward', 'Sandy', 'Patrick')
+LAST_NAMES = ('Garcia', 'Rodriguez', 'Gonzalez', 'Fernandez', 'Lopez', 'Martinez', 'Sanchez', 'Perez', 'Gomez',
+              'Martin', 'Jimenez', 'Ruiz', 'Hernandez', 'Diaz', 'Moreno', 'Alvarez', 'Romero', 'Navarro', 'Torres',
+              'Krabs', 'Tentacles')
+WORDS = ('lista', 'compra', 'ideas', 'reunion', 'viaje', 'libro', 'pendiente', 'proyecto', 'recordar', 'llamar',
+         'revisar', 'cita', 'medico', 'trabajo', 'casa', 'receta', 'pelicula', 'regalo', 'gimnasio', 'factura',
+         'notas', 'clase', 'examen', 'plan', 'semana', 'manana', 'tarde', 'enviar', 'correo', 'comprar', 'leer')
+
+
+def note_count_weights(max_notes:int, zipf_s:float) -> list[float]:
+    '''Pesos acumulados de la distribución de notas por usuario (índice k = k notas)'''
+    return list(itertools.accumulate(1 / (k + 1) ** zipf_s for k in range(max_notes + 1)))
+
+
+def mean_notes(max_notes:int, zipf_s:float) -> float:
+    '''Media de notas por usuario esperada con estos parámetros'''
+    weights = [1 / (k + 1) ** zipf_s for k in range(max_notes + 1)]
+    return sum(k * w for k, w in enumerate(weights)) / sum(weights)
+
+
+def _today() -> datetime:
+    return datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def generate(num_users:int, first_id:int = 1, max_notes:int = DEFAULT_MAX_NOTES, zipf_s:float = DEFAULT_ZIPF_S,
+             seed:int = DEFAULT_SEED, days:int = DEFAULT_DAYS,
+             end:datetime | None = None) -> Iterator[tuple[dict, list[dict]]]:
+    '''
+    Genera (usuario, notas del usuario) uno a uno. Todo sale de un único Random con semilla y de `end`:
+    determinista
+    '''
+    rng = random.Random(seed)
+    end = end or _today()
+    window = days * 86400
+    weights = note_count_weights(max_notes, zipf_s)
+    total_weight = weights[-1]
+    # Unir palabras por cada nota costaba más que cargarla: se eligen de un catálogo generado al principio
+    titles = [f'{word.capitalize()} {n}' for word in WORDS for n in range(1, 33)]
+    descriptions = [' '.join(rng.choices(WORDS, k=rng.randint(2, 20)))[:150] for _ in range(_CATALOG_SIZE)]
+
+    for i in range(num_users):
+        user_id = first_id + i
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        # username <= 20 caracteres: 8 del nombre + '_' + el id en hexadecimal (7 dígitos hasta 268M).
+        # Con el id y no con el índice, una segunda carga sobre la misma BD no repite usernames
+        username = f'{first_name.lower()[:8]}_{user_id:x}'
+        user = {
+            'id': user_id, 'first_name': first_name, 'last_name': last_name, 'username': username,
+            'email': f'{username}@example.com' if rng.random() < 0.7 else None,
+            'age': min(max(round(rng.gauss(38, 14)), 14), 99),
+            'password': f'{rng.getrandbits(64):016x}', 'is_active': True,
+        }
+
+        notes = []
+        for _ in range(bisect.bisect_left(weights, rng.random() * total_weight)):
+            created_at = end - timedelta(seconds=rng.random() * window)
+            notes.append({'title': rng.choice(titles), 'description': descriptions[rng.getrandbits(_CATALOG_BITS)],
+                          'user_id': user_id, 'created_at': created_at, 'updated_at': created_at})
+        yield user, notes
+
+
+def seed(engine:Engine, num_users:int, max_notes:int = DEFAULT_MAX_NOTES, zipf_s:float = DEFAULT_ZIPF_S,
+         seed:int = DEFAULT_SEED, chunk_size:int = DEFAULT_CHUNK_SIZE,
+         progress:Callable[[SeedReport], None] | None = None, days:int = DEFAULT_DAYS,
+         end:datetime | None = None) -> SeedReport:
+    '''
+    Inserta los datos generados por bloques de ~chunk_size filas (más las notas del último usuario),
+    cada bloque en su propia transacción. `progress` se llama tras cada bloque confirmado
+    '''
+    report = SeedReport()
+    start = time.perf_counter()
+    end = end or _today()
+
+    with engine.begin() as connection:
+        create_partitions(connection, start=(end - timedelta(days=days)).date(), today=end.date())
+
+    with Session(engine) as session:
+        with session.begin():
+            first_id = (session.scalar(select(func.max(User.id))) or 0) + 1
+        users:list[dict] = []
+        notes:list[dict] = []
+
+        def flush():
+            with session.begin():
+                if users:
+                    load_rows(session, User.__table__, users)
+                if notes:
+                    load_rows(session, Note.__table__, notes)
+            report.users += len(users)
+            report.notes += len(notes)
+            report.elapsed = time.perf_counter() - start
+            users.clear()
+            notes.clear()
+            if progress:
+                progress(report)
+
+        for user, user_notes in generate(num_users, first_id, max_notes, zipf_s, seed, days, end):
+            users.append(user)
+            notes.extend(user_notes)
+            if len(users) + len(notes) >= chunk_size:
+                flush()
+        if users:
+            flush()
+
+        if engine.dialect.name == 'postgresql':
+            # Los ids se han dado aquí: la secuencia debe continuar a partir del último
+            with session.begin():
+                session.execute(text("SELECT setval(pg_get_serial_sequence('users', 'id'), "
+                                     "(SELECT max(id) FROM users))"))
+
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera usuarios y notas sintéticos de forma determinista')
+    parser.add_argument('users', type=int, help='Número de usuarios')
+    parser.add_argument('--max-notes', type=int, default=DEFAULT_MAX_NOTES, help='Máximo de notas por usuario')
+    parser.add_argument('--zipf-s', type=float, default=DEFAULT_ZIPF_S,
+                        help='Exponente de la distribución de notas (mayor = más usuarios con pocas notas)')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS,
+                        help='Las notas se reparten entre los días anteriores a hoy')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Filas por transacción')
+    parser.add_argument('--url', help='URL de la BD (por defecto la de la aplicación)')
+    args = parser.parse_args()
+
+    import db # import tardío: registra la compatibilidad con SQLite y no conecta solo por importar el módulo
+
+    if args.url:
+        engine = create_engine(args.url)
+    elif db.shard_engines:
+        sys.exit('El generador no reparte las filas entre shards: indica una BD sin sharding con --url')
+    else:
+        engine = db.engine
+
+    print(f'Media esperada de notas por usuario: {mean_notes(args.max_notes, args.zipf_s):.2f}')
+
+    def print_progress(report:SeedReport):
+        print(f'\r{report.users} usuarios, {report.notes} notas ({report.rows_per_sec:.0f} filas/s)',
+              end='', flush=True)
+
+    report = seed(engine, args.users, args.max_notes, args.zipf_s, args.seed, args.chunk_size, print_progress,
+                  args.days)
+    print(f'\nDatos generados en {report.elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+'''
+Arranque de la API en producción: un proceso maestro y config.SERVE_WORKERS procesos hijo (fork) con uvicorn
+que atienden el mismo socket de escucha.
+
+- El maestro no importa la aplicación ni crea el engine: cada hijo importa main después del fork y abre sus
+  propias conexiones. Si otro servidor importa la app antes del fork (gunicorn --preload), db descarta en
+  el hijo las conexiones heredadas (os.register_at_fork).
+- Presupuesto de conexiones: con DB_CONNECTION_BUDGET_J cada hijo dimensiona su pool (y con él el threadpool,
+  la admisión y los workers de trabajos) con su parte del total, así la suma nunca supera el presupuesto.
+- SIGTERM / SIGINT al maestro: lo reenvía a los hijos, que dejan de aceptar conexiones, terminan las peticiones
+  en curso (como mucho config.SERVE_GRACEFUL_TIMEOUT segundos) y paran los workers de fondo (lifespan).
+- Reciclado: un hijo termina de la misma forma ordenada tras config.SERVE_MAX_REQUESTS peticiones (más un
+  margen aleatorio, para que no coincidan) y el maestro arranca otro. Los demás siguen atendiendo el socket:
+  no se corta el servicio. Acota el crecimiento de memoria. Un hijo que muere por un error también se reemplaza.
+- Estado en memoria de cada hijo: la caché de respuestas, los contadores de filas y los eventos SSE / WebSocket
+  siguen las escrituras de los demás leyendo el log de cambios (change_feed.py, cada CHANGE_FEED_INTERVAL_J
+  segundos); el filtro de usernames lo lee por su cuenta. La LRU de Idempotency-Key solo guarda respuestas ya
+  terminadas: quien coordina los reintentos entre hijos es la tabla idempotency_keys.
+
+Uso:
+    python -m serve [--host 0.0.0.0] [--port 8000] [--workers N]
+'''
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+
+APP = 'main:app'
+# Un hijo que muere antes de este tiempo (p.ej. no puede importar la app) se reemplaza tras una pausa
+MIN_UPTIME = 1.0
+
+logger = logging.getLogger('serve')
+
+
+def _run_worker(sock:socket.socket):
+    '''Cuerpo de un hijo: servidor uvicorn sobre el socket heredado. No vuelve'''
+    import uvicorn
+    import config
+
+    # Grupo de procesos propio: un Ctrl+C en la terminal llega solo al maestro, que avisa una única vez.
+    # uvicorn fuerza la salida sin esperar a las peticiones si recibe SIGINT dos veces
+    os.setpgid(0, 0)
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+
+    server = uvicorn.Server(uvicorn.Config(
+        APP, lifespan='on', timeout_graceful_shutdown=int(config.SERVE_GRACEFUL_TIMEOUT),
+        limit_max_requests=config.SERVE_MAX_REQUESTS or None,
+        limit_max_requests_jitter=config.SERVE_MAX_REQUESTS_JITTER,
+    ))
+    code = 0
+    try:
+        server.run(sockets=[sock])
+        code = 0 if server.started else 3
+    except BaseException:
+        logger.exception('Error en el worker')
+        code = 1
+    finally:
+        logging.shutdown()
+        os._exit(code) # sin volver al bucle del maestro ni ejecutar sus atexit
+
+
+class Master:
+    '''Arranca los hijos, los reemplaza cuando terminan y los para ordenadamente con SIGTERM / SIGINT'''
+
+    def __init__(self, sock:socket.socket, workers:int, graceful_timeout:float):
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.children:dict[int, float] = {} # pid -> instante de arranque
+        self.stopping_since:float | None = None
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(self.sock)
+        self.children[pid] = time.monotonic()
+        logger.info('Worker %s arrancado', pid)
+
+    def stop(self, sig, frame):
+        if self.stopping_since is not None:
+            return
+        logger.info('Parando: esperando a que terminen las peticiones en curso')
+        self.stopping_since = time.monotonic()
+        for pid in self.children:
+            self._signal(pid, signal.SIGTERM)
+
+    @staticmethod
+    def _signal(pid:int, sig:int):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                # Margen para el lifespan (parar los workers de fondo) tras el drenado de peticiones
+                if self.stopping_since is not None and \
+                        time.monotonic() - self.stopping_since > self.graceful_timeout + 10:
+                    logger.warning('Workers sin terminar tras el tiempo de espera: se matan')
+                    for child in self.children:
+                        self._signal(child, signal.SIGKILL)
+                time.sleep(0.1)
+                continue
+
+            started = self.children.pop(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping_since is not None:
+                continue
+
+            if code == 0:
+                logger.info('Worker %s reciclado', pid)
+            else:
+                logger.warning('Worker %s terminado con código %s', pid, code)
+                if time.monotonic() - started < MIN_UPTIME:
+                    time.sleep(MIN_UPTIME)
+            self.spawn()
+
+        logger.info('Parado')
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Arranca la API con varios procesos')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help='Procesos (por defecto SERVE_WORKERS_J)')
+    args = parser.parse_args()
+
+    # Antes de importar config: el reparto del presupuesto de conexiones depende del número de procesos
+    if args.workers is not None:
+        os.environ['SERVE_WORKERS_J'] = str(args.workers)
+    import config
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(name)s %(levelname)s %(message)s')
+    if config.DB_REQUEST_CONNECTIONS < 1 or config.JOB_WORKERS < 1:
+        sys.exit(f'{config.DB_MAX_CONNECTIONS} conexiones por proceso no bastan para {config.SERVE_WORKERS} '
+                 f'procesos: sube DB_CONNECTION_BUDGET_J o baja el número de procesos')
+
+    sock = socket.socket(socket.AF_INET6 if ':' in args.host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    logger.info('Escuchando en %s:%s con %s procesos de %s conexiones', args.host, args.port,
+                config.SERVE_WORKERS, config.DB_MAX_CONNECTIONS)
+
+    sys.exit(Master(sock, config.SERVE_WORKERS, config.SERVE_GRACEFUL_TIMEOUT).run())
+
+
+if __name__ == '__main__':
+    main()
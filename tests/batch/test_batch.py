@@ -0,0 +1,209 @@
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.exc import DataError, OperationalError
+
+import routers.batch
+from main import app
+from exceptions.deadline_exceptions import DeadlineExceeded
+from models.change import Change
+from models.note import Note
+from models.user import User
+
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def session_factory(api_db):
+    return api_db
+
+
+def user_body(username:str, **fields) -> dict:
+    return {'first_name': 'Pepe', 'last_name': 'Ruiz', 'username': username, 'age': 24, 'password': '12345678',
+            **fields}
+
+
+def usernames(session_factory) -> list[str]:
+    with session_factory() as session:
+        return session.scalars(select(User.username).where(User.is_active).order_by(User.id)).all()
+
+
+def run(operations:list[dict], mode:str = 'independent'):
+    response = client.post('/batch/', json={'mode': mode, 'operations': operations})
+    assert response.status_code == status.HTTP_200_OK
+    return response.json()
+
+
+def test_independent(session_factory, subtests):
+    '''Test que valida que en modo independent cada operación se ejecuta y confirma por separado'''
+    result = run([
+        {'method': 'POST', 'path': '/users/', 'body': user_body('pepe')},
+        {'method': 'POST', 'path': '/users/', 'body': user_body('PEPE')},
+        {'method': 'PATCH', 'path': '/users/1', 'body': {'age': 30}},
+        {'method': 'GET', 'path': '/users/1'},
+        {'method': 'GET', 'path': '/users/by-username/Pepe'},
+        {'method': 'POST', 'path': '/users/', 'body': user_body('otro')},
+        {'method': 'DELETE', 'path': '/users/2'},
+        {'method': 'PUT', 'path': '/users/99', 'body': user_body('nadie')},
+    ])
+    statuses = [r['status'] for r in result['results']]
+
+    with subtests.test('statuses'):
+        assert statuses == [201, 400, 200, 200, 200, 201, 204, 404]
+        assert result['committed'] is True
+
+    with subtests.test('bodies'):
+        assert result['results'][3]['body']['age'] == 30
+        assert result['results'][4]['body']['id'] == 1
+        assert result['results'][1]['body'] == {'detail': "El usuario 'PEPE' ya existe"}
+
+    with subtests.test('failures do not undo the rest'):
+        assert usernames(session_factory) == ['pepe']
+
+
+def test_independent_database_errors(session_factory, monkeypatch, subtests):
+    '''Test que valida que en modo independent un error de la BD da el status de la ruta y no afecta a las demás'''
+    class Canceled(Exception):
+        pgcode = '57014'
+
+    def failing_create(user, session):
+        # Falla a medias: deja una fila escrita en la transacción sin confirmar
+        session.add(User(first_name='Pepe', last_name='Ruiz', username='a_medias', age=24, password='12345678'))
+        session.flush()
+        raise DataError('INSERT', {}, Exception('value too long'))
+
+    def failing_get(session, id):
+        raise OperationalError('SELECT', {}, Exception('server closed the connection'))
+
+    def canceled_get(session, username):
+        raise OperationalError('SELECT', {}, Canceled())
+
+    def expired_delete(session, id):
+        raise DeadlineExceeded()
+
+    run([{'method': 'POST', 'path': '/users/', 'body': user_body('pepe')}])
+    create_user = routers.batch.create_user
+    monkeypatch.setattr(routers.batch, 'create_user', failing_create)
+    monkeypatch.setattr(routers.batch, 'get_user_row_by_id', failing_get)
+    monkeypatch.setattr(routers.batch, 'get_user_by_username', canceled_get)
+    monkeypatch.setattr(routers.batch, 'delete_user', expired_delete)
+    result = run([
+        {'method': 'POST', 'path': '/users/', 'body': user_body('otro')},
+        {'method': 'PATCH', 'path': '/users/1', 'body': {'age': 30}},
+        {'method': 'GET', 'path': '/users/1'},
+        {'method': 'GET', 'path': '/users/by-username/pepe'},
+        {'method': 'DELETE', 'path': '/users/1'},
+        {'method': 'PATCH', 'path': '/users/1', 'body': {'age': 31}},
+    ])
+
+    with subtests.test('statuses'):
+        assert [r['status'] for r in result['results']] == [500, 200, 500, 504, 504, 200]
+        assert result['results'][0]['body'] == {'detail': 'Internal Server Error'}
+        assert result['results'][3]['body'] == {'detail': DeadlineExceeded().message}
+
+    with subtests.test('failed operation rolled back, the rest committed'):
+        assert usernames(session_factory) == ['pepe']
+        with session_factory() as session:
+            assert session.get(User, 1).age == 31
+
+    with subtests.test('atomic rolls back on a database error'):
+        monkeypatch.setattr(routers.batch, 'create_user', create_user)
+        monkeypatch.setattr(routers.batch, 'get_user_row_by_id', failing_get)
+        failed = run([
+            {'method': 'POST', 'path': '/users/', 'body': user_body('nuevo')},
+            {'method': 'GET', 'path': '/users/1'},
+            {'method': 'PATCH', 'path': '/users/1', 'body': {'age': 40}},
+        ], 'atomic')
+        assert [r['status'] for r in failed['results']] == [201, 500, 424]
+        assert usernames(session_factory) == ['pepe']
+
+
+def test_atomic(session_factory, subtests):
+    '''Test que valida que en modo atomic el lote se confirma entero o no se confirma nada'''
+    ok = run([
+        {'method': 'POST', 'path': '/users/', 'body': user_body('pepe')},
+        {'method': 'POST', 'path': '/users/', 'body': user_body('otro')},
+        {'method': 'PATCH', 'path': '/users/1', 'body': {'last_name': 'Lopez'}},
+    ], 'atomic')
+
+    with subtests.test('committed'):
+        assert ok['committed'] is True
+        assert [r['status'] for r in ok['results']] == [201, 201, 200]
+        assert usernames(session_factory) == ['pepe', 'otro']
+
+    failed = run([
+        {'method': 'POST', 'path': '/users/', 'body': user_body('nuevo')},
+        {'method': 'DELETE', 'path': '/users/1'},
+        {'method': 'POST', 'path': '/users/', 'body': user_body('OTRO')},
+        {'method': 'PATCH', 'path': '/users/2', 'body': {'age': 50}},
+    ], 'atomic')
+
+    with subtests.test('first failure rolls back'):
+        assert failed['committed'] is False
+        assert [r['status'] for r in failed['results']] == [201, 204, 400, 424]
+        assert usernames(session_factory) == ['pepe', 'otro']
+
+    with subtests.test('change log only has committed batches'):
+        with session_factory() as session:
+            assert session.scalars(select(Change.op).order_by(Change.seq)).all() == ['create', 'create', 'update']
+
+
+def test_invalid_operations(session_factory, subtests):
+    '''Test que valida las operaciones con ruta, método o cuerpo no válidos'''
+    result = run([
+        {'method': 'GET', 'path': '/notes/1'},
+        {'method': 'POST', 'path': '/users/1'},
+        {'method': 'POST', 'path': '/users/', 'body': user_body('x')},
+    ])
+
+    with subtests.test('statuses'):
+        assert [r['status'] for r in result['results']] == [404, 405, 422]
+
+    with subtests.test('validation detail'):
+        assert result['results'][2]['body']['detail'][0]['loc'] == ['body', 'username']
+
+    with subtests.test('limits'):
+        assert client.post('/batch/', json={'operations': []}).status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
+def test_read_routes(session_factory, subtests):
+    '''Test que valida el listado, la disponibilidad de username y las notas de un usuario dentro de un lote'''
+    with session_factory() as session, session.begin():
+        session.add_all([User(first_name='Pepe', last_name='Ruiz', username=f'user_{i}', age=24, password='12345678')
+                         for i in range(3)])
+        session.add(Note(title='Nota', description='Nota de prueba', user_id=1))
+
+    result = run([
+        {'method': 'GET', 'path': '/users/'},
+        {'method': 'GET', 'path': '/users?after=1&limit=1'},
+        {'method': 'GET', 'path': '/users/?count=exact'},
+        {'method': 'GET', 'path': '/users/?limit=0'},
+        {'method': 'GET', 'path': '/users/availability?username=USER_0'},
+        {'method': 'GET', 'path': '/users/availability?username=libre'},
+        {'method': 'GET', 'path': '/users/availability'},
+        {'method': 'GET', 'path': '/users/1/notes?limit=10'},
+        {'method': 'GET', 'path': '/users/99/notes'},
+        {'method': 'GET', 'path': '/users/1/notes?since=2024-01-01&until=2020-01-01'},
+        {'method': 'DELETE', 'path': '/users/1/notes'},
+    ])
+    results = result['results']
+
+    with subtests.test('statuses'):
+        assert [r['status'] for r in results] == [200, 200, 400, 422, 200, 200, 422, 200, 404, 422, 405]
+
+    with subtests.test('list'):
+        assert [user['username'] for user in results[0]['body']] == ['user_0', 'user_1', 'user_2']
+        assert [user['id'] for user in results[1]['body']] == [2]
+
+    with subtests.test('query validation detail'):
+        assert results[3]['body']['detail'][0]['loc'] == ['query', 'limit']
+        assert results[6]['body']['detail'][0]['loc'] == ['query', 'username']
+
+    with subtests.test('availability'):
+        assert results[4]['body'] == {'username': 'USER_0', 'available': False}
+        assert results[5]['body'] == {'username': 'libre', 'available': True}
+
+    with subtests.test('notes'):
+        assert [(note['title'], note['user_id']) for note in results[7]['body']] == [('Nota', 1)]
@@ -0,0 +1,159 @@
+import asyncio
+import time
+from unittest.mock import Mock
+
+from anyio import to_thread
+from fastapi.testclient import TestClient
+
+from main import app
+from db import get_db
+from response_cache import ResponseCache, users_cache, _invalidate
+
+
+class Renderer:
+    '''render() de prueba que cuenta las llamadas y devuelve el número de llamada'''
+
+    def __init__(self, delay:float = 0):
+        self.calls = 0
+        self.delay = delay
+
+    def __call__(self) -> bytes:
+        self.calls += 1
+        time.sleep(self.delay)
+        return str(self.calls).encode()
+
+
+def test_miss_then_hit(subtests):
+    '''Test que valida que la segunda petición se sirve de caché sin recalcular'''
+    cache = ResponseCache('test', 'test')
+    render = Renderer()
+
+    async def scenario():
+        return await cache.get('k', render), await cache.get('k', render)
+
+    first, second = asyncio.run(scenario())
+
+    with subtests.test('states'):
+        assert (first[1], second[1]) == ('miss', 'hit')
+
+    with subtests.test('same bytes, one render'):
+        assert first[0] == second[0] == b'1'
+        assert render.calls == 1
+
+
+def test_stale_while_revalidate(subtests):
+    '''Test que valida que tras una escritura se sirve la versión antigua y se refresca una sola vez'''
+    cache = ResponseCache('test', 'test')
+    render = Renderer(delay=0.05)
+
+    async def scenario():
+        await cache.get('k', render)
+        cache.bump()
+        stale = [await cache.get('k', render) for _ in range(3)]
+        await asyncio.sleep(0.2) # deja terminar el refresco en segundo plano
+        return stale, await cache.get('k', render)
+
+    stale, fresh = asyncio.run(scenario())
+
+    with subtests.test('stale served'):
+        assert stale == [(b'1', 'stale')] * 3
+
+    with subtests.test('single background refresh'):
+        assert render.calls == 2
+        assert fresh == (b'2', 'hit')
+
+
+def test_concurrent_misses_single_render():
+    '''Test que valida que varias peticiones sin caché esperan a un único cálculo'''
+    cache = ResponseCache('test', 'test')
+    render = Renderer(delay=0.05)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get('k', render) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+
+    assert render.calls == 1
+    assert {body for body, _ in results} == {b'1'}
+
+
+def test_cancelled_miss_handed_over(subtests):
+    '''Test que valida que si se cancela la petición que calcula una entrada, las que esperaban no fallan'''
+    cache = ResponseCache('test', 'user', ttl=60, stale_ttl=60)
+    renders = []
+
+    def render(name:str):
+        def inner():
+            renders.append(name)
+            time.sleep(0.05)
+            return name.encode()
+        return inner
+
+    async def scenario():
+        leader = asyncio.create_task(cache.get('k', render('leader')))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(cache.get('k', render(f'waiter_{i}'))) for i in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await asyncio.gather(*waiters), leader
+
+    results, leader = asyncio.run(scenario())
+
+    with subtests.test('leader cancelled'):
+        assert leader.cancelled()
+
+    with subtests.test('waiters served by one of them'):
+        assert renders == ['leader', 'waiter_0']
+        assert results == [(b'waiter_0', 'miss')] * 3
+
+
+def test_get_all_users_cached(subtests):
+    '''Test que valida que GET /users/ se sirve de caché y que una escritura confirmada de usuarios la invalida'''
+    session = Mock()
+    session.execute.return_value.mappings.return_value.all.return_value = [
+        {'id': 1, 'first_name': 'Pepe', 'last_name': 'Ruiz', 'username': 'pep_ul', 'email': None, 'age': 24}
+    ]
+    app.dependency_overrides[get_db] = lambda: session
+    try:
+        client = TestClient(app)
+        first = client.get('/users/')
+        second = client.get('/users/')
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    with subtests.test('x-cache'):
+        assert [r.headers['x-cache'] for r in (first, second)] == ['miss', 'hit']
+
+    with subtests.test('queries'):
+        assert session.execute.call_count == 1
+
+    with subtests.test('body'):
+        assert first.json() == second.json() == [
+            {'id': 1, 'first_name': 'Pepe', 'last_name': 'Ruiz', 'username': 'pep_ul', 'email': None, 'age': 24}
+        ]
+
+    with subtests.test('invalidation'):
+        generation = users_cache.generation
+        _invalidate([{'entity': 'note'}])
+        assert users_cache.generation == generation
+        _invalidate([{'entity': 'user'}])
+        assert users_cache.generation == generation + 1
+
+
+def test_background_refresh_uses_threadpool_limiter():
+    '''Test que valida que los refrescos en segundo plano ocupan hueco del threadpool limitado de anyio'''
+    cache = ResponseCache('test', 'test')
+    render = Renderer(delay=0.1)
+
+    async def scenario():
+        limiter = to_thread.current_default_thread_limiter()
+        await cache.get('k', render)
+        cache.bump()
+        await cache.get('k', render)
+        await asyncio.sleep(0.05)
+        borrowed = limiter.borrowed_tokens
+        await asyncio.gather(*cache._refresh_tasks)
+        return borrowed
+
+    assert asyncio.run(scenario()) == 1
+    assert render.calls == 2
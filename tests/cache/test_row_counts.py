@@ -0,0 +1,110 @@
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+from main import app
+from crud.user import create_user, delete_user, count_users_at_seq
+from models.user import User
+from row_counts import RowCounter, users_counter
+from schemas.user import UserCreate
+
+
+def add_user(session_factory, username:str) -> int:
+    with session_factory() as session:
+        return create_user(UserCreate(first_name='Pepe', last_name='Ruiz', username=username, age=24,
+                                      password='12345678'), session).id
+
+
+def test_exact_follows_crud_writes(session_factory, subtests):
+    '''Test que valida que el contador se ajusta con las altas y bajas de crud.user sin volver a contar'''
+    calls = []
+
+    def count(session):
+        calls.append(1)
+        return count_users_at_seq(session)
+
+    counter = RowCounter('user', count, lambda session: None, ttl=60)
+    for i in range(3):
+        add_user(session_factory, f'user_{i}')
+
+    with subtests.test('first request counts'):
+        assert counter.exact(session_factory()) == 3
+        assert len(calls) == 1
+
+    user_id = add_user(session_factory, 'user_3')
+    add_user(session_factory, 'user_4')
+    with session_factory() as session:
+        delete_user(session, user_id)
+        delete_user(session, 999) # no existe: no cambia nada
+
+    with subtests.test('incremental'):
+        assert counter.exact(session_factory()) == 4
+        assert len(calls) == 1
+
+    with subtests.test('writes outside crud.user seen after ttl'):
+        with session_factory() as session, session.begin():
+            session.execute(insert(User).values(first_name='Pepe', last_name='Ruiz', username='bulk',
+                                                age=24, password='12345678'))
+        assert counter.exact(session_factory()) == 4
+        counter.ttl = 0
+        assert counter.exact(session_factory()) == 5
+        assert len(calls) == 2
+
+
+def test_changes_during_count(session_factory, subtests):
+    '''Test que valida que los cambios confirmados mientras se cuenta no se pierden ni se cuentan dos veces'''
+    def count(session):
+        counter.apply(1, seq=5) # alta confirmada antes del snapshot del COUNT: ya contada
+        counter.apply(1, seq=6) # alta confirmada después
+        counter.apply(-1, seq=7)
+        counter.apply(1, seq=8)
+        return 10, seen
+
+    with subtests.test('by seq'):
+        seen = 5
+        counter = RowCounter('test', count, lambda session: None)
+        assert counter.exact(session_factory()) == 11
+
+    with subtests.test('seq unknown (sharding)'):
+        seen = None
+        counter = RowCounter('test', count, lambda session: None)
+        assert counter.exact(session_factory()) == 12
+
+
+def test_count_and_seq_same_snapshot(session_factory):
+    '''Test que valida que el recuento devuelve el seq del último cambio que ya incluye'''
+    add_user(session_factory, 'pepe')
+    add_user(session_factory, 'luis')
+    with session_factory() as session:
+        assert count_users_at_seq(session) == (2, 2)
+
+
+def test_estimated_falls_back_to_count(session_factory):
+    '''Test que valida que sin estadísticas (SQLite) el modo estimated cuenta e indica que es exacto'''
+    add_user(session_factory, 'pepe')
+    with session_factory() as session:
+        assert users_counter.total(session, 'estimated') == (1, 'exact')
+
+
+def test_total_count_header(api_db, subtests):
+    '''Test que valida la cabecera X-Total-Count de GET /users/ y el modo usado'''
+    for i in range(3):
+        add_user(api_db, f'user_{i}')
+
+    client = TestClient(app)
+    plain = client.get('/users/')
+    exact = client.get('/users/', params={'limit': 1, 'count': 'exact'})
+    add_user(api_db, 'user_3')
+    after_create = client.get('/users/', params={'limit': 1, 'count': 'exact'})
+    invalid = client.get('/users/', params={'count': 'approximate'})
+
+    with subtests.test('only when asked'):
+        assert 'X-Total-Count' not in plain.headers
+
+    with subtests.test('exact'):
+        assert len(exact.json()) == 1
+        assert (exact.headers['X-Total-Count'], exact.headers['X-Total-Count-Mode']) == ('3', 'exact')
+        assert after_create.headers['X-Total-Count'] == '4'
+
+    with subtests.test('invalid mode'):
+        assert invalid.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
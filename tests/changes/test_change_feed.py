@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import crud.change
+from change_feed import ChangeFeed
+from crud.user import create_user
+from models.change import Change
+from schemas.user import UserCreate
+
+
+@pytest.fixture(autouse=True)
+def commit_hooks(monkeypatch):
+    '''Solo los hooks del feed del test'''
+    monkeypatch.setattr(crud.change, '_commit_hooks', [])
+
+
+def make_user(username:str) -> UserCreate:
+    return UserCreate(first_name='Pepe', last_name='Ruiz', username=username, age=24, password='12345678')
+
+
+def remote_change(engine, entity_id:int):
+    '''Un cambio confirmado por otro proceso: llega al log sin pasar por los hooks de este'''
+    with Session(engine) as session, session.begin():
+        session.execute(insert(Change).values(entity='user', entity_id=entity_id, op='create', process='otro',
+                                              data={'username': f'remoto_{entity_id}'},
+                                              changed_at=datetime.now(timezone.utc)))
+
+
+def test_feed_delivers_other_processes_changes(engine, subtests):
+    '''Test que valida que el feed reparte los cambios de otros procesos y, en orden, los de todos'''
+    feed = ChangeFeed(engine, interval=60)
+    received, ordered = [], []
+    feed.subscribe(lambda changes: received.extend(c['entity_id'] for c in changes))
+    feed.subscribe(lambda changes: ordered.extend(c['entity_id'] for c in changes), in_order=True)
+
+    remote_change(engine, 90) # anterior al arranque: no se reparte
+    feed.poll()
+
+    with Session(engine) as session:
+        local_id = create_user(make_user('local'), session).id
+    remote_change(engine, 91)
+
+    with subtests.test('local changes on commit'):
+        assert received == [local_id]
+        assert ordered == []
+
+    feed.poll()
+
+    with subtests.test('remote changes from the log'):
+        assert received == [local_id, 91]
+
+    with subtests.test('ordered subscribers get every change in seq order'):
+        assert ordered == [local_id, 91]
+
+    with subtests.test('cursor advances'):
+        feed.poll()
+        assert received == [local_id, 91]
+        assert ordered == [local_id, 91]
+
+
+def test_feed_disabled(engine):
+    '''Test que valida que sin intervalo todos los suscritos reciben los cambios al confirmarse, sin leer el log'''
+    feed = ChangeFeed(engine, interval=0)
+    ordered = []
+    feed.subscribe(lambda changes: ordered.extend(c['entity_id'] for c in changes), in_order=True)
+    feed.start()
+
+    with Session(engine) as session:
+        local_id = create_user(make_user('local'), session).id
+
+    assert ordered == [local_id]
+    assert feed._thread is None
@@ -0,0 +1,71 @@
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from main import app
+from crud.user import create_user, update_user, delete_user
+from schemas.user import UserCreate, UserPatch
+
+
+@pytest.fixture
+def engine(engine, api_db):
+    return engine
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def make_user(username:str) -> UserCreate:
+    return UserCreate(first_name='Pepe', last_name='Ruiz', username=username, age=24, password='12345678')
+
+
+def test_changes_from_crud_writes(engine, client, subtests):
+    '''Test que valida que create/update/delete de crud.user quedan en el log de cambios, en orden'''
+    # Una sesión por operación, igual que una por petición en la API
+    with Session(engine) as session:
+        user_id = create_user(make_user('pepe_r'), session).id
+    with Session(engine) as session:
+        update_user(user_id, UserPatch(age=30), session)
+    with Session(engine) as session:
+        delete_user(session, user_id)
+
+    response = client.get('/changes/')
+    data = response.json()
+
+    with subtests.test('status code'):
+        assert response.status_code == status.HTTP_200_OK
+
+    with subtests.test('ops in order'):
+        assert [(c['op'], c['entity_id']) for c in data['changes']] == [
+            ('create', user_id), ('update', user_id), ('delete', user_id)
+        ]
+        assert [c['seq'] for c in data['changes']] == sorted(c['seq'] for c in data['changes'])
+
+    with subtests.test('snapshot and tombstone'):
+        assert data['changes'][1]['data']['age'] == 30
+        assert 'password' not in data['changes'][1]['data']
+        assert data['changes'][2]['data'] is None
+
+
+def test_changes_pagination(engine, client, subtests):
+    '''Test que valida la paginación por cursor del endpoint GET /changes'''
+    for i in range(5):
+        with Session(engine) as session:
+            create_user(make_user(f'user_{i}'), session)
+
+    first = client.get('/changes/', params={'limit': 3}).json()
+    second = client.get('/changes/', params={'since': first['next_cursor'], 'limit': 3}).json()
+    empty = client.get('/changes/', params={'since': second['next_cursor']}).json()
+
+    with subtests.test('first page'):
+        assert len(first['changes']) == 3 and first['has_more']
+
+    with subtests.test('second page'):
+        assert len(second['changes']) == 2 and not second['has_more']
+        assert second['changes'][0]['seq'] > first['next_cursor']
+
+    with subtests.test('up to date'):
+        assert empty == {'changes': [], 'next_cursor': second['next_cursor'], 'has_more': False}
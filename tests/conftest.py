@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import db # noqa: F401 registra char_length y las foreign keys para SQLite
+from db import get_db
+from main import app
+from models.base import Base
+from response_cache import clear_all
+from row_counts import clear_all as clear_row_counts
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'postgres: necesita una BD Postgres (variables DB_*_J); si no, se salta')
+
+
+@pytest.fixture(autouse=True)
+def clear_response_caches():
+    '''Cada test parte de cachés de respuestas y contadores de filas vacíos (los datos mockeados cambian entre tests)'''
+    clear_all()
+    clear_row_counts()
+    yield
+    clear_all()
+    clear_row_counts()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    '''BD SQLite en fichero, propia de cada test, con todas las tablas'''
+    engine = create_engine(f'sqlite:///{tmp_path / "test.db"}')
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    '''Sesiones contra `engine`, con la misma configuración que db.SessionLocal'''
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def api_db(session_factory):
+    '''Los endpoints de la app usan `session_factory` (get_db) durante el test'''
+    def override_get_db():
+        with session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    yield session_factory
+    app.dependency_overrides.pop(get_db, None)
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import crud.change
+import routers.events
+from main import app
+from crud.change import get_changes
+from crud.user import create_user, update_user
+from schemas.user import UserCreate, UserPatch
+from events import Broker, broker
+
+
+def change(seq:int, user_id:int, op:str = 'update') -> dict:
+    return {'seq': seq, 'entity': 'user', 'entity_id': user_id, 'op': op, 'data': {'id': user_id}}
+
+
+def make_user(username:str) -> UserCreate:
+    return UserCreate(first_name='Pepe', last_name='Ruiz', username=username, age=24, password='12345678')
+
+
+@pytest.fixture
+def session_factory(session_factory, monkeypatch):
+    monkeypatch.setattr(routers.events, 'SessionLocal', session_factory)
+    return session_factory
+
+
+def test_broker_filters_by_user(subtests):
+    '''Test que valida que cada suscriptor recibe solo los cambios de su filtro, publicados desde otro hilo'''
+
+    async def scenario():
+        broker = Broker()
+        everything = broker.subscribe()
+        only_1 = broker.subscribe(user_id=1)
+
+        publisher = threading.Thread(target=broker.publish, args=([change(1, 1), change(2, 2)],))
+        publisher.start()
+        publisher.join()
+
+        return await everything.next_batch(1), await only_1.next_batch(1)
+
+    everything, only_1 = asyncio.run(scenario())
+
+    with subtests.test('all'):
+        assert [e.seq for e in everything] == [1, 2]
+
+    with subtests.test('user filter'):
+        assert [e.seq for e in only_1] == [1]
+
+    with subtests.test('shared encoding'):
+        assert everything[0] is only_1[0]
+        assert everything[0].sse.startswith(b'id: 1\nevent: user.update\n')
+
+
+def test_slow_consumer_overflow(subtests):
+    '''Test que valida que un suscriptor que no lee a tiempo queda marcado para desconexión'''
+
+    async def scenario():
+        broker = Broker()
+        subscriber = broker.subscribe(buffer_size=2)
+        broker.publish([change(seq, 1) for seq in range(1, 4)])
+        return subscriber
+
+    subscriber = asyncio.run(scenario())
+
+    with subtests.test('overflowed'):
+        assert subscriber.overflowed
+
+    with subtests.test('buffer bounded'):
+        assert len(subscriber.buffer) == 2
+
+
+def test_websocket_receives_committed_changes(session_factory, subtests):
+    '''Test que valida que un cambio hecho con crud.user llega por WebSocket tras el commit'''
+    with session_factory() as session:
+        user_id = create_user(make_user('pepe_r'), session).id
+
+    with TestClient(app).websocket_connect(f'/events/ws?user_id={user_id}') as ws:
+        with session_factory() as session:
+            create_user(make_user('otro_user'), session) # otro usuario: filtrado
+        with session_factory() as session:
+            update_user(user_id, UserPatch(age=30), session)
+
+        message = ws.receive_json()
+
+    with subtests.test('filtered by user'):
+        assert (message['entity_id'], message['op']) == (user_id, 'update')
+
+    with subtests.test('data'):
+        assert message['data']['age'] == 30
+
+
+def test_websocket_late_lower_seq_delivered(session_factory, monkeypatch):
+    '''Test que valida que un cambio publicado después de otro con seq mayor (commits concurrentes) también llega'''
+    pending = []
+    monkeypatch.setattr(crud.change, '_commit_hooks', [pending.extend])
+    for username in ('user_1', 'user_2'):
+        with session_factory() as session:
+            create_user(make_user(username), session)
+    first, second = pending
+
+    with TestClient(app).websocket_connect('/events/ws') as ws:
+        while not broker._by_user: # se suscribe después de aceptar la conexión
+            time.sleep(0.01)
+        broker.publish([second])
+        broker.publish([first])
+        received = [ws.receive_json()['seq'] for _ in range(2)]
+
+    with session_factory() as session:
+        assert received == [c.seq for c in reversed(get_changes(session, 0, 10))]
+
+
+async def read_sse(path:str, headers:dict, events:int) -> tuple[dict, list[str]]:
+    '''
+    Llama a la app ASGI directamente y se desconecta tras recibir `events` eventos
+    (el TestClient espera a que termine la respuesta y un flujo SSE no termina nunca)
+    '''
+    disconnect = asyncio.Event()
+    start:dict = {}
+    lines:list[str] = []
+
+    async def receive():
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            start.update(message)
+        elif message['type'] == 'http.response.body':
+            lines.extend(message.get('body', b'').decode().splitlines())
+            if sum(l.startswith('data: ') for l in lines) >= events:
+                disconnect.set()
+
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        'client': ('test', 1), 'server': ('test', 80),
+    }
+    await asyncio.wait_for(app(scope, receive, send), 5)
+    return start, lines
+
+
+def test_sse_replays_from_last_event_id(session_factory, subtests):
+    '''Test que valida que al reconectar con Last-Event-ID se reenvían los cambios perdidos'''
+    for username in ('user_1', 'user_2', 'user_3'):
+        with session_factory() as session:
+            create_user(make_user(username), session)
+
+    start, lines = asyncio.run(read_sse('/events/', {'Last-Event-ID': '1'}, events=2))
+
+    with subtests.test('content type'):
+        assert (b'content-type', b'text/event-stream; charset=utf-8') in start['headers']
+
+    with subtests.test('events after cursor'):
+        assert [l for l in lines if l.startswith('id: ')] == ['id: 2', 'id: 3']
+        data = [json.loads(l[len('data: '):]) for l in lines if l.startswith('data: ')]
+        assert [d['data']['username'] for d in data] == ['user_2', 'user_3']
+
+
+def test_backlog_over_limit_signals_resync(session_factory, monkeypatch, subtests):
+    '''Test que valida que si el backlog supera el límite se envía hasta él y un evento resync, sin perder nada'''
+    monkeypatch.setattr(routers.events.config, 'EVENTS_REPLAY_LIMIT', 2)
+    for username in ('user_1', 'user_2', 'user_3', 'user_4'):
+        with session_factory() as session:
+            create_user(make_user(username), session)
+
+    start, lines = asyncio.run(read_sse('/events/', {'Last-Event-ID': '0'}, events=10))
+
+    with subtests.test('first page'):
+        assert [l for l in lines if l.startswith('id: ')] == ['id: 1', 'id: 2']
+
+    with subtests.test('resync event'):
+        assert lines[-3:-1] == ['event: resync', 'data: {"since": 2}']
+
+
+def test_user_backlog_filtered_in_sql(session_factory, monkeypatch):
+    '''Test que valida que el límite del backlog filtrado por usuario solo cuenta los cambios de ese usuario'''
+    monkeypatch.setattr(routers.events.config, 'EVENTS_REPLAY_LIMIT', 2)
+    with session_factory() as session:
+        user_id = create_user(make_user('pepe_r'), session).id
+    for username in ('user_1', 'user_2', 'user_3'):
+        with session_factory() as session:
+            create_user(make_user(username), session)
+    with session_factory() as session:
+        update_user(user_id, UserPatch(age=30), session)
+
+    start, lines = asyncio.run(read_sse(f'/events/?user_id={user_id}', {'Last-Event-ID': '0'}, events=2))
+
+    assert [l for l in lines if l.startswith('id: ')] == ['id: 1', 'id: 5']
+    assert not any(l == 'event: resync' for l in lines)
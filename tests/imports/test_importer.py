@@ -0,0 +1,126 @@
+import json
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy import select, func
+
+import config
+import crud.change
+from main import app
+from db import get_db
+from models.change import Change
+from models.user import User
+from models.note import Note
+from importer import import_rows
+from username_filter import username_filter
+
+
+USERS_CSV = '''first_name,last_name,username,email,age,password
+Pepe,Ruiz,pepe_r,,24,12345678
+Ana,Lopez,ana_l,ana@correo.com,30,12345678
+X,Lopez,corto,,30,12345678
+Luis,Gomez,pepe_r,,40,12345678
+Marta,Diaz,marta_d,,150,12345678
+'''
+
+
+@pytest.fixture
+def session(session_factory):
+    '''Sesión contra una BD SQLite en fichero (ruta de executemany del importador)'''
+    with session_factory() as session:
+        yield session
+
+
+def test_import_users_csv(session, tmp_path, subtests):
+    '''Test que importa usuarios desde CSV, rechazando filas inválidas y duplicadas'''
+    errors_path = tmp_path / 'errors.ndjson'
+    progress = []
+
+    report = import_rows('users', USERS_CSV.splitlines(keepends=True), 'csv', session, chunk_size=2,
+                         errors_path=str(errors_path), progress=lambda r: progress.append(r.rows_read))
+
+    with subtests.test('report'):
+        assert (report.rows_read, report.rows_imported, report.rows_rejected) == (5, 2, 3)
+        assert report.errors_file == str(errors_path)
+
+    with subtests.test('progress per chunk'):
+        assert progress == [2, 4, 5]
+
+    with subtests.test('rows in db'):
+        usernames = session.scalars(select(User.username).order_by(User.id)).all()
+        assert usernames == ['pepe_r', 'ana_l']
+
+    with subtests.test('rejected lines'):
+        rejected = [json.loads(line)['line'] for line in errors_path.read_text().splitlines()]
+        assert sorted(rejected) == [4, 5, 6]
+
+
+def test_import_notes_ndjson(session, tmp_path, subtests):
+    '''Test que importa notas desde NDJSON, rechazando JSON inválido y FK inexistentes'''
+    with session.begin():
+        session.add(User(id=1, first_name='Pepe', last_name='Ruiz', username='pepe_r', age=24, password='12345678'))
+
+    lines = [
+        json.dumps({'title': 'Nota 1', 'description': 'Descripcion 1', 'user_id': 1}),
+        '{no es json',
+        json.dumps({'title': 'Nota 2', 'description': 'Descripcion 2', 'user_id': 99}),
+        json.dumps({'title': 'Nota 3', 'description': 'Descripcion 3', 'user_id': 1}),
+    ]
+    report = import_rows('notes', lines, 'ndjson', session, errors_path=str(tmp_path / 'errors.ndjson'))
+
+    with subtests.test('report'):
+        assert (report.rows_read, report.rows_imported, report.rows_rejected) == (4, 2, 2)
+
+    with subtests.test('rows in db'):
+        assert session.scalar(select(func.count()).select_from(Note)) == 2
+
+
+def test_import_endpoint(session, tmp_path, monkeypatch, subtests):
+    '''Test del endpoint POST /imports/{kind} con un CSV en el cuerpo'''
+    monkeypatch.setattr(config, 'IMPORT_ERRORS_DIR', str(tmp_path))
+    app.dependency_overrides[get_db] = lambda: session
+    try:
+        client = TestClient(app)
+        response = client.post('/imports/users', content=USERS_CSV, headers={'Content-Type': 'text/csv'})
+        unsupported = client.post('/imports/users', content=USERS_CSV, headers={'Content-Type': 'text/plain'})
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    with subtests.test('status code'):
+        assert response.status_code == status.HTTP_200_OK
+        assert unsupported.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+    with subtests.test('report'):
+        data = response.json()
+        assert (data['rows_imported'], data['rows_rejected']) == (2, 3)
+        assert 'rows_per_sec' in data
+
+
+def test_import_users_change_log(session, monkeypatch, subtests):
+    '''Test que valida que los usuarios importados quedan en el log de cambios y llegan al filtro de usernames'''
+    with session.begin():
+        # Dado de baja: su username se puede volver a usar y no debe registrarse como alta
+        session.add(User(id=1, first_name='Pepe', last_name='Ruiz', username='ana_l', age=24, password='12345678',
+                         is_active=False))
+    monkeypatch.setattr(username_filter, 'engines', [session.get_bind()])
+    monkeypatch.setattr(username_filter, 'sync_interval', 60)
+    try:
+        username_filter.rebuild()
+        # Otro proceso: el alta solo le llega por el log de cambios
+        monkeypatch.setattr(crud.change, '_commit_hooks', [])
+        import_rows('users', USERS_CSV.splitlines(keepends=True), 'csv', session, chunk_size=2)
+
+        with subtests.test('one create per imported user'):
+            changes = session.execute(select(Change.entity_id, Change.op, Change.data).order_by(Change.seq)).all()
+            imported = session.scalars(select(User.id).where(User.is_active).order_by(User.id)).all()
+            assert [(entity_id, op) for entity_id, op, _ in changes] == [(id, 'create') for id in imported]
+            assert [data['username'] for _, _, data in changes] == ['pepe_r', 'ana_l']
+
+        with subtests.test('username filter through the change log'):
+            assert 'pepe_r'.encode() not in username_filter._filter
+            username_filter.sync()
+            assert 'pepe_r'.encode() in username_filter._filter
+            assert 'ana_l'.encode() in username_filter._filter
+    finally:
+        username_filter.clear()
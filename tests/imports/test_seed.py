@@ -0,0 +1,92 @@
+import pytest
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import Session
+
+from crud.user import get_note_count_drift
+from models.base import Base
+from models.note import Note
+from models.user import User
+from schemas.note import NoteCreate
+from schemas.user import UserCreate
+from seed import seed, generate, mean_notes
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    engines = []
+
+    def make(name:str = 'seed'):
+        engine = create_engine(f'sqlite:///{tmp_path / f"{name}.db"}')
+        Base.metadata.create_all(engine)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.dispose()
+
+
+def dump(engine) -> tuple[list, list]:
+    with Session(engine) as session:
+        users = session.execute(select(User.__table__).order_by(User.id)).all()
+        notes = session.execute(select(Note.title, Note.description, Note.user_id).order_by(Note.id)).all()
+    return users, notes
+
+
+def test_deterministic(make_engine, subtests):
+    '''Test que valida que la misma semilla genera las mismas filas sea cual sea el tamaño de bloque'''
+    small, large, other = make_engine('small'), make_engine('large'), make_engine('other')
+    report = seed(small, 300, max_notes=20, chunk_size=50)
+    seed(large, 300, max_notes=20, chunk_size=100_000)
+    seed(other, 300, max_notes=20, seed=7)
+
+    with subtests.test('report'):
+        assert report.users == 300
+        assert report.notes == len(dump(small)[1]) > 0
+
+    with subtests.test('same seed, any chunk size'):
+        assert dump(small) == dump(large)
+
+    with subtests.test('different seed'):
+        assert dump(small) != dump(other)
+
+
+def test_rows_valid_and_skewed(make_engine, subtests):
+    '''Test que valida que las filas cumplen los schemas y que las notas por usuario siguen una distribución sesgada'''
+    engine = make_engine()
+    seed(engine, 2000, max_notes=30, chunk_size=1000)
+
+    with Session(engine) as session:
+        counts = session.scalars(select(User.note_count)).all()
+
+        with subtests.test('valid rows'):
+            for user in session.execute(select(User.__table__)).mappings():
+                UserCreate.model_validate(dict(user))
+            for note in session.execute(select(Note.title, Note.description, Note.user_id)).mappings():
+                NoteCreate.model_validate(dict(note))
+
+        with subtests.test('note_count maintained'):
+            assert get_note_count_drift(session) == []
+
+    with subtests.test('zipf'):
+        assert max(counts) <= 30
+        assert counts.count(0) > counts.count(1) > counts.count(10) # la mayoría con pocas notas
+        assert sum(counts) / len(counts) == pytest.approx(mean_notes(30, 1.1), rel=0.15)
+
+
+def test_seed_twice(make_engine):
+    '''Test que valida que una segunda carga continúa los ids sin repetir usernames'''
+    engine = make_engine()
+    seed(engine, 100, max_notes=5)
+    seed(engine, 100, max_notes=5)
+
+    with Session(engine) as session:
+        assert session.scalar(select(func.count(func.distinct(func.lower(User.username))))) == 200
+        assert session.scalar(select(func.max(User.id))) == 200
+
+
+def test_generate_streams():
+    '''Test que valida que el generador es perezoso (memoria acotada): no genera por adelantado'''
+    rows = generate(10**12)
+    user, notes = next(rows)
+    assert user['id'] == 1 and all(note['user_id'] == 1 for note in notes)
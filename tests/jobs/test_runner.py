@@ -0,0 +1,262 @@
+import json
+import os
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+from threading import Event
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy import select, func
+
+from main import app
+from db import get_db
+from models.user import User
+from models.job import Job
+from models.note import Note
+from crud.job import get_job, request_cancel
+from exceptions.job_exceptions import JobCancelled
+from job_runner import JobRunner, JobContext, HANDLERS, import_file, current_owner
+
+
+started = Event()
+
+
+def wait_cancel(ctx, params):
+    '''Handler de prueba que avanza hasta que lo cancelan'''
+    for i in range(10_000):
+        ctx.progress(i, force=True)
+        if i == 2:
+            started.set()
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def test_handlers(monkeypatch):
+    '''Registra los handlers de prueba solo durante el test (monkeypatch restaura HANDLERS al terminar)'''
+    monkeypatch.setitem(HANDLERS, 'test_wait_cancel', wait_cancel)
+
+
+@pytest.fixture
+def runner(session_factory, tmp_path):
+    runner = JobRunner(session_factory, workers=2, files_dir=str(tmp_path / 'files'))
+    yield runner
+    runner.stop()
+
+
+def wait_finished(session_factory, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with session_factory() as session:
+            job = get_job(session, job_id)
+            if job.status not in ('queued', 'running'):
+                session.expunge(job)
+                return job
+        time.sleep(0.02)
+    raise AssertionError(f'El trabajo {job_id} no ha terminado')
+
+
+def test_export_users(session_factory, runner, subtests):
+    '''Test que valida que la exportación de usuarios deja un NDJSON con todos los usuarios'''
+    with session_factory() as session, session.begin():
+        session.add_all([
+            User(first_name='Pepe', last_name='Ruiz', username=f'user_{i}', age=24, password='12345678')
+            for i in range(3)
+        ])
+
+    runner.start()
+    job = wait_finished(session_factory, runner.submit('export_users', {}))
+
+    with subtests.test('status'):
+        assert job.status == 'succeeded'
+        assert (job.processed, job.total, job.result) == (3, 3, {'rows': 3})
+
+    with subtests.test('result file'):
+        with open(job.result_path) as f:
+            usernames = [json.loads(line)['username'] for line in f]
+        assert usernames == ['user_0', 'user_1', 'user_2']
+
+
+def test_orphaned_job_requeued_on_start(session_factory, runner):
+    '''Test que valida que un trabajo que quedó en running se vuelve a ejecutar al arrancar'''
+    with session_factory() as session:
+        with session.begin():
+            job = Job(kind='export_users', status='running', params={})
+            session.add(job)
+        job_id = job.id
+
+    runner.start()
+    assert wait_finished(session_factory, job_id).status == 'succeeded'
+
+
+def test_only_dead_owners_requeued(session_factory, runner, subtests):
+    '''
+    Test que valida que al arrancar solo vuelven a la cola los trabajos de procesos muertos o sin heartbeat,
+    no los que ejecutan otros procesos vivos (p.ej. los demás workers de serve.py)
+    '''
+    host, boot_id, _ = current_owner().rsplit(':', 2)
+    finished = subprocess.Popen(['true'])
+    finished.wait()
+    now = datetime.now(timezone.utc)
+    owners = {
+        'live sibling': (f'{host}:{boot_id}:{os.getppid()}', now),
+        'dead process': (f'{host}:{boot_id}:{finished.pid}', now),
+        'host rebooted': (f'{host}:otro-arranque:{os.getppid()}', now),
+        'other host, recent heartbeat': ('otro-equipo:x:1', now),
+        'other host, stale heartbeat': ('otro-equipo:x:2', now - timedelta(hours=1)),
+    }
+    with session_factory() as session:
+        with session.begin():
+            jobs = {case: Job(kind='export_users', status='running', params={}, owner=owner, heartbeat_at=heartbeat)
+                    for case, (owner, heartbeat) in owners.items()}
+            session.add_all(jobs.values())
+        ids = {case: job.id for case, job in jobs.items()}
+
+    runner.start()
+    for case in ('dead process', 'host rebooted', 'other host, stale heartbeat'):
+        with subtests.test(case):
+            assert wait_finished(session_factory, ids[case]).status == 'succeeded'
+
+    for case in ('live sibling', 'other host, recent heartbeat'):
+        with subtests.test(case):
+            with session_factory() as session:
+                job = get_job(session, ids[case])
+                assert (job.status, job.owner) == ('running', owners[case][0])
+
+
+def test_lost_job_not_overwritten(session_factory, runner, test_handlers):
+    '''
+    Test que valida que si otro proceso da por huérfano un trabajo de este (sin heartbeat demasiado tiempo)
+    y lo reclama, este deja de ejecutarlo sin pisar su estado
+    '''
+    started.clear()
+    runner.start()
+    job_id = runner.submit('test_wait_cancel', {})
+    assert started.wait(5)
+
+    with session_factory() as session, session.begin():
+        session.get(Job, job_id).owner = 'otro-equipo:x:1'
+
+    deadline = time.monotonic() + 5
+    while runner._running and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert not runner._running
+    with session_factory() as session:
+        job = get_job(session, job_id)
+        assert (job.status, job.owner) == ('running', 'otro-equipo:x:1')
+
+
+def test_import_resumes_after_last_committed_chunk(session_factory, runner, tmp_path, subtests):
+    '''Test que valida que una importación que muere tras confirmar un bloque se retoma sin duplicar sus filas'''
+    with session_factory() as session:
+        with session.begin():
+            session.add(User(id=1, first_name='Pepe', last_name='Ruiz', username='pepe', age=24, password='12345678'))
+            job = Job(kind='import', status='running', params={}, owner=runner.owner) # reclamado por este proceso
+            session.add(job)
+        job_id = job.id
+
+    path = tmp_path / 'notes.ndjson'
+    params = {'kind': 'notes', 'path': str(path), 'format': 'ndjson', 'chunk_size': 2}
+    path.write_text(''.join(json.dumps({'title': f'Nota {i}', 'description': 'Nota de prueba', 'user_id': 1}) + '\n'
+                            for i in range(5)))
+
+    def shutdown(processed, total=None, force=False):
+        runner._stopping = True # el proceso se detiene después de confirmar el primer bloque
+        raise JobCancelled(job_id)
+
+    ctx = JobContext(runner, job_id, Event())
+    ctx.progress = shutdown
+    with pytest.raises(JobCancelled):
+        import_file(ctx, params)
+    runner._stopping = False
+
+    with subtests.test('upload kept for the next run'):
+        assert path.exists()
+
+    with subtests.test('checkpoint committed with the chunk'):
+        with session_factory() as session:
+            assert get_job(session, job_id).processed == 2
+            assert session.scalar(select(func.count()).select_from(Note)) == 2
+
+    with session_factory() as session:
+        processed = get_job(session, job_id).processed
+    report = import_file(JobContext(runner, job_id, Event(), resume_from=processed), params)
+
+    with subtests.test('resumed without duplicates'):
+        assert report['rows_imported'] == 3
+        with session_factory() as session:
+            titles = session.scalars(select(Note.title).order_by(Note.id)).all()
+        assert titles == [f'Nota {i}' for i in range(5)]
+
+    with subtests.test('upload removed when finished'):
+        assert not path.exists()
+
+
+def test_import_upload_removed(session_factory, runner, tmp_path, subtests):
+    '''Test que valida que el fichero subido se borra si la importación falla o se cancela'''
+    with session_factory() as session:
+        with session.begin():
+            job = Job(kind='import', status='running', params={}, owner=runner.owner)
+            session.add(job)
+        job_id = job.id
+
+    def cancelled(processed, total=None, force=False):
+        raise JobCancelled(job_id)
+
+    def failed(processed, total=None, force=False):
+        raise RuntimeError('La BD no responde')
+
+    for case, progress, error in (('cancelled', cancelled, JobCancelled), ('failed', failed, RuntimeError)):
+        with subtests.test(case):
+            path = tmp_path / f'{case}.ndjson'
+            path.write_text(json.dumps({'title': 'Nota', 'description': 'Nota de prueba', 'user_id': 1}) + '\n')
+            ctx = JobContext(runner, job_id, Event())
+            ctx.progress = progress
+            with pytest.raises(error):
+                import_file(ctx, {'kind': 'notes', 'path': str(path), 'format': 'ndjson', 'chunk_size': 2})
+            assert not path.exists()
+
+
+def test_cancel_running_job(session_factory, runner, test_handlers, subtests):
+    '''Test que valida la cancelación de un trabajo en ejecución'''
+    started.clear()
+    runner.start()
+    job_id = runner.submit('test_wait_cancel', {})
+    assert started.wait(5)
+
+    with session_factory() as session:
+        request_cancel(session, job_id)
+
+    job = wait_finished(session_factory, job_id)
+
+    with subtests.test('status'):
+        assert job.status == 'cancelled'
+
+    with subtests.test('progress saved'):
+        assert job.processed > 0
+
+
+def test_cancel_queued_job(session_factory, runner):
+    '''Test que valida que un trabajo en cola (runner parado) se cancela sin llegar a ejecutarse'''
+    job_id = runner.submit('export_users', {})
+    with session_factory() as session:
+        assert request_cancel(session, job_id).status == 'cancelled'
+
+    runner.start()
+    assert wait_finished(session_factory, job_id).status == 'cancelled'
+
+
+def test_get_job_not_found():
+    '''Test unitario que valida que GET /jobs/{id} responde 404 si el trabajo no existe'''
+    from unittest.mock import Mock
+    mock_session = Mock()
+    mock_session.get.return_value = None
+
+    app.dependency_overrides[get_db] = lambda: mock_session
+    try:
+        response = TestClient(app).get('/jobs/1')
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
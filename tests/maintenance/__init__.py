@@ -0,0 +1 @@
+# Necesario para que pytest reconozca las importaciones entre modulos
\ No newline at end of file
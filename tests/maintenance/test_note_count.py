@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import insert, delete, update, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from crud.user import get_note_count_drift, get_user_row_by_id
+from maintenance import note_counts
+from models.note import Note
+from models.user import User
+
+
+@pytest.fixture
+def engine(engine):
+    with Session(engine) as session, session.begin():
+        session.add_all([User(id=i, first_name='Pepe', last_name='Ruiz', username=f'user_{i}', age=24,
+                              password='12345678') for i in (1, 2, 3)])
+    return engine
+
+
+def note_count(engine, user_id:int) -> int:
+    with Session(engine) as session:
+        return session.scalar(select(User.note_count).where(User.id == user_id))
+
+
+def add_notes(engine, user_id:int, n:int):
+    with Session(engine) as session, session.begin():
+        session.execute(insert(Note), [{'title': 'Nota', 'description': 'Nota de prueba', 'user_id': user_id}] * n)
+
+
+def test_note_count_follows_writes(engine, subtests):
+    '''Test que valida que note_count se mantiene con el ORM, INSERT masivo, UPDATE y DELETE'''
+    with subtests.test('orm insert'):
+        with Session(engine) as session, session.begin():
+            user = session.get(User, 1)
+            user.notes.append(Note(title='Nota', description='Nota de prueba'))
+        assert note_count(engine, 1) == 1
+
+    with subtests.test('bulk insert'):
+        add_notes(engine, 2, 5)
+        assert note_count(engine, 2) == 5
+
+    with subtests.test('move note'):
+        with Session(engine) as session, session.begin():
+            session.execute(update(Note).where(Note.user_id == 1).values(user_id=3))
+        assert (note_count(engine, 1), note_count(engine, 3)) == (0, 1)
+
+    with subtests.test('delete notes'):
+        with Session(engine) as session, session.begin():
+            session.execute(delete(Note).where(Note.id.in_(select(Note.id).where(Note.user_id == 2).limit(2))))
+        assert note_count(engine, 2) == 3
+
+    with subtests.test('bulk delete(User) cascade'):
+        with Session(engine) as session, session.begin():
+            session.execute(delete(User).where(User.id == 2))
+        assert (note_count(engine, 1), note_count(engine, 3)) == (0, 1)
+        assert get_note_count_drift(Session(engine)) == []
+
+    with subtests.test('exposed in user rows'):
+        assert get_user_row_by_id(Session(engine), 3)['note_count'] == 1
+
+
+def test_check_and_repair(engine, subtests):
+    '''Test que valida que la comprobación detecta la desincronización y la reparación la corrige'''
+    add_notes(engine, 1, 2)
+    with Session(engine) as session, session.begin():
+        session.execute(update(User).where(User.id.in_([1, 3])).values(note_count=7))
+
+    with subtests.test('drift detected'):
+        drift = get_note_count_drift(Session(engine))
+        assert [(r['id'], r['note_count'], r['actual']) for r in drift] == [(1, 7, 2), (3, 7, 0)]
+
+    factory = sessionmaker(bind=engine)
+    with subtests.test('check only'):
+        assert note_counts(factory, [engine]) == 2
+
+    with subtests.test('repair'):
+        assert note_counts(factory, [engine], repair=True) == 0
+        assert (note_count(engine, 1), note_count(engine, 3)) == (2, 0)
+        assert note_counts(factory, [engine]) == 0
@@ -0,0 +1,225 @@
+import os
+import subprocess
+import sys
+import uuid
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, delete, func, insert, inspect, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.schema import CreateTable
+
+import db
+from benchmarks.notes_partitioning import COLUMNS, VARIANTS
+from models.base import Base
+from models.note import Note, install_note_count_triggers
+from models.user import User
+from partitions import (add_months, month_start, partition_name, is_partitioned, list_partitions, create_partitions,
+                        apply_retention)
+
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def test_months(subtests):
+    '''Test que valida el cálculo de meses y el nombre de las particiones'''
+    with subtests.test('month_start'):
+        assert month_start(date(2026, 10, 19)) == date(2026, 10, 1)
+
+    with subtests.test('add_months'):
+        assert add_months(date(2026, 10, 1), 3) == date(2027, 1, 1)
+        assert add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+        assert add_months(date(2026, 1, 1), -25) == date(2023, 12, 1)
+
+    with subtests.test('partition_name'):
+        assert partition_name(date(2026, 3, 1)) == 'notes_p2026_03'
+
+
+def test_sqlite_noop(engine):
+    '''Test que valida que fuera de Postgres (sin particionar) no se crea ni separa ninguna partición'''
+    with engine.begin() as connection:
+        assert not is_partitioned(connection)
+        assert create_partitions(connection, start=date(2020, 1, 1)) == []
+        assert apply_retention(connection, keep_months=1, drop=True) == []
+
+
+def test_benchmark_columns_match_model():
+    '''Test que valida que la tabla del benchmark de particionado tiene las mismas columnas que models.note'''
+    ddl = str(CreateTable(Note.__table__).compile(dialect=postgresql.dialect()))
+    model_columns = [line.strip().rstrip(',') for line in ddl.strip().splitlines()[1:-1]
+                     if not line.strip().startswith(('PRIMARY KEY', 'CONSTRAINT', 'FOREIGN KEY'))]
+    assert [line.strip().rstrip(',') for line in COLUMNS.strip().splitlines()] == model_columns
+
+
+def pg_engine(**kwargs):
+    '''Engine de la BD Postgres de las variables DB_*_J. Si no hay o no responde, se salta el test'''
+    if not db.DB_URL.startswith('postgresql') or not db.DB_HOST:
+        pytest.skip('Sin BD Postgres (DB_*_J)')
+    engine = create_engine(db.DB_URL, **kwargs)
+    try:
+        engine.connect().close()
+    except OperationalError as e:
+        engine.dispose()
+        pytest.skip(f'Postgres no disponible: {e.orig}')
+    return engine
+
+
+@pytest.fixture
+def pg_connection():
+    '''
+    Conexión a la BD Postgres de las variables DB_*_J, con un esquema propio dentro de una transacción que se
+    deshace al terminar (el DDL de Postgres es transaccional): no deja nada en la BD
+    '''
+    engine = pg_engine()
+    connection = engine.connect()
+
+    schema = f'test_partitions_{uuid.uuid4().hex[:8]}'
+    transaction = connection.begin()
+    try:
+        connection.exec_driver_sql(f'CREATE SCHEMA {schema}')
+        # Sin cualificar, users y notes son las del esquema del test (también para partitions.py)
+        connection.exec_driver_sql(f'SET LOCAL search_path TO {schema}')
+        Base.metadata.create_all(connection, tables=[User.__table__])
+        connection.exec_driver_sql(VARIANTS['partitioned'])
+        connection.exec_driver_sql('CREATE INDEX notes_user_id_created_at_idx ON notes (user_id, created_at)')
+        install_note_count_triggers(connection)
+        yield connection
+    finally:
+        transaction.rollback()
+        connection.close()
+        engine.dispose()
+
+
+@pytest.mark.postgres
+def test_partitions_postgres(pg_connection, subtests):
+    '''Test que valida en Postgres la creación de particiones, dónde va cada nota y la retención'''
+    connection = pg_connection
+    today = date(2026, 10, 19)
+    user_id = connection.execute(insert(User).values(first_name='Pepe', last_name='Ruiz', username='pepe', age=24,
+                                                     password='12345678').returning(User.id)).scalar_one()
+
+    def add_note(created_at:datetime):
+        connection.execute(insert(Note.__table__).values(title='Nota', description='Nota de prueba', user_id=user_id,
+                                                         created_at=created_at, updated_at=created_at))
+
+    def note_count() -> int:
+        return connection.execute(select(User.note_count).where(User.id == user_id)).scalar_one()
+
+    with subtests.test('create'):
+        assert is_partitioned(connection)
+        created = create_partitions(connection, start=date(2026, 6, 1), ahead=2, today=today)
+        assert created == [partition_name(date(2026, month, 1)) for month in range(6, 13)]
+        assert create_partitions(connection, start=date(2026, 6, 1), ahead=2, today=today) == []
+
+    with subtests.test('insert'):
+        add_note(datetime(2026, 6, 30, 23, 59, tzinfo=timezone.utc))
+        add_note(datetime(2026, 7, 1, tzinfo=timezone.utc)) # límite inferior: partición de julio
+        add_note(datetime(2026, 10, 19, 12, tzinfo=timezone.utc))
+        located = connection.exec_driver_sql('SELECT tableoid::regclass::text FROM notes ORDER BY created_at').scalars()
+        assert list(located) == ['notes_p2026_06', 'notes_p2026_07', 'notes_p2026_10']
+        assert note_count() == 3
+
+        # Mes sin partición (no hay partición por defecto): falla sin tocar el resto
+        with pytest.raises(DBAPIError), connection.begin_nested():
+            add_note(datetime(2027, 6, 1, tzinfo=timezone.utc))
+        assert note_count() == 3
+
+    with subtests.test('retention'):
+        removed = apply_retention(connection, keep_months=3, drop=True, today=today)
+        assert removed == ['notes_p2026_06']
+        assert list_partitions(connection)[0] == date(2026, 7, 1)
+        assert connection.exec_driver_sql("SELECT to_regclass('notes_p2026_06')").scalar() is None
+        assert note_count() == 2
+
+
+@pytest.fixture
+def pg_database():
+    '''BD Postgres nueva en el servidor de las variables DB_*_J, que se borra al terminar. Devuelve su URL'''
+    server = pg_engine(isolation_level='AUTOCOMMIT')
+    name = f'test_partitions_{uuid.uuid4().hex[:8]}'
+    with server.connect() as connection:
+        connection.exec_driver_sql(f'CREATE DATABASE {name}')
+    try:
+        yield server.url.set(database=name)
+    finally:
+        with server.connect() as connection:
+            connection.exec_driver_sql(f'DROP DATABASE {name} WITH (FORCE)')
+        server.dispose()
+
+
+# Se ejecuta en otro proceso: config.NOTES_PARTITIONED se lee al importar los modelos
+CREATE_PARTITIONED = '''
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import db
+from models.base import Base
+from models.note import Note
+from models.user import User
+
+Base.metadata.create_all(db.engine)
+with Session(db.engine) as session, session.begin():
+    user = User(first_name='Pepe', last_name='Ruiz', username='pepe', age=24, password='12345678')
+    user.notes.append(Note(title='Nota', description='Nota de prueba'))
+    session.add(user)
+with Session(db.engine) as session:
+    note = session.scalars(select(Note)).one()
+    assert session.get(Note, note.id) is note
+'''
+
+
+@pytest.mark.postgres
+def test_partitioned_model_postgres(pg_database, subtests):
+    '''
+    Test que valida en Postgres la tabla notes que crea el modelo con NOTES_PARTITIONED_J=1: clave primaria,
+    particiones iniciales, triggers de note_count en la tabla particionada, retención y borrado en cascada
+    '''
+    url = pg_database.render_as_string(hide_password=False)
+    env = {**os.environ, 'DB_URL_J': url, 'NOTES_PARTITIONED_J': '1', 'NOTES_PARTITIONS_AHEAD_J': '2'}
+    subprocess.run([sys.executable, '-c', CREATE_PARTITIONED], cwd=ROOT, env=env, check=True)
+
+    engine = create_engine(pg_database)
+    current = month_start(datetime.now(timezone.utc).date())
+    try:
+        with engine.begin() as connection:
+            user_id = connection.execute(select(User.id)).scalar_one()
+
+            def note_count() -> int:
+                return connection.execute(select(User.note_count).where(User.id == user_id)).scalar_one()
+
+            def add_notes(created_at:datetime, n:int = 1):
+                connection.execute(insert(Note.__table__), [
+                    {'title': 'Nota', 'description': 'Nota de prueba', 'user_id': user_id, 'created_at': created_at,
+                     'updated_at': created_at}] * n)
+
+            with subtests.test('table'):
+                assert is_partitioned(connection)
+                assert inspect(connection).get_pk_constraint('notes')['constrained_columns'] == ['id', 'created_at']
+                assert list_partitions(connection) == [add_months(current, i) for i in range(3)]
+
+            with subtests.test('note_count triggers on the partitioned table'):
+                assert note_count() == 1 # la nota del ORM
+                add_notes(datetime.now(timezone.utc), 3)
+                assert note_count() == 4
+                connection.execute(delete(Note.__table__).where(Note.id.in_(
+                    select(Note.id).where(Note.user_id == user_id).order_by(Note.id).limit(2))))
+                assert note_count() == 2
+
+            with subtests.test('retention'):
+                old = add_months(current, -3)
+                created = create_partitions(connection, start=old, ahead=2)
+                assert created == [partition_name(add_months(old, i)) for i in range(3)]
+                add_notes(datetime(old.year, old.month, 15, tzinfo=timezone.utc), 2)
+                assert note_count() == 4
+                removed = apply_retention(connection, keep_months=2, drop=True)
+                assert removed == [partition_name(old)]
+                assert list_partitions(connection)[0] == add_months(old, 1)
+                assert note_count() == 2
+
+            with subtests.test('cascade delete'):
+                connection.execute(delete(User).where(User.id == user_id))
+                assert connection.execute(select(func.count()).select_from(Note.__table__)).scalar_one() == 0
+    finally:
+        engine.dispose()
@@ -0,0 +1,85 @@
+from sqlalchemy import insert, select, func
+from sqlalchemy.orm import Session
+
+from crud.user import (create_user, update_user, delete_user, get_user_rows, get_user_row_by_id,
+                       get_user_by_username, count_users)
+from models.note import Note
+from models.user import User
+from purge import purge
+from schemas.user import UserCreate, UserPatch
+
+
+def make_user(username:str) -> UserCreate:
+    return UserCreate(first_name='Pepe', last_name='Ruiz', username=username, age=24, password='12345678')
+
+
+def add_user(session_factory, username:str, notes:int = 0) -> int:
+    with session_factory() as session:
+        user_id = create_user(make_user(username), session).id
+    if notes:
+        with session_factory() as session, session.begin():
+            session.execute(insert(Note), [{'title': 'Nota', 'description': 'Nota de prueba', 'user_id': user_id}] * notes)
+    return user_id
+
+
+def count(engine, model, *where) -> int:
+    with Session(engine) as session:
+        return session.scalar(select(func.count()).select_from(model).where(*where))
+
+
+def test_soft_delete_hides_user(engine, session_factory, subtests):
+    '''Test que valida que un usuario dado de baja sigue en BD pero ninguna lectura ni escritura lo ve'''
+    user_id = add_user(session_factory, 'pepe', notes=3)
+    add_user(session_factory, 'otro')
+
+    with session_factory() as session:
+        assert delete_user(session, user_id) is not None
+
+    with subtests.test('still stored, notes untouched'):
+        assert count(engine, User, User.id == user_id, ~User.is_active) == 1
+        assert count(engine, Note, Note.user_id == user_id) == 3
+
+    with subtests.test('reads'):
+        with session_factory() as session:
+            assert [row['username'] for row in get_user_rows(session)] == ['otro']
+            assert get_user_row_by_id(session, user_id) is None
+            assert get_user_by_username(session, 'PEPE') is None
+            assert count_users(session) == 1
+
+    with subtests.test('writes'):
+        with session_factory() as session:
+            assert update_user(user_id, UserPatch(age=30), session) is None
+        with session_factory() as session:
+            assert delete_user(session, user_id) is None
+
+    with subtests.test('username free again'):
+        with session_factory() as session:
+            assert create_user(make_user('Pepe'), session).id != user_id
+
+
+def test_purge_in_batches(engine, session_factory, subtests):
+    '''Test que valida que la purga borra notas y usuarios dados de baja por lotes, sin tocar los activos'''
+    deleted = [add_user(session_factory, f'baja_{i}', notes=4) for i in range(3)]
+    active = add_user(session_factory, 'activo', notes=2)
+    for user_id in deleted:
+        with session_factory() as session:
+            delete_user(session, user_id)
+
+    with subtests.test('time bounded'):
+        report = purge([engine], batch_size=5, max_seconds=0)
+        assert (report.batches, report.finished) == (0, False)
+
+    report = purge([engine], batch_size=5, pause=0)
+
+    with subtests.test('report'):
+        assert (report.notes_deleted, report.users_deleted, report.finished) == (12, 3, True)
+        # 12 notas en lotes de 5 (5, 5, 2) + un lote de usuarios
+        assert report.batches == 4
+
+    with subtests.test('only inactive users'):
+        assert count(engine, User) == 1
+        assert count(engine, Note) == count(engine, Note, Note.user_id == active) == 2
+
+    with subtests.test('nothing left'):
+        report = purge([engine])
+        assert (report.notes_deleted, report.users_deleted, report.finished) == (0, 0, True)
@@ -0,0 +1,94 @@
+import gzip
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from middleware.compression import CompressionMiddleware, negotiate
+
+
+BIG_BODY = 'journal ' * 1000
+
+app = FastAPI()
+
+
+@app.get('/big', response_class=PlainTextResponse)
+def big():
+    return BIG_BODY
+
+
+@app.get('/small', response_class=PlainTextResponse)
+def small():
+    return 'hola'
+
+
+@app.get('/stream')
+def stream():
+    return StreamingResponse((BIG_BODY for _ in range(5)), media_type='text/plain')
+
+
+client = TestClient(CompressionMiddleware(app, minimum_size=500))
+
+
+@pytest.mark.parametrize(['accept_encoding', 'expected'], [
+    ('gzip', 'gzip'),
+    ('gzip, br, zstd', 'zstd'),
+    ('br;q=1, zstd;q=0.5', 'br'),
+    ('zstd;q=0, gzip', 'gzip'),
+    ('*', 'zstd'),
+    ('identity', None),
+    ('', None)
+], ids=['gzip', 'server preference', 'client q', 'q=0', 'wildcard', 'identity', 'empty'])
+def test_negotiate(accept_encoding, expected):
+    '''Test unitario de la negociación de Accept-Encoding'''
+    encodings = {'zstd': None, 'br': None, 'gzip': None}
+    assert negotiate(accept_encoding, encodings) == expected
+
+
+def test_compress_gzip(subtests):
+    '''Test que valida que un cuerpo grande se comprime con gzip'''
+    response = client.get('/big', headers={'Accept-Encoding': 'gzip'})
+
+    with subtests.test('headers'):
+        assert response.headers['content-encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['vary']
+
+    with subtests.test('body'):
+        assert response.text == BIG_BODY
+
+
+def test_small_body_not_compressed():
+    '''Test que valida que los cuerpos por debajo del umbral no se comprimen'''
+    response = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'content-encoding' not in response.headers
+
+
+def test_streaming_compressed(subtests):
+    '''Test que valida que un StreamingResponse se comprime de forma incremental'''
+    with client.stream('GET', '/stream', headers={'Accept-Encoding': 'gzip'}) as response:
+        raw = b''.join(response.iter_raw())
+
+    with subtests.test('headers'):
+        assert response.headers['content-encoding'] == 'gzip'
+        assert 'content-length' not in response.headers
+
+    with subtests.test('body'):
+        assert gzip.decompress(raw).decode() == BIG_BODY * 5
+
+
+@pytest.mark.parametrize('encoding', ['br', 'zstd'])
+def test_optional_encodings(encoding):
+    '''Test que valida brotli y zstd cuando su librería está instalada'''
+    pytest.importorskip('brotli' if encoding == 'br' else 'zstandard')
+
+    with client.stream('GET', '/big', headers={'Accept-Encoding': encoding}) as response:
+        raw = b''.join(response.iter_raw())
+
+    assert response.headers['content-encoding'] == encoding
+    if encoding == 'br':
+        import brotli
+        assert brotli.decompress(raw).decode() == BIG_BODY
+    else:
+        import zstandard
+        assert zstandard.ZstdDecompressor().decompressobj().decompress(raw).decode() == BIG_BODY
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, status
+from fastapi.testclient import TestClient
+
+from middleware.concurrency import Limiter, ConcurrencyLimitMiddleware, REJECTED
+
+
+def test_limiter_queue_full(subtests):
+    '''Test que valida que el limiter rechaza al llenarse la cola y cede el hueco al liberar'''
+
+    async def scenario():
+        limiter = Limiter('test', limit=1, queue_size=1, timeout=1)
+
+        first = await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        rejected = await limiter.acquire()
+
+        queued_before_release = limiter.queued
+        limiter.release()
+        second = await waiting
+        return limiter, first, second, rejected, queued_before_release
+
+    limiter, first, second, rejected, queued = asyncio.run(scenario())
+
+    with subtests.test('first acquire ok'):
+        assert first is None
+
+    with subtests.test('queue full rejected'):
+        assert rejected == 'queue_full'
+        assert queued == 1
+
+    with subtests.test('slot handed over to waiter'):
+        assert second is None
+        assert limiter.in_flight == 1
+        assert limiter.queued == 0
+
+
+def test_limiter_timeout(subtests):
+    '''Test que valida que una petición en cola se rechaza al superar el timeout'''
+
+    async def scenario():
+        limiter = Limiter('test', limit=1, queue_size=5, timeout=0.01)
+        await limiter.acquire()
+        return limiter, await limiter.acquire()
+
+    limiter, result = asyncio.run(scenario())
+
+    with subtests.test('timeout'):
+        assert result == 'timeout'
+
+    with subtests.test('queue cleaned'):
+        assert limiter.queued == 0
+        assert limiter.in_flight == 1
+
+
+def test_limiter_cancelled_after_handover(subtests):
+    '''Test que valida que una espera cancelada justo después de recibir el hueco lo devuelve'''
+
+    async def scenario():
+        limiter = Limiter('test', limit=1, queue_size=5, timeout=1)
+        await limiter.acquire()
+        cancelled = asyncio.create_task(limiter.acquire())
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+
+        limiter.release() # cede el hueco a `cancelled`, que se cancela antes de volver a ejecutarse
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        second = await waiting
+        limiter.release()
+        return limiter, second
+
+    limiter, second = asyncio.run(scenario())
+
+    with subtests.test('slot passed to the next waiter'):
+        assert second is None
+
+    with subtests.test('no slot leaked'):
+        assert limiter.in_flight == 0
+        assert limiter.queued == 0
+
+
+@pytest.mark.parametrize(['method', 'route_class'], [('get', 'read'), ('post', 'write')])
+def test_middleware_rejects_with_503(method, route_class, subtests):
+    '''Test que valida que el middleware responde 503 con Retry-After cuando no hay hueco'''
+
+    app = FastAPI()
+
+    @app.api_route('/', methods=['GET', 'POST'])
+    def root():
+        return {}
+
+    middleware = ConcurrencyLimitMiddleware(app)
+    middleware.limiters[route_class] = Limiter(route_class, limit=0, queue_size=0, timeout=1)
+    rejected_before = REJECTED.value(route_class=route_class, reason='queue_full')
+
+    response = getattr(TestClient(middleware), method)('/')
+
+    with subtests.test('status code'):
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+    with subtests.test('retry-after header'):
+        assert 'retry-after' in response.headers
+
+    with subtests.test('rejection metric'):
+        assert REJECTED.value(route_class=route_class, reason='queue_full') == rejected_before + 1
@@ -0,0 +1,109 @@
+import time
+from unittest.mock import Mock
+
+import pytest
+from fastapi import Depends, FastAPI, status
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import config
+import db
+from db import get_db
+from exceptions.deadline_exceptions import DeadlineExceeded
+from main import deadline_exceeded_handler
+from middleware.concurrency import ConcurrencyLimitMiddleware, Limiter
+from middleware.deadline import DeadlineMiddleware, remaining
+
+
+@pytest.fixture
+def app(session_factory, monkeypatch):
+    '''App mínima con el middleware y get_db real sobre SQLite'''
+    monkeypatch.setattr(db, 'SessionLocal', session_factory)
+
+    app = FastAPI()
+    app.add_exception_handler(DeadlineExceeded, deadline_exceeded_handler)
+
+    @app.get('/budget')
+    def budget():
+        return {'remaining': remaining()}
+
+    @app.get('/imports/budget')
+    def imports_budget():
+        return {'remaining': remaining()}
+
+    @app.get('/slow')
+    def slow(session:Session = Depends(get_db)):
+        time.sleep(0.05)
+        return {'value': session.execute(select(1)).scalar()}
+
+    @app.get('/canceled')
+    def canceled(session:Session = Depends(get_db)):
+        raise OperationalError('SELECT ...', None, Mock(pgcode=db.QUERY_CANCELED))
+
+    return app
+
+
+def test_budget_from_header_and_route(app, subtests):
+    '''Test que valida el presupuesto por cabecera, el tope máximo y el valor por defecto por ruta'''
+    client = TestClient(DeadlineMiddleware(app, route_timeouts={'/imports': 120}))
+
+    with subtests.test('default'):
+        response = client.get('/budget')
+        assert 0 < response.json()['remaining'] <= config.REQUEST_TIMEOUT
+        assert response.headers['x-request-timeout'] == f'{config.REQUEST_TIMEOUT:g}'
+
+    with subtests.test('header'):
+        response = client.get('/budget', headers={'X-Request-Timeout': '2.5'})
+        assert 2 < response.json()['remaining'] <= 2.5
+
+    with subtests.test('header capped'):
+        response = client.get('/budget', headers={'X-Request-Timeout': str(config.REQUEST_TIMEOUT_MAX * 10)})
+        assert response.json()['remaining'] <= config.REQUEST_TIMEOUT_MAX
+
+    with subtests.test('route default'):
+        assert 60 < client.get('/imports/budget').json()['remaining'] <= 120
+
+    with subtests.test('invalid header'):
+        for value in ('abc', '0', '-1', 'nan'):
+            assert client.get('/budget', headers={'X-Request-Timeout': value}).status_code == 400
+
+
+def test_no_deadline_outside_requests(app):
+    '''Test que valida que sin el middleware no hay límite (jobs, scripts...)'''
+    assert TestClient(app).get('/budget').json() == {'remaining': None}
+
+
+def test_exhausted_budget_returns_504(app, subtests):
+    '''Test que valida que una transacción que empieza con el presupuesto agotado no llega a consultar'''
+    client = TestClient(DeadlineMiddleware(app))
+
+    with subtests.test('enough budget'):
+        assert client.get('/slow', headers={'X-Request-Timeout': '5'}).json() == {'value': 1}
+
+    with subtests.test('exhausted'):
+        response = client.get('/slow', headers={'X-Request-Timeout': '0.01'})
+        assert response.status_code == status.HTTP_504_GATEWAY_TIMEOUT
+
+
+def test_statement_timeout_returns_504(app):
+    '''Test que valida que la cancelación por statement_timeout de Postgres se responde con 504'''
+    response = TestClient(DeadlineMiddleware(app), raise_server_exceptions=False).get('/canceled')
+    assert response.status_code == status.HTTP_504_GATEWAY_TIMEOUT
+
+
+def test_admission_wait_bounded_by_deadline(app, subtests):
+    '''Test que valida que la espera en la cola de admisión no supera el deadline de la petición'''
+    limiter = ConcurrencyLimitMiddleware(app)
+    limiter.limiters['read'] = Limiter('read', limit=0, queue_size=5, timeout=5)
+    client = TestClient(DeadlineMiddleware(limiter))
+
+    start = time.monotonic()
+    response = client.get('/budget', headers={'X-Request-Timeout': '0.05'})
+
+    with subtests.test('status code'):
+        assert response.status_code == status.HTTP_504_GATEWAY_TIMEOUT
+
+    with subtests.test('did not wait the queue timeout'):
+        assert time.monotonic() - start < 1
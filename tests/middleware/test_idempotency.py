@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+import config
+from middleware.idempotency import IdempotencyMiddleware
+from models.idempotency import IdempotencyRecord
+
+
+calls = []
+
+app = FastAPI()
+
+
+@app.post('/items', status_code=status.HTTP_201_CREATED)
+async def create_item(item:dict):
+    calls.append(item)
+    await asyncio.sleep(0.05)
+    return {'n': len(calls), **item}
+
+
+@app.post('/upload')
+async def upload(request:Request):
+    body = await request.body()
+    calls.append(len(body))
+    return {'size': len(body), 'sha256': hashlib.sha256(body).hexdigest()}
+
+
+@app.post('/boom')
+def boom():
+    calls.append('boom')
+    return JSONResponse({'detail': 'error'}, status_code=500)
+
+
+@pytest.fixture(autouse=True)
+def clear_calls():
+    calls.clear()
+
+
+@pytest.fixture
+def middleware(session_factory):
+    return IdempotencyMiddleware(app, session_factory)
+
+
+def post(client, path, payload, key):
+    return client.post(path, json=payload, headers={'Idempotency-Key': key})
+
+
+def test_replay_returns_original_response(middleware, subtests):
+    '''Test que valida que un reintento con la misma clave devuelve la respuesta original sin ejecutar el endpoint'''
+    client = TestClient(middleware)
+    first = post(client, '/items', {'a': 1}, 'k1')
+    second = post(client, '/items', {'a': 1}, 'k1')
+
+    with subtests.test('same response'):
+        assert second.status_code == first.status_code == status.HTTP_201_CREATED
+        assert second.json() == first.json()
+
+    with subtests.test('endpoint called once'):
+        assert len(calls) == 1
+
+    with subtests.test('replay header'):
+        assert second.headers['idempotent-replayed'] == 'true'
+        assert 'idempotent-replayed' not in first.headers
+
+
+def test_replay_from_db(session_factory, subtests):
+    '''Test que valida que la respuesta se recupera de BD cuando no está en la LRU (otro proceso / reinicio)'''
+    post(TestClient(IdempotencyMiddleware(app, session_factory)), '/items', {'a': 1}, 'k1')
+    replay = post(TestClient(IdempotencyMiddleware(app, session_factory)), '/items', {'a': 1}, 'k1')
+
+    with subtests.test('replayed'):
+        assert replay.headers['idempotent-replayed'] == 'true'
+        assert len(calls) == 1
+
+    with subtests.test('stored in db'):
+        with session_factory() as session:
+            assert session.get(IdempotencyRecord, ('testclient', 'k1')).status_code == status.HTTP_201_CREATED
+
+
+def test_expired_key_not_replayed(middleware, monkeypatch, subtests):
+    '''Test que valida que pasado IDEMPOTENCY_TTL la respuesta no se repite, tampoco desde la LRU en memoria'''
+    monkeypatch.setattr(config, 'IDEMPOTENCY_TTL', 0.2)
+    client = TestClient(middleware)
+    post(client, '/items', {'a': 1}, 'k1')
+
+    with subtests.test('replayed before expiry'):
+        assert post(client, '/items', {'a': 1}, 'k1').headers.get('idempotent-replayed') == 'true'
+
+    time.sleep(0.3)
+    with subtests.test('executed again after expiry'):
+        response = post(client, '/items', {'a': 1}, 'k1')
+        assert 'idempotent-replayed' not in response.headers
+        assert len(calls) == 2
+
+
+def test_oversized_headers_rejected(middleware, subtests):
+    '''Test que valida que Idempotency-Key y X-Client-Id más largos que sus columnas se rechazan con 400'''
+    client = TestClient(middleware)
+
+    with subtests.test('key'):
+        assert post(client, '/items', {'a': 1}, 'k' * 256).status_code == status.HTTP_400_BAD_REQUEST
+
+    with subtests.test('client id'):
+        response = client.post('/items', json={'a': 1}, headers={'Idempotency-Key': 'k1', 'X-Client-Id': 'c' * 101})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    with subtests.test('endpoint not called'):
+        assert calls == []
+
+
+def test_large_body_streamed_through(middleware, session_factory, subtests):
+    '''Test que valida que un cuerpo grande (fuera de memoria) llega entero al endpoint y se resume igual'''
+    body = bytes(range(256)) * 12_000 # ~3 MB, por encima de IDEMPOTENCY_MAX_BODY
+    response = TestClient(middleware).post('/upload', content=body, headers={'Idempotency-Key': 'k1'})
+
+    with subtests.test('body intact'):
+        assert response.json() == {'size': len(body), 'sha256': hashlib.sha256(body).hexdigest()}
+
+    with subtests.test('fingerprint'):
+        with session_factory() as session:
+            record = session.get(IdempotencyRecord, ('testclient', 'k1'))
+        assert record.fingerprint == hashlib.sha256(b'POST\0/upload\0\0' + body).hexdigest()
+
+
+def test_key_reused_with_other_payload(middleware):
+    '''Test que valida que reutilizar la clave con otro cuerpo devuelve 422'''
+    client = TestClient(middleware)
+    post(client, '/items', {'a': 1}, 'k1')
+    response = post(client, '/items', {'a': 2}, 'k1')
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
+def test_server_error_not_stored(middleware):
+    '''Test que valida que las respuestas 5xx no se guardan y el reintento se ejecuta de nuevo'''
+    client = TestClient(middleware)
+    post(client, '/boom', {}, 'k1')
+    post(client, '/boom', {}, 'k1')
+
+    assert calls == ['boom', 'boom']
+
+
+def test_concurrent_duplicates_wait_for_first(middleware, subtests):
+    '''Test que valida que los duplicados concurrentes esperan a la original en vez de ejecutarse'''
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=middleware)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await asyncio.gather(*(post(client, '/items', {'a': 1}, 'k1') for _ in range(3)))
+
+    responses = asyncio.run(scenario())
+
+    with subtests.test('endpoint called once'):
+        assert len(calls) == 1
+
+    with subtests.test('same body'):
+        assert all(r.json() == responses[0].json() for r in responses)
+        assert sum(r.headers.get('idempotent-replayed') == 'true' for r in responses) == 2
@@ -0,0 +1,140 @@
+import time
+
+from fastapi import FastAPI, status
+from fastapi.testclient import TestClient
+
+import config
+from middleware.profiling import ProfilingMiddleware, ProfileStore, profile_token, verify_token, to_collapsed
+from routers import profiles
+
+
+SECRET = 'secreto'
+
+
+def busy(seconds:float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def make_app(tmp_path, **kwargs) -> tuple[TestClient, ProfileStore]:
+    app = FastAPI()
+
+    @app.get('/items/{item_id}')
+    def item(item_id:int):
+        busy(0.05)
+        return {'id': item_id}
+
+    store = ProfileStore(str(tmp_path), max_files=kwargs.pop('max_files', 10))
+    middleware = ProfilingMiddleware(app, store=store, interval=0.001, **kwargs)
+    return TestClient(middleware), store
+
+
+def test_token(subtests):
+    '''Test que valida la firma de la cabecera X-Profile'''
+    with subtests.test('valid'):
+        assert verify_token(SECRET, profile_token(SECRET))
+
+    with subtests.test('wrong secret'):
+        assert not verify_token('otro', profile_token(SECRET))
+
+    with subtests.test('expired'):
+        assert not verify_token(SECRET, profile_token(SECRET, ttl=-10))
+
+    with subtests.test('garbage / disabled'):
+        assert not verify_token(SECRET, 'abc')
+        assert not verify_token('', profile_token(''))
+
+
+def test_signed_header_profiles_request(tmp_path, subtests):
+    '''Test que valida que una petición con X-Profile firmada se perfila y se etiqueta con la plantilla de ruta'''
+    client, store = make_app(tmp_path, sample_rate=0, secret=SECRET)
+
+    plain = client.get('/items/1')
+    profiled = client.get('/items/2', headers={'X-Profile': profile_token(SECRET)})
+
+    with subtests.test('only signed request profiled'):
+        assert 'x-profile-id' not in plain.headers
+        assert [p['id'] for p in store.recent()] == [profiled.headers['x-profile-id']]
+
+    metadata = store.recent()[0]
+    with subtests.test('metadata'):
+        assert (metadata['method'], metadata['route'], metadata['path']) == ('GET', '/items/{item_id}', '/items/2')
+        assert metadata['status_code'] == 200
+        assert metadata['samples'] > 0
+
+    profile = store.load(metadata['id'])
+    with subtests.test('speedscope'):
+        assert profile['profiles'][0]['name'] == 'GET /items/{item_id}'
+        assert any(frame['name'] == 'busy' for frame in profile['shared']['frames'])
+
+    with subtests.test('collapsed'):
+        assert 'busy (test_profiling.py' in to_collapsed(profile)
+
+
+def test_sample_rate_and_ring(tmp_path, subtests):
+    '''Test que valida el muestreo 1 de cada N y que solo se conservan los perfiles más recientes'''
+    client, store = make_app(tmp_path, sample_rate=2, secret='', max_files=2)
+
+    responses = [client.get(f'/items/{i}') for i in range(8)]
+    profiled = [r.headers['x-profile-id'] for r in responses if 'x-profile-id' in r.headers]
+
+    with subtests.test('1 in 2 profiled'):
+        assert len(profiled) == 4
+
+    with subtests.test('bounded ring keeps the newest'):
+        assert [p['id'] for p in store.recent()] == profiled[:1:-1]
+
+
+def test_admin_endpoints(tmp_path, monkeypatch, subtests):
+    '''Test que valida el listado y la descarga de perfiles'''
+    client, store = make_app(tmp_path, sample_rate=1, secret='')
+    profile_id = client.get('/items/1').headers['x-profile-id']
+
+    monkeypatch.setattr(profiles, 'store', store)
+    monkeypatch.setattr(config, 'PROFILE_SECRET', SECRET)
+    admin = FastAPI()
+    admin.include_router(profiles.router)
+    admin_client = TestClient(admin, headers={'X-Profile': profile_token(SECRET)})
+
+    with subtests.test('list'):
+        assert [p['id'] for p in admin_client.get('/admin/profiles/').json()] == [profile_id]
+
+    with subtests.test('speedscope'):
+        response = admin_client.get(f'/admin/profiles/{profile_id}')
+        assert response.json()['metadata']['id'] == profile_id
+
+    with subtests.test('collapsed'):
+        response = admin_client.get(f'/admin/profiles/{profile_id}', params={'format': 'collapsed'})
+        assert response.headers['content-type'].startswith('text/plain')
+        assert response.text.strip()
+
+    with subtests.test('not found / invalid id'):
+        assert admin_client.get('/admin/profiles/1-abc').status_code == status.HTTP_404_NOT_FOUND
+        assert admin_client.get('/admin/profiles/..%2Fetc').status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_admin_endpoints_require_token(tmp_path, monkeypatch, subtests):
+    '''Test que valida que los perfiles solo se sirven con una cabecera X-Profile firmada y vigente'''
+    client, store = make_app(tmp_path, sample_rate=1, secret='')
+    profile_id = client.get('/items/1').headers['x-profile-id']
+
+    monkeypatch.setattr(profiles, 'store', store)
+    monkeypatch.setattr(config, 'PROFILE_SECRET', SECRET)
+    admin = FastAPI()
+    admin.include_router(profiles.router)
+    admin_client = TestClient(admin)
+
+    for path in ('/admin/profiles/', f'/admin/profiles/{profile_id}'):
+        with subtests.test('missing', path=path):
+            assert admin_client.get(path).status_code == status.HTTP_401_UNAUTHORIZED
+
+        with subtests.test('wrong secret / expired', path=path):
+            for token in (profile_token('otro'), profile_token(SECRET, ttl=-10)):
+                response = admin_client.get(path, headers={'X-Profile': token})
+                assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    with subtests.test('no secret configured'):
+        monkeypatch.setattr(config, 'PROFILE_SECRET', '')
+        response = admin_client.get('/admin/profiles/', headers={'X-Profile': profile_token('')})
+        assert response.status_code == status.HTTP_403_FORBIDDEN
@@ -0,0 +1,79 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+from sqlalchemy import create_engine
+
+from models.base import Base
+
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url:str, timeout:float = 20):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise TimeoutError(url)
+
+
+@pytest.fixture
+def server(tmp_path):
+    url = f'sqlite:///{tmp_path / "serve.db"}'
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    port = free_port()
+    env = {**os.environ, 'DB_URL_J': url, 'DB_CONNECTION_BUDGET_J': '10', 'PURGE_INTERVAL_J': '0',
+           'SERVE_MAX_REQUESTS_J': '5', 'SERVE_MAX_REQUESTS_JITTER_J': '2'}
+    log = open(tmp_path / 'serve.log', 'w+')
+    process = subprocess.Popen([sys.executable, '-m', 'serve', '--workers', '2', '--host', '127.0.0.1',
+                                '--port', str(port)], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_ready(f'http://127.0.0.1:{port}/users/')
+        yield process, f'http://127.0.0.1:{port}', tmp_path / 'serve.log'
+    finally:
+        if process.poll() is None:
+            process.kill()
+        log.close()
+
+
+def test_budget_split():
+    '''Test que valida que el presupuesto global de conexiones se reparte entre los procesos'''
+    env = {**os.environ, 'SERVE_WORKERS_J': '4', 'DB_CONNECTION_BUDGET_J': '40', 'DB_MAX_OVERFLOW_J': '5'}
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'import config; print(config.DB_POOL_SIZE, config.DB_MAX_OVERFLOW)'],
+        cwd=ROOT, env=env, text=True)
+    assert output.split() == ['10', '0']
+
+
+def test_recycle_and_drain(server, subtests):
+    '''Test que valida que los workers se reciclan sin cortar el servicio y que SIGTERM los para ordenadamente'''
+    process, url, log = server
+
+    with subtests.test('recycle'):
+        statuses = [httpx.get(f'{url}/users/').status_code for _ in range(30)]
+        assert statuses == [200] * 30
+        assert 'reciclado' in log.read_text()
+
+    with subtests.test('sigterm'):
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=30) == 0
+        assert 'Parado' in log.read_text()
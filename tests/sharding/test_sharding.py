@@ -0,0 +1,262 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, select, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import config
+import crud.change
+import db
+
+from main import app
+from db import get_db, init_shards, sharded_sessionmaker, shard_for_user
+from crud.change import relay_pending_changes
+from crud.user import (create_user, update_user, delete_user, get_user_rows, get_user_row_by_id,
+                       get_user_by_id, get_user_by_username)
+from exceptions.user_exceptions import UserAlreadyExists
+from models.change import Change
+from models.note import Note
+from models.user import User
+from purge import purge
+from schemas.user import UserCreate, UserPatch
+
+
+NUM_SHARDS = 3
+
+
+@pytest.fixture
+def engines(tmp_path):
+    engines = [create_engine(f'sqlite:///{tmp_path / f"shard{i}.db"}') for i in range(NUM_SHARDS)]
+    init_shards(engines)
+    yield engines
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engines):
+    return sharded_sessionmaker(engines)
+
+
+@pytest.fixture
+def users(session_factory) -> list[int]:
+    '''Crea 20 usuarios (una sesión por operación, como en la API) y devuelve sus ids'''
+    ids = []
+    for i in range(20):
+        with session_factory() as session:
+            ids.append(create_user(make_user(f'user_{i}'), session).id)
+    return ids
+
+
+def make_user(username:str) -> UserCreate:
+    return UserCreate(first_name='Pepe', last_name='Ruiz', username=username, age=24, password='12345678')
+
+
+def count(engine, model, *where) -> int:
+    with Session(engine) as session:
+        return session.scalar(select(func.count()).select_from(model).where(*where))
+
+
+def test_users_placed_by_id(engines, users, subtests):
+    '''Test que valida que cada usuario está solo en el shard id % nº de shards y que se usan todos'''
+    with subtests.test('id matches shard'):
+        for user_id in users:
+            expected = int(shard_for_user(user_id, NUM_SHARDS))
+            assert [count(e, User, User.id == user_id) for e in engines] == \
+                [int(i == expected) for i in range(NUM_SHARDS)]
+
+    with subtests.test('all shards used'):
+        assert all(count(engine, User) for engine in engines)
+
+    with subtests.test('unique ids'):
+        assert len(set(users)) == len(users)
+
+
+def test_notes_colocated_with_user(engines, session_factory, users, subtests):
+    '''Test que valida que las notas se guardan en el shard de su usuario y se purgan con él'''
+    with session_factory() as session, session.begin():
+        for user_id in users[:6]:
+            user = session.get(User, user_id)
+            user.notes.append(Note(title='Nota', description='Nota de prueba'))
+
+    with subtests.test('co-located'):
+        for user_id in users[:6]:
+            shard = int(shard_for_user(user_id, NUM_SHARDS))
+            assert count(engines[shard], Note, Note.user_id == user_id) == 1
+
+    with subtests.test('lazy load from the user shard'):
+        with session_factory() as session:
+            assert [n.title for n in session.get(User, users[0]).notes] == ['Nota']
+
+    with subtests.test('purged after delete'):
+        with session_factory() as session:
+            delete_user(session, users[0])
+        assert sum(count(engine, Note, Note.user_id == users[0]) for engine in engines) == 1
+        assert purge(engines).finished
+        assert sum(count(engine, Note, Note.user_id == users[0]) for engine in engines) == 0
+        assert sum(count(engine, User, User.id == users[0]) for engine in engines) == 0
+
+
+def test_paginated_fan_out(session_factory, users, subtests):
+    '''Test que valida que GET /users/ por páginas devuelve el mismo orden global que sin paginar'''
+    with session_factory() as session:
+        everything = [row['id'] for row in get_user_rows(session)]
+
+        pages, after = [], None
+        while page := get_user_rows(session, after=after, limit=7):
+            pages.append([row['id'] for row in page])
+            after = page[-1]['id']
+
+    with subtests.test('globally ordered'):
+        assert everything == sorted(users)
+
+    with subtests.test('pages'):
+        assert [len(p) for p in pages] == [7, 7, 6]
+        assert [user_id for page in pages for user_id in page] == everything
+
+
+def test_fan_out_bounded_per_shard(engines, session_factory, users, monkeypatch):
+    '''Test que valida que con muchos fan-out a la vez no hay más de DB_REQUEST_CONNECTIONS consultas por shard'''
+    monkeypatch.setattr(config, 'DB_REQUEST_CONNECTIONS', 2)
+    monkeypatch.setattr(db, '_fan_out_executors', {})
+    lock = Lock()
+    running, peak = {}, {}
+
+    def track(engine):
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before(*args):
+            with lock:
+                running[engine] = running.get(engine, 0) + 1
+                peak[engine] = max(peak.get(engine, 0), running[engine])
+            time.sleep(0.02)
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after(*args):
+            with lock:
+                running[engine] -= 1
+
+    for engine in engines:
+        track(engine)
+
+    def read_page(_):
+        with session_factory() as session:
+            return [row['id'] for row in get_user_rows(session, limit=5)]
+
+    with ThreadPoolExecutor(8) as requests:
+        pages = list(requests.map(read_page, range(8)))
+
+    assert pages == [sorted(users)[:5]] * 8
+    assert peak and all(value <= 2 for value in peak.values())
+
+
+def test_reads_and_writes_by_id(session_factory, users, subtests):
+    '''Test que valida lecturas y escrituras por id y la comprobación global de username'''
+    user_id = users[3]
+
+    with subtests.test('row by id'):
+        with session_factory() as session:
+            assert get_user_row_by_id(session, user_id)['username'] == 'user_3'
+            assert get_user_row_by_id(session, 10_000) is None
+
+    with subtests.test('update'):
+        with session_factory() as session:
+            update_user(user_id, UserPatch(age=50), session)
+        with session_factory() as session:
+            assert get_user_by_id(session, user_id).age == 50
+
+    with subtests.test('by username across shards'):
+        with session_factory() as session:
+            assert get_user_by_username(session, 'USER_7').id == users[7]
+
+    with subtests.test('rename to a username held in another shard'):
+        other = next(u for u in users if shard_for_user(u, NUM_SHARDS) != shard_for_user(user_id, NUM_SHARDS))
+        with session_factory() as session, pytest.raises(UserAlreadyExists):
+            update_user(user_id, UserPatch(username=f'USER_{users.index(other)}'), session)
+
+    with subtests.test('create with a renamed username'):
+        with session_factory() as session:
+            update_user(user_id, UserPatch(username='renombrado'), session)
+        with session_factory() as session, pytest.raises(UserAlreadyExists):
+            create_user(make_user('Renombrado'), session)
+
+
+def test_change_log_on_primary_shard(engines, users, subtests):
+    '''Test que valida que el log de cambios está en el shard principal aunque el usuario esté en otro'''
+    with subtests.test('relayed after commit'):
+        assert count(engines[0], Change) == len(users)
+        assert all(count(engine, Change) == 0 for engine in engines[1:])
+
+    with subtests.test('in order, once'):
+        with Session(engines[0]) as session:
+            changes = session.scalars(select(Change).order_by(Change.seq)).all()
+        assert [change.entity_id for change in changes] == users
+        assert len({change.source for change in changes if change.source}) == \
+            sum(shard_for_user(user_id, NUM_SHARDS) != '0' for user_id in users)
+
+
+def test_change_kept_when_primary_fails(engines, session_factory, users, monkeypatch, subtests):
+    '''
+    Test que valida que si el log principal falla tras confirmar la escritura el cambio no se pierde: queda en la
+    cola del shard del usuario y se traslada después una sola vez, aunque el borrado de la cola no se confirme
+    '''
+    user_id = next(user_id for user_id in users if shard_for_user(user_id, NUM_SHARDS) != '0')
+    shard = engines[int(shard_for_user(user_id, NUM_SHARDS))]
+
+    def failing(*args, **kwargs):
+        raise OperationalError('INSERT', {}, Exception('primary down'))
+
+    with subtests.test('write committed, change queued on its shard'):
+        monkeypatch.setattr(crud.change, 'relay_changes', failing)
+        with session_factory() as session:
+            update_user(user_id, UserPatch(first_name='Luis'), session)
+        monkeypatch.undo()
+        assert count(shard, User, User.first_name == 'Luis') == 1
+        assert count(shard, Change) == 1
+        assert count(engines[0], Change) == len(users)
+
+    with subtests.test('relayed once'):
+        published = []
+        monkeypatch.setattr(crud.change, '_commit_hooks', [published.extend])
+        # El borrado de la cola falla: el cambio ya está en el log principal y no se repite
+        with monkeypatch.context() as patch:
+            patch.setattr(crud.change, 'delete', failing)
+            with pytest.raises(OperationalError):
+                relay_pending_changes(engines)
+        assert relay_pending_changes(engines) == 0
+        assert count(shard, Change) == 0
+        assert count(engines[0], Change, Change.entity_id == user_id, Change.op == 'update') == 1
+        assert [(change['entity_id'], change['op']) for change in published] == [(user_id, 'update')]
+
+
+def test_get_all_endpoint(session_factory, users, subtests):
+    '''Test que valida GET /users/ con sharding, completo y paginado'''
+    def override_get_db():
+        with session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        client = TestClient(app)
+        everything = client.get('/users/')
+        page = client.get('/users/', params={'after': sorted(users)[4], 'limit': 5, 'count': 'estimated'})
+        by_id = client.get(f'/users/{users[5]}')
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    with subtests.test('all'):
+        assert everything.status_code == status.HTTP_200_OK
+        assert [u['id'] for u in everything.json()] == sorted(users)
+
+    with subtests.test('page'):
+        assert [u['id'] for u in page.json()] == sorted(users)[5:10]
+
+    with subtests.test('total over all shards'):
+        assert page.headers['X-Total-Count'] == str(len(users))
+
+    with subtests.test('by id'):
+        assert by_id.json()['username'] == 'user_5'
@@ -0,0 +1,120 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert
+from sqlalchemy.orm import sessionmaker
+
+from main import app
+from crud.user import create_user, update_user, delete_user
+from models.change import Change
+from schemas.user import UserCreate, UserPatch
+from username_filter import BloomFilter, CHECKS, username_filter
+
+
+client = TestClient(app)
+
+
+def new_user(username:str) -> UserCreate:
+    return UserCreate(first_name='Pepe', last_name='Ruiz', username=username, age=24, password='12345678')
+
+
+@pytest.fixture
+def engine(engine, api_db, monkeypatch):
+    for username in ('pepe', 'Ana_Lopez', 'luis'):
+        with api_db() as session:
+            create_user(new_user(username), session)
+
+    monkeypatch.setattr(username_filter, 'engines', [engine])
+    monkeypatch.setattr(username_filter, 'sync_interval', 60)
+    yield engine
+    username_filter.clear()
+
+
+def check(username:str) -> bool:
+    response = client.get('/users/availability', params={'username': username})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['username'] == username
+    return response.json()['available']
+
+
+def test_bloom_filter():
+    '''Test que valida que el filtro no da falsos negativos y da falsos positivos en torno a la tasa pedida'''
+    bloom = BloomFilter(10_000, 0.01)
+    for i in range(10_000):
+        bloom.add(f'user_{i}'.encode())
+
+    assert all(f'user_{i}'.encode() in bloom for i in range(10_000))
+    false_positives = sum(f'other_{i}'.encode() in bloom for i in range(20_000))
+    assert false_positives / 20_000 < 0.02
+    assert bloom.memory_bytes == 11_982 # ~9,6 bits por elemento para un 1 %
+    assert bloom.num_hashes == 7
+    assert 0.009 < bloom.estimated_fp_rate < 0.011
+
+
+def test_availability(engine, subtests):
+    '''Test que valida las respuestas del endpoint y que un username libre no consulta la BD'''
+    checkouts = []
+    event.listen(engine, 'checkout', lambda *args: checkouts.append(1))
+
+    with subtests.test('without filter'):
+        assert not check('pepe')
+        assert check('nadie')
+        assert len(checkouts) == 2
+
+    assert username_filter.rebuild()
+    checkouts.clear()
+    negatives = CHECKS.value(result='negative')
+
+    with subtests.test('taken, case insensitive'):
+        assert not check('PEPE')
+        assert not check('ana_lopez')
+        assert len(checkouts) == 2
+
+    with subtests.test('free answered by the filter'):
+        assert check('nadie') and check('pepe2')
+        assert CHECKS.value(result='negative') == negatives + 2
+        assert len(checkouts) == 2
+
+    with subtests.test('validation'):
+        response = client.get('/users/availability', params={'username': 'ab'})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
+def test_filter_follows_writes(engine, subtests):
+    '''Test que valida que el filtro recoge las altas y renombrados de este proceso y los de otros (log de cambios)'''
+    factory = sessionmaker(bind=engine, expire_on_commit=False)
+    username_filter.rebuild()
+
+    with subtests.test('create and update in this process'):
+        with factory() as session:
+            user = create_user(new_user('nuevo'), session)
+            update_user(user.id, UserPatch(username='Renombrado'), session)
+        assert check('nuevo') # renombrado: sigue en el filtro, pero el índice dice que está libre
+        assert not check('renombrado')
+
+    with subtests.test('other processes through the change log'):
+        # Otro proceso: la fila y su cambio se confirman sin pasar por los hooks de este
+        with factory() as session, session.begin():
+            session.execute(insert(Change).values(entity='user', entity_id=99, op='create', data={'username': 'remoto'},
+                                                  changed_at=datetime.now(timezone.utc)))
+        username_filter.sync()
+        assert 'remoto'.encode() in username_filter._filter
+
+    with subtests.test('deleted usernames are gone after a rebuild'):
+        with factory() as session:
+            delete_user(session, user.id)
+        assert check('renombrado')
+        username_filter.rebuild()
+        assert 'renombrado'.encode() not in username_filter._filter
+        assert 'pepe'.encode() in username_filter._filter
+
+
+def test_stale_filter_not_used(engine):
+    '''Test que valida que si el log de cambios no se lee a tiempo el filtro deja de usarse y responde el índice'''
+    username_filter.rebuild()
+    username_filter._synced_at -= 60 * 11
+    unfiltered = CHECKS.value(result='unfiltered')
+    assert check('nadie')
+    assert CHECKS.value(result='unfiltered') == unfiltered + 1
@@ -0,0 +1,65 @@
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from main import app
+from crud.user import create_user, get_user_row_by_id, get_user_by_username
+from db import ROUTE, HOLDS, HOLD_SECONDS
+from schemas.user import UserCreate
+
+
+def test_read_releases_connection(engine, subtests):
+    '''Test que valida que una lectura de crud devuelve la conexión al pool al terminar, sin cerrar la sesión'''
+    factory = sessionmaker(bind=engine, expire_on_commit=False)
+    with factory() as session:
+        user = create_user(UserCreate(first_name='Pepe', last_name='Ruiz', username='pepe', age=24,
+                                      password='12345678'), session)
+
+        with subtests.test('after write'):
+            assert engine.pool.checkedout() == 0
+            assert user.username == 'pepe' # sin caducar: no vuelve a pedir conexión
+            assert engine.pool.checkedout() == 0
+
+        with subtests.test('after read'):
+            assert get_user_row_by_id(session, user.id)['username'] == 'pepe'
+            assert get_user_by_username(session, 'PEPE').id == user.id
+            assert not session.in_transaction()
+            assert engine.pool.checkedout() == 0
+
+        with subtests.test('inside a transaction'):
+            with session.begin():
+                get_user_row_by_id(session, user.id)
+                assert session.in_transaction() # la lectura no confirma la transacción en curso
+                assert engine.pool.checkedout() == 1
+            assert engine.pool.checkedout() == 0
+
+
+def test_hold_metrics(engine):
+    '''Test que valida que se mide cuánto tiempo ocupa una conexión cada ruta'''
+    route = 'GET /test/hold'
+    factory = sessionmaker(bind=engine, expire_on_commit=False)
+    with factory(info={ROUTE: route}) as session:
+        get_user_row_by_id(session, 1)
+        get_user_row_by_id(session, 2)
+
+    assert HOLDS.value(route=route) == 2
+    assert HOLD_SECONDS.value(route=route) > 0
+
+
+def test_notes_single_checkout(engine, api_db, subtests):
+    '''Test que valida que GET /users/{id}/notes comprueba el usuario y lee sus notas con una sola conexión'''
+    with api_db() as session:
+        user_id = create_user(UserCreate(first_name='Pepe', last_name='Ruiz', username='pepe', age=24,
+                                         password='12345678'), session).id
+    checkouts = []
+    event.listen(engine, 'checkout', lambda *args: checkouts.append(1))
+    client = TestClient(app)
+
+    with subtests.test('existing user'):
+        assert client.get(f'/users/{user_id}/notes').status_code == status.HTTP_200_OK
+        assert len(checkouts) == 1
+
+    with subtests.test('missing user'):
+        assert client.get('/users/999/notes').status_code == status.HTTP_404_NOT_FOUND
+        assert len(checkouts) == 2
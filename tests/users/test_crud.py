@@ -1,7 +1,7 @@
 import pytest
 from crud.user import get_users, get_user_by_id, create_user, delete_user, update_user
 from unittest.mock import Mock, MagicMock
-from schemas.user import UserCreate, UserUpdate, UserPatch
+from schemas.user import UserCreate, UserUpdate, UserPatch, UserRead
 from models.user import User
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
@@ -35,7 +35,7 @@ def mock_e_orig():
     de restricción de unicidad en la columna `username`
     '''
     mock_e_orig = Mock()
-    mock_e_orig.diag.constraint_name = 'users_username_key'
+    mock_e_orig.diag.constraint_name = 'users_username_lower_key'
     return mock_e_orig
 
 
@@ -227,7 +227,7 @@ def test_update_user_username_already_exists(magic_mock_session, mock_e_orig, us
 
 def test_delete_user_ok(magic_mock_session, user, subtests):
     '''
-    Test unitario que prueba el borrado de
+    Test unitario que prueba el borrado (baja con is_active = false) de
     un usuario registrado en el sistema
     '''
     
@@ -237,11 +237,12 @@ def test_delete_user_ok(magic_mock_session, user, subtests):
     result = delete_user(magic_mock_session, user_id)
     
     with subtests.test('get called once with'):
-        magic_mock_session.get.assert_called_once_with(User, user_id)
+        magic_mock_session.get.assert_called_once_with(User, user_id, with_for_update=True)
 
-    with subtests.test('begin and delete called once'):
+    with subtests.test('begin called once, soft delete'):
         magic_mock_session.begin.assert_called_once()
-        magic_mock_session.delete.assert_called_once_with(user)
+        magic_mock_session.delete.assert_not_called()
+        assert user.is_active is False
 
     with subtests.test('data returned'):
         assert result is user 
@@ -259,7 +260,7 @@ def test_delete_user_none(magic_mock_session, subtests):
     result = delete_user(magic_mock_session, user_id)
 
     with subtests.test('get called once with'):
-        magic_mock_session.get.assert_called_once_with(User, user_id)
+        magic_mock_session.get.assert_called_once_with(User, user_id, with_for_update=True)
 
     with subtests.test('begin called'):
         magic_mock_session.begin.assert_called_once()
@@ -269,4 +270,61 @@ def test_delete_user_none(magic_mock_session, subtests):
 
     with subtests.test('data returned'):
         assert result is None
-    
\ No newline at end of file
+    
+
+
+def test_username_unique_case_insensitive(engine, subtests):
+    '''
+    Test con SQLite real que valida que el índice único sobre lower(username) hace que
+    create_user y update_user lancen UserAlreadyExists con variantes en mayúsculas y que
+    get_user_by_username encuentre al usuario con cualquier variante
+    '''
+    from crud.user import get_user_by_username
+
+    new_user = lambda username: UserCreate(first_name='Pepe', last_name='Ruiz', username=username, age=24,
+                                           password='12345678')
+    with Session(engine) as session:
+        create_user(new_user('Pepe_R'), session)
+    with Session(engine) as session:
+        other_id = create_user(new_user('otro'), session).id
+
+    with subtests.test('create with case variant'):
+        with Session(engine) as session, pytest.raises(UserAlreadyExists):
+            create_user(new_user('pepe_r'), session)
+
+    with subtests.test('update with case variant'):
+        with Session(engine) as session, pytest.raises(UserAlreadyExists):
+            update_user(other_id, UserPatch(username='PEPE_R'), session)
+
+    with subtests.test('lookup'):
+        with Session(engine) as session:
+            assert get_user_by_username(session, 'pEPe_r').username == 'Pepe_R'
+            assert get_user_by_username(session, 'nadie') is None
+
+
+def test_read_rows_match_orm(engine, subtests):
+    '''Test con SQLite real que valida que la lectura por Core devuelve lo mismo que el ORM al serializar'''
+    from pydantic import TypeAdapter
+    from crud.user import get_user_rows, get_user_row_by_id
+
+    adapter = TypeAdapter(list[UserRead])
+    for i in range(3):
+        with Session(engine) as session:
+            create_user(UserCreate(first_name='Pepe', last_name='Ruiz', username=f'user_{i}', age=20 + i,
+                                   email=f'user{i}@correo.com' if i else None, password='12345678'), session)
+
+    with Session(engine) as session:
+        orm = adapter.dump_python(adapter.validate_python(get_users(session)))
+        rows = adapter.dump_python(adapter.validate_python(get_user_rows(session)))
+        row = get_user_row_by_id(session, orm[1]['id'])
+        missing = get_user_row_by_id(session, 999)
+
+    with subtests.test('list'):
+        assert rows == orm
+
+    with subtests.test('by id'):
+        assert UserRead.model_validate(row).model_dump() == orm[1]
+        assert missing is None
+
+    with subtests.test('no password'):
+        assert 'password' not in row
@@ -97,10 +97,12 @@ def magic_mock_session_with_add(magic_mock_session):
 def user_list(mock_db_session, request):
     '''
     Fixture que prepara a la sesión mockeada para que tenga un valor al llamar a su método
-    "scalars.all". Se devuelve el resultado para poder utilizarlo en el test correspondiente
-    y poder hacer comparaciones
+    "execute.mappings.all" (lectura por Core, filas en lugar de instancias ORM). Se devuelve el
+    resultado para poder utilizarlo en el test correspondiente y poder hacer comparaciones
     '''
-    mock_db_session.scalars.return_value.all.return_value = request.param
+    mock_db_session.execute.return_value.mappings.return_value.all.return_value = [
+        UserRead.model_validate(u).model_dump() for u in request.param
+    ]
     return request.param
 
 
@@ -111,10 +113,11 @@ def user_list(mock_db_session, request):
 def user(mock_db_session, request):
     '''
     Fixture que prepara a la sesión mockeada para que tenga un valor al llamar a su metodo
-    "get". Se devuelve el resultado para poder utilizarlo en el test correspondiente
-    y poder hacer comparaciones
+    "execute.mappings.first" (lectura por Core). Se devuelve el resultado para poder utilizarlo
+    en el test correspondiente y poder hacer comparaciones
     '''
-    mock_db_session.get.return_value = request.param
+    mock_db_session.execute.return_value.mappings.return_value.first.return_value = \
+        UserRead.model_validate(request.param).model_dump()
     return request.param
 
 
@@ -199,12 +202,36 @@ def test_get_by_id_not_found(mock_db_session):
     Test unitario básico para validar que el endpoint get_by_id responde 404 NOT FOUND
     cuando no existe el usuario con el id especificado
     '''
-    mock_db_session.get.return_value = None
+    mock_db_session.execute.return_value.mappings.return_value.first.return_value = None
     response = call_endpoint(client=client, method='get_by_id', base_url=BASE_URL, resource_id=110)
     assert response.status_code == status.HTTP_404_NOT_FOUND
 
 
 
+## TESTS GET_BY_USERNAME ##
+
+def test_get_by_username_ok(mock_db_session, subtests):
+    '''Test que valida que get_by_username responde 200 OK con el usuario encontrado'''
+    user = User(id=1, first_name='Pepe', last_name='Rodriguez', username='pep_ul', age=24)
+    mock_db_session.scalars.return_value.first.return_value = user
+
+    response = client.get(f'{BASE_URL.rstrip("/")}/by-username/PEP_UL')
+
+    with subtests.test('status code'):
+        assert response.status_code == status.HTTP_200_OK
+
+    with subtests.test('data validation'):
+        assert response.json() == UserRead.model_validate(user).model_dump()
+
+
+def test_get_by_username_not_found(mock_db_session):
+    '''Test que valida que get_by_username responde 404 NOT FOUND si no hay usuario con ese username'''
+    mock_db_session.scalars.return_value.first.return_value = None
+    response = client.get(f'{BASE_URL.rstrip("/")}/by-username/nadie')
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+
 ## TESTS CREATE ##
 
 def test_create_ok(create_response, user_create, subtests):
@@ -218,11 +245,14 @@ def test_create_ok(create_response, user_create, subtests):
 
 
     data = create_response.json()
-    user_out = UserRead.model_validate(data).model_dump(exclude={'id'})
+    user_out = UserRead.model_validate(data).model_dump(exclude={'id', 'note_count'})
 
     with subtests.test('data validation'):
         assert user_create.model_dump(exclude={'password'}) == user_out
 
+    with subtests.test('no notes yet'):
+        assert data['note_count'] == 0
+
 
 
 @patch('routers.user.create_user')
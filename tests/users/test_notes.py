@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, update, select
+
+from main import app
+from crud.user import get_user_notes
+from models.note import Note
+from models.user import User
+
+
+client = TestClient(app)
+
+NOW = datetime.now(timezone.utc).replace(microsecond=0)
+
+
+@pytest.fixture
+def session_factory(api_db):
+    with api_db() as session, session.begin():
+        session.add_all([User(id=i, first_name='Pepe', last_name='Ruiz', username=f'user_{i}', age=24,
+                              password='12345678') for i in (1, 2)])
+        # Notas del usuario 1 de hace 0, 10, 20... 90 días; una del usuario 2
+        session.execute(insert(Note), [
+            {'title': f'Nota {days}', 'description': 'Nota de prueba', 'user_id': 1,
+             'created_at': NOW - timedelta(days=days)} for days in range(0, 100, 10)
+        ] + [{'title': 'Otra', 'description': 'Nota de prueba', 'user_id': 2, 'created_at': NOW}])
+    return api_db
+
+
+def test_timestamps(session_factory, subtests):
+    '''Test que valida que created_at y updated_at se rellenan al crear y updated_at cambia al actualizar'''
+    with session_factory() as session, session.begin():
+        note = Note(title='Nueva', description='Nota de prueba', user_id=2)
+        session.add(note)
+    with session_factory() as session:
+        created_at, updated_at = session.execute(select(Note.created_at, Note.updated_at)
+                                                 .where(Note.title == 'Nueva')).one()
+
+    with subtests.test('insert'):
+        assert created_at is not None and updated_at >= created_at
+
+    with subtests.test('update'):
+        with session_factory() as session, session.begin():
+            session.execute(update(Note).where(Note.title == 'Nueva').values(description='Nota cambiada'))
+        with session_factory() as session:
+            assert session.execute(select(Note.created_at, Note.updated_at)
+                                   .where(Note.title == 'Nueva')).one() != (created_at, updated_at)
+            assert session.scalar(select(Note.created_at).where(Note.title == 'Nueva')) == created_at
+
+
+def test_get_user_notes(session_factory, subtests):
+    '''Test que valida que solo se devuelven las notas del usuario en [since, until), las más recientes primero'''
+    with session_factory() as session:
+        with subtests.test('bounds'):
+            notes = get_user_notes(session, 1, NOW - timedelta(days=30), NOW - timedelta(days=10), 100)
+            assert [note['title'] for note in notes] == ['Nota 20', 'Nota 30']
+
+        with subtests.test('limit'):
+            notes = get_user_notes(session, 1, NOW - timedelta(days=365), NOW + timedelta(days=1), 2)
+            assert [note['title'] for note in notes] == ['Nota 0', 'Nota 10']
+
+        with subtests.test('other user'):
+            notes = get_user_notes(session, 2, NOW - timedelta(days=1), NOW + timedelta(days=1), 100)
+            assert [note['title'] for note in notes] == ['Otra']
+
+        with subtests.test('missing user'):
+            assert get_user_notes(session, 99, NOW - timedelta(days=1), NOW + timedelta(days=1), 100) is None
+
+
+def test_notes_endpoint(session_factory, subtests):
+    '''Test que valida GET /users/{id}/notes: rango por defecto, rango explícito, 404 y rangos inválidos'''
+    with subtests.test('default window'):
+        response = client.get('/users/1/notes')
+        assert response.status_code == status.HTTP_200_OK
+        assert [note['title'] for note in response.json()] == ['Nota 0', 'Nota 10', 'Nota 20']
+        assert set(response.json()[0]) == {'id', 'title', 'description', 'user_id', 'created_at', 'updated_at'}
+
+    with subtests.test('explicit range'):
+        since = (NOW - timedelta(days=85)).isoformat()
+        until = (NOW - timedelta(days=65)).isoformat()
+        response = client.get('/users/1/notes', params={'since': since, 'until': until})
+        assert [note['title'] for note in response.json()] == ['Nota 70', 'Nota 80']
+
+    with subtests.test('not found'):
+        assert client.get('/users/99/notes').status_code == status.HTTP_404_NOT_FOUND
+
+    with subtests.test('invalid range'):
+        since, until = NOW.isoformat(), (NOW - timedelta(days=1)).isoformat()
+        response = client.get('/users/1/notes', params={'since': since, 'until': until})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+        response = client.get('/users/1/notes', params={'since': (NOW - timedelta(days=1000)).isoformat()})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
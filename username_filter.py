@@ -0,0 +1,274 @@
+'''
+Filtro de Bloom de los usernames en uso para GET /users/availability, que el formulario de alta consulta en
+cada pulsación. Cada proceso tiene el suyo:
+
+- Se construye al arrancar, en un hilo (el arranque no espera), recorriendo los usernames activos de cada BD
+  (shard) por lotes de config.USERNAME_FILTER_SCAN_BATCH filas. Se dimensiona con el número de usuarios para
+  config.USERNAME_FILTER_FP_RATE de falsos positivos. Mientras no está listo se consulta siempre el índice.
+- Un "no está" del filtro es definitivo y se responde sin tocar la BD. Un "puede estar" se confirma con el
+  índice único de lower(username) (crud.user.username_exists): un falso positivo solo cuesta esa consulta.
+- Altas y renombrados: los de este proceso se añaden al confirmarse (on_changes_committed) y los de los
+  demás se leen del log de cambios cada config.USERNAME_FILTER_SYNC_INTERVAL segundos. Si la lectura se
+  retrasa (BD caída...) el filtro no se usa hasta que se pone al día: un "no está" podría no estar al día.
+- Un filtro de Bloom no admite borrados: los usernames de bajas y renombrados siguen dentro (más falsos
+  positivos). Cada config.USERNAME_FILTER_REBUILD_INTERVAL segundos, o si se llena por encima de su
+  capacidad, se construye otro y se sustituye. Los usuarios importados (importer.py) también pasan por el
+  log de cambios: entran como las altas.
+
+Las claves se normalizan con casefold(), que junta al menos lo mismo que el lower() de la BD: dos usernames
+iguales para el índice único nunca dan claves distintas (como mucho hay más falsos positivos).
+
+Memoria y tasa de falsos positivos en /metrics: journal_username_filter_bytes, _items y
+_estimated_fp_rate (la teórica con los usernames que tiene), y journal_username_checks_total por resultado.
+La tasa real es false_positive / (negative + false_positive).
+'''
+import hashlib
+import logging
+import math
+import time
+from threading import Event, Lock, Thread
+
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+
+import config
+from crud.change import get_changes, get_last_change_seq, on_changes_committed
+from crud.user import count_users, estimate_users, get_usernames, username_exists
+from db import engine, shard_engines
+from metrics import Counter, Gauge
+
+
+CHECKS = Counter('journal_username_checks_total', 'Consultas de disponibilidad de username',
+                 ('result',)) # negative (solo filtro), hit, false_positive, unfiltered (sin filtro listo)
+FILTER_BYTES = Gauge('journal_username_filter_bytes', 'Memoria del filtro de Bloom de usernames')
+FILTER_ITEMS = Gauge('journal_username_filter_items', 'Usernames añadidos al filtro de Bloom')
+FILTER_FP_RATE = Gauge('journal_username_filter_estimated_fp_rate',
+                       'Tasa de falsos positivos teórica del filtro con los usernames que tiene')
+
+# Margen de capacidad sobre los usuarios actuales (altas hasta la siguiente reconstrucción) y capacidad mínima
+_HEADROOM = 1.25
+_MIN_CAPACITY = 10_000
+# Lecturas del log de cambios seguidas sin conseguirse tras las que el filtro deja de usarse
+_MAX_MISSED_SYNCS = 10
+# Cambios leídos por consulta al log
+_SYNC_BATCH = 1000
+# Segundos entre reintentos de la construcción si falla y no hay lectura del log que marque el ritmo
+_RETRY_INTERVAL = 5
+
+logger = logging.getLogger(__name__)
+
+
+def _key(username:str) -> bytes:
+    return username.casefold().encode()
+
+
+class BloomFilter:
+    '''
+    Conjunto probabilístico de tamaño fijo: `in` nunca da falsos negativos y da falsos positivos con
+    probabilidad ~fp_rate mientras no se superen `capacity` elementos.
+    m = -n·ln(p) / ln(2)² bits y k = m/n·ln(2) posiciones por elemento, sacadas de un único blake2b de
+    128 bits partido en dos hashes (h1 + i·h2, Kirsch-Mitzenmacher)
+    '''
+
+    def __init__(self, capacity:int, fp_rate:float):
+        self.capacity = max(capacity, 1)
+        self.num_bits = max(math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2 / 8), 1) * 8
+        self.num_hashes = max(round(self.num_bits / self.capacity * math.log(2)), 1)
+        self.items = 0
+        self._bits = bytearray(self.num_bits // 8)
+
+    def _positions(self, key:bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key:bytes):
+        '''No es seguro con varios hilos a la vez (dos altas pueden tocar el mismo byte): UsernameFilter bloquea'''
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.items += 1
+
+    def __contains__(self, key:bytes) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._bits)
+
+    @property
+    def estimated_fp_rate(self) -> float:
+        '''(1 - e^(-k·n/m))^k con los n elementos añadidos'''
+        return (1 - math.exp(-self.num_hashes * self.items / self.num_bits)) ** self.num_hashes
+
+
+class UsernameFilter:
+    '''Filtro de Bloom de un proceso más su mantenimiento (construcción, log de cambios) en un hilo'''
+
+    def __init__(self, engines:list[Engine], fp_rate:float, sync_interval:float, rebuild_interval:float,
+                 scan_batch:int | None = None):
+        self.engines = engines # el primero es el principal, donde está el log de cambios
+        self.fp_rate = fp_rate
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.scan_batch = scan_batch or config.USERNAME_FILTER_SCAN_BATCH
+        self._filter:BloomFilter | None = None
+        self._building:BloomFilter | None = None
+        self._seq:int | None = None # último cambio del log ya añadido
+        self._synced_at = 0.0
+        self._lock = Lock() # las altas llegan desde los hilos del threadpool
+        self._stop = Event()
+        self._thread:Thread | None = None
+
+    def _usable(self) -> BloomFilter | None:
+        current = self._filter
+        if current is None or self.sync_interval <= 0:
+            return current
+        if time.monotonic() - self._synced_at > self.sync_interval * _MAX_MISSED_SYNCS:
+            return None
+        return current
+
+    def is_taken(self, session:Session, username:str) -> bool:
+        '''True si algún usuario activo tiene el username. Solo consulta la BD si el filtro no lo descarta'''
+        current = self._usable()
+        if current is not None and _key(username) not in current:
+            CHECKS.inc(result='negative')
+            return False
+
+        taken = username_exists(session, username)
+        CHECKS.inc(result='unfiltered' if current is None else 'hit' if taken else 'false_positive')
+        return taken
+
+    def add(self, username:str):
+        key = _key(username)
+        with self._lock:
+            for target in (self._filter, self._building):
+                if target is not None:
+                    target.add(key)
+
+    def rebuild(self, stop:Event | None = None) -> bool:
+        '''
+        Construye un filtro nuevo y sustituye al actual. Lo que se confirme durante el recorrido entra por add()
+        (este proceso) o por sync(), que sigue desde el cursor del log leído antes de empezar.
+        Devuelve False si se pide parar a medias
+        '''
+        if self._seq is None and self.sync_interval > 0:
+            with Session(self.engines[0]) as session:
+                self._seq = get_last_change_seq(session)
+        total = 0
+        for bind in self.engines:
+            with Session(bind) as session:
+                # Dimensionar no necesita el total exacto: en Postgres sale de las estadísticas, sin COUNT
+                estimate = estimate_users(session)
+                total += estimate if estimate is not None else count_users(session)
+
+        new = BloomFilter(max(int(total * _HEADROOM), _MIN_CAPACITY), self.fp_rate)
+        with self._lock:
+            self._building = new
+        built = False
+        try:
+            for bind in self.engines:
+                after = None
+                while True:
+                    if stop is not None and stop.is_set():
+                        return False
+                    with Session(bind) as session:
+                        rows = get_usernames(session, after, self.scan_batch)
+                    with self._lock:
+                        for row in rows:
+                            new.add(_key(row['username']))
+                    if len(rows) < self.scan_batch:
+                        break
+                    after = rows[-1]['id']
+                    if self._sync_due():
+                        self.sync()
+            if self.sync_interval > 0:
+                self.sync()
+            built = True
+        finally:
+            # En el mismo bloqueo: un add() entre quitar el nuevo de _building y ponerlo en _filter se perdería
+            with self._lock:
+                self._building = None
+                if built:
+                    self._filter = new
+        if self.sync_interval <= 0:
+            self._synced_at = time.monotonic()
+        self._report()
+        logger.info('Filtro de usernames: %s usernames, %s KiB, %s hashes', new.items, new.memory_bytes // 1024,
+                    new.num_hashes)
+        return True
+
+    def _sync_due(self) -> bool:
+        return self.sync_interval > 0 and time.monotonic() - self._synced_at >= self.sync_interval
+
+    def sync(self):
+        '''Añade los usernames de las altas y cambios del log posteriores al cursor (los de otros procesos)'''
+        with Session(self.engines[0]) as session:
+            if self._seq is None:
+                self._seq = get_last_change_seq(session)
+            while True:
+                changes = get_changes(session, self._seq, _SYNC_BATCH)
+                for change in changes:
+                    if change.entity == 'user' and change.op in ('create', 'update') and change.data:
+                        self.add(change.data['username'])
+                if changes:
+                    self._seq = changes[-1].seq
+                if len(changes) < _SYNC_BATCH:
+                    break
+        self._synced_at = time.monotonic()
+        self._report()
+
+    def _report(self):
+        current = self._filter
+        if current is not None:
+            FILTER_BYTES.set(current.memory_bytes)
+            FILTER_ITEMS.set(current.items)
+            FILTER_FP_RATE.set(current.estimated_fp_rate)
+
+    def clear(self):
+        with self._lock:
+            self._filter = None
+            self._seq = None
+
+    def start(self):
+        if self.fp_rate <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='username-filter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''Para el hilo. Una construcción en curso se abandona al terminar su lote'''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        rebuild_at = 0.0
+        while not self._stop.is_set():
+            current = self._filter
+            try:
+                if time.monotonic() >= rebuild_at or (current is not None and current.items > current.capacity):
+                    if self.rebuild(self._stop):
+                        rebuild_at = time.monotonic() + self.rebuild_interval if self.rebuild_interval > 0 \
+                            else math.inf
+                elif self.sync_interval > 0:
+                    self.sync()
+            except Exception:
+                # p.ej. la BD no responde: se reintenta en la siguiente vuelta
+                logger.exception('Error actualizando el filtro de usernames')
+            self._stop.wait(self.sync_interval if self.sync_interval > 0 else _RETRY_INTERVAL)
+
+
+@on_changes_committed
+def _apply_changes(changes:list[dict]):
+    for change in changes:
+        if change['entity'] == 'user' and change['op'] in ('create', 'update') and change['data']:
+            username_filter.add(change['data']['username'])
+
+
+username_filter = UsernameFilter(shard_engines or [engine], config.USERNAME_FILTER_FP_RATE,
+                                 config.USERNAME_FILTER_SYNC_INTERVAL, config.USERNAME_FILTER_REBUILD_INTERVAL)